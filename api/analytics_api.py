@@ -0,0 +1,43 @@
+from fastapi import Depends, HTTPException, APIRouter
+from crud.crud import *
+from models import *
+from database.connection import get_db
+from api.dispatch import db_route
+from typing import Literal
+import logging
+
+router = APIRouter()
+
+@router.get("/analytics/quotes", response_model = QuoteSummary)
+@db_route("query")
+def quote_summary_api(history: bool = False, currency: Literal["usd", "rmb"] = "usd",
+                      db: tuple = Depends(get_db)):
+    """
+    Quote statistics per customer (min / max / avg / median / p10 / p90) and margins over the
+    products' price_usd (currency=rmb: price_rmb). Current quotes unless history=true.
+    Cached until the next quote write.
+    """
+    conn, cursor = db
+    try:
+        return quote_summary(conn, cursor, history = history, currency = currency, cache = quote_analytics)
+    except Exception as e:
+        logging.error(f"Failed to compute quote analytics: {e}", exc_info = True)
+        raise HTTPException(status_code=500, detail=f"Failed to compute quote analytics: {e}")
+
+@router.get("/analytics/quotes/drift", response_model = QuoteDrift)
+@db_route("query")
+def quote_drift_api(bucket: Literal["day", "week", "month"] = "month", customer_id: int = None,
+                    since: str = None, until: str = None, db: tuple = Depends(get_db)):
+    """
+    Price drift per period: quotes in [since, until) relative to the first quote for the same
+    product and customer. Cached until the next quote write.
+    """
+    conn, cursor = db
+    try:
+        return quote_drift(conn, cursor, bucket = bucket, customer_id = customer_id, since = since, until = until,
+                           cache = quote_analytics)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Failed to compute quote drift: {e}", exc_info = True)
+        raise HTTPException(status_code=500, detail=f"Failed to compute quote drift: {e}")
@@ -1,17 +1,50 @@
-from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi import FastAPI, Depends, HTTPException, Request, Query
+from fastapi.responses import JSONResponse, Response
 from fastapi.exceptions import RequestValidationError
 from fastapi.exception_handlers import request_validation_exception_handler
 from crud.crud import *
 from models import *
-from database.connection import get_db
+from database.connection import get_db, init_database
+from api.dispatch import db_route
+from api.metrics import MetricsMiddleware, request_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from database.pool import pool_stats, close_pools
+from database.executor import executor_stats, shutdown_executors, ExecutorSaturated
+from database.writer import writer_stats, stop_writers
+from database.instrument import query_stats
+from typing import Literal
+from database.storage import start_checkpointer
+from database.maintenance import run_maintenance, maintenance_stats, database_stats, MaintenanceRunning
+from contextlib import asynccontextmanager
+import config
 from api.product_api import router as product_router
 from api.customer_api import router as customer_router
 from api.tag_api import router as tag_router
 from api.quote_api import router as quote_router
 from api.image_api import router as image_router
+from api.change_api import router as change_router
+from api.lock_api import router as lock_router
+from api.analytics_api import router as analytics_router
+from crud.lock_crud import start_lock_reaper, lock_metrics, count_active_locks
+from crud.maintenance_crud import start_orphan_cleaner, cleanup_metrics
 import logging
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Apply the storage profile / schema once, then keep the WAL checkpointed, expired
+    # locks cleared and orphaned rows removed in the background
+    init_database(config.DB_NAME)
+    tasks = [start_checkpointer(config.DB_NAME), start_lock_reaper(config.DB_NAME),
+             start_orphan_cleaner(config.DB_NAME)]
+    yield
+    for task in tasks:
+        if task:
+            task.stop()
+    stop_writers()
+    shutdown_executors()
+    close_pools()
+
+app = FastAPI(lifespan = lifespan)
+app.add_middleware(MetricsMiddleware)
 
 # Logging
 
@@ -31,6 +64,9 @@ app.include_router(customer_router)
 app.include_router(tag_router)
 app.include_router(quote_router)
 app.include_router(image_router)
+app.include_router(change_router)
+app.include_router(lock_router)
+app.include_router(analytics_router)
 
 
 # Misc routes
@@ -45,23 +81,78 @@ def raise_404_if_not_empty(result, msg = "Resource not found"):
         raise HTTPException(status_code=404, detail = msg)
 
 
-@app.patch("/products/{product_id}/lock", response_model = Product)
-def set_lock_status(product_id: int, lock: LockStatus, user: str, db: tuple = Depends(get_db)):
+@app.get("/metrics", include_in_schema = False)
+def get_metrics():
+    """Request latency / status and pool, executor, writer, cache and lock gauges, for Prometheus"""
+    return Response(request_metrics.render(), media_type = METRICS_CONTENT_TYPE)
+
+@app.get("/debug/pool")
+def get_pool_stats():
+    return pool_stats()
+
+@app.get("/debug/executor")
+def get_executor_stats():
+    return executor_stats()
+
+@app.get("/debug/writer")
+def get_writer_stats():
+    return writer_stats()
+
+@app.get("/debug/queries")
+def get_query_stats(sort: Literal["time", "calls", "avg", "max", "rows"] = "time",
+                    limit: int = Query(50, ge = 1, le = 1000)):
+    """Statement timings by normalized SQL, and the latest slow queries with their plans (PM_QUERY_STATS=1)"""
+    return query_stats.snapshot(sort = sort, limit = limit)
+
+@app.delete("/debug/queries", status_code = 204)
+def reset_query_stats():
+    query_stats.reset()
+
+@app.get("/debug/cache")
+def get_cache_stats():
+    return product_cache.stats()
+
+@app.get("/debug/customers")
+def get_customer_cache_stats():
+    return customer_name_cache.stats()
+
+@app.get("/debug/analytics")
+def get_analytics_cache_stats():
+    return quote_analytics.stats()
+
+@app.get("/debug/locks")
+@db_route("read")
+def get_lock_stats(db: tuple = Depends(get_db)):
+    conn, cursor = db
+    return {**lock_metrics.stats(), "active": count_active_locks(conn, cursor)}
+
+@app.get("/debug/maintenance")
+@db_route("read")
+def get_maintenance_stats(db: tuple = Depends(get_db)):
+    """Database size and free pages now, orphan cleanup totals, and the last maintenance run"""
+    conn, cursor = db
+    return {"database": database_stats(conn), "cleanup": cleanup_metrics.stats(), **maintenance_stats()}
+
+@app.post("/admin/maintenance")
+@db_route("write", group_commit = False)
+def run_maintenance_api(analyze: bool = True, vacuum: bool = True, max_pages: int = Query(None, ge = 1),
+                        db: tuple = Depends(get_db)):
+    """
+    ANALYZE, PRAGMA optimize and incremental vacuum in small steps (see database/maintenance.py);
+    returns database size, free pages and probe query latency before and after. 409 while a run is going.
+    """
     conn, cursor = db
     try:
-        if lock.locked == True:
-            locked_product(conn, cursor, product_id, user)
-        else:
-            unlock_product(conn, cursor, product_id)
-        result = format_product(conn, cursor, product_id)
-        raise_404_if_not_empty(result, msg = "Lock not found")
-        conn.commit()
-        logging.info(f"Set lock status for product ID: {product_id}")
-        return result
-    except Exception as e:
-        logging.error(f"Failed to update lock status: {e}", exc_info = True)
-        raise HTTPException(status_code=500, detail=f"Failed to update lock status: {e}")
+        return run_maintenance(conn, analyze_tables = analyze, vacuum = vacuum, max_pages = max_pages)
+    except MaintenanceRunning as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
 
+@app.exception_handler(ExecutorSaturated)
+async def executor_saturated_handler(request: Request, exc: ExecutorSaturated):
+    # Back-pressure: shed load instead of queueing without bound
+    logging.warning(str(exc))
+    return JSONResponse(status_code = 503, content = {"detail": str(exc)}, headers = {"Retry-After": "1"})
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
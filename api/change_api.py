@@ -0,0 +1,34 @@
+from fastapi import Depends, HTTPException, APIRouter, Query
+from crud.crud import *
+from models import *
+from database.connection import get_db
+from api.dispatch import db_route
+import logging
+import config
+
+router = APIRouter()
+
+@router.get("/changes", response_model = ChangeFeed)
+@db_route("query")
+def list_changes_api(since: str = None,
+                     limit: int = Query(config.MAX_PAGE_SIZE, ge = 1, le = config.MAX_PAGE_SIZE),
+                     hydrate: bool = False,
+                     db: tuple = Depends(get_db)):
+    """
+    Delta sync: ids of products upserted or deleted after the since token (omit it for everything).
+    Repeat with next_token while has_more is true, then store next_token for the next refresh.
+    hydrate=true also returns the upserted products. 410 means the token is too old: resync fully.
+    """
+    conn, cursor = db
+    try:
+        feed = list_changes(conn, cursor, since = since, limit = limit)
+        if hydrate:
+            feed["products"] = format_products(conn, cursor, feed["upserted"], cache = product_cache)
+        return feed
+    except ChangesPruned as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Failed to list changes: {e}", exc_info = True)
+        raise HTTPException(status_code=500, detail=f"Failed to list changes: {e}")
@@ -2,19 +2,26 @@ from fastapi import Depends, HTTPException, APIRouter
 from crud.crud import *
 from models import *
 from database.connection import get_db
+from api.dispatch import db_route
+from api.etag import expected_version, precondition_failed
 import logging
 import sqlite3
 
 router = APIRouter()
 
 @router.post("/products/{product_id}/customers/", response_model = Product, status_code = 201)
-def create_customers_endpoint(customers:CustomerList, product_id:int, db = Depends(get_db)):
+@db_route("write")
+def create_customers_endpoint(customers:CustomerList, product_id:int,
+                              version: Optional[int] = Depends(expected_version), db = Depends(get_db)):
     conn, cursor = db
     try:
+        check_version(conn, cursor, product_id, version)
         add_customer(conn, cursor, product_id, customers.customers)
         conn.commit()
         logging.info(f"Customer created: {customers.customers}")
         return format_product (conn, cursor, product_id)
+    except VersionConflict as e:
+        raise precondition_failed(e)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
@@ -22,12 +29,17 @@ def create_customers_endpoint(customers:CustomerList, product_id:int, db = Depen
         raise HTTPException(status_code=500, detail=f"Failed to add customer: {e}")
 
 @router.delete("/products/{product_id}/customers/{customer_id}", status_code=204)
-def delete_customer_from_product_api(product_id: int, customer_id: int, db: tuple = Depends(get_db)):
+@db_route("write")
+def delete_customer_from_product_api(product_id: int, customer_id: int,
+                                     version: Optional[int] = Depends(expected_version), db: tuple = Depends(get_db)):
     conn, cursor = db
     try:
+        check_version(conn, cursor, product_id, version)
         delete_customer_from_product(conn, cursor, product_id, customer_id)
         conn.commit()
         logging.info(f"Deleted customer with ID: {customer_id} from product: {product_id}")
+    except VersionConflict as e:
+        raise precondition_failed(e)
     except ValueError as e:
         print("Caught ValueError:", str(e))
         raise HTTPException(status_code=404, detail=str(e))
@@ -37,6 +49,7 @@ def delete_customer_from_product_api(product_id: int, customer_id: int, db: tupl
 
 
 @router.patch("/customers/{customer_id}", response_model = CustomerOut)
+@db_route("write")
 def edit_customer_api(customer_id: int, new_name: CustomerUpdate, db: tuple = Depends(get_db)):
     conn, cursor = db
     try:
@@ -52,6 +65,7 @@ def edit_customer_api(customer_id: int, new_name: CustomerUpdate, db: tuple = De
         raise HTTPException(status_code=500, detail=f"Failed to update customer: {e}")
 
 @router.get("/customers", response_model = List[CustomerOut])
+@db_route("query")
 def list_customer_api(db: tuple = Depends(get_db)):
     conn, cursor = db
     try:
@@ -0,0 +1,74 @@
+import time
+import inspect
+import functools
+from fastapi import Depends
+import config
+from database.connection import get_db_factory
+from database.executor import get_executor
+from database.writer import get_db_writer
+from api.metrics import current_timing
+
+"""
+Async execution mode for DB-bound routes. db_route(lane) turns a sync handler taking
+db = Depends(get_db) into an async handler whose body, connection checkout included, runs on
+the lane's DBExecutor (database/executor.py) instead of Starlette's shared threadpool.
+Write routes are instead queued on the single writer (database/writer.py), which runs them on
+its own connection and group-commits them. Handlers keep their sync code; with PM_ASYNC_DB=0
+they are left as they are. Each routed request reports its queue wait and handler time to
+the request metrics (api/metrics.py).
+"""
+
+
+async def _timed(submit):
+    # await submit(work), where work(func, *args, **kwargs) runs func on the worker / writer;
+    # records the handler's time there and the wait for it on the request's metrics
+    timing = current_timing()
+    worked = 0.0
+
+    def work(func, *args, **kwargs):
+        nonlocal worked
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            worked = time.perf_counter() - started
+
+    submitted = time.perf_counter()
+    try:
+        return await submit(work)
+    finally:
+        if timing is not None:
+            timing.handler_done = time.perf_counter()
+            timing.db = worked
+            timing.queue = max(timing.handler_done - submitted - worked, 0.0)
+
+def db_route(lane, group_commit = True):
+    # group_commit=False keeps a write route on the write lane's pooled connections, for handlers
+    # that commit mid-way; handlers that may wait (lock acquisition with wait=) use the lock lane
+    def decorate(handler):
+        if not config.ASYNC_DB:
+            return handler
+        signature = inspect.signature(handler)
+        queued = lane == "write" and group_commit and config.WRITER_ENABLED
+        # The connection is opened on the worker, so a request waiting in the queue holds none
+        source = Depends(get_db_writer) if queued else Depends(get_db_factory)
+        parameters = [param.replace(default = source) if param.name == "db" else param
+                      for param in signature.parameters.values()]
+
+        if queued:
+            @functools.wraps(handler)
+            async def route(*args, db, **kwargs):
+                return await _timed(
+                    lambda work: db.run(lambda conn, cursor: work(handler, *args, db = (conn, cursor), **kwargs)))
+        else:
+            def call(*args, db, **kwargs):
+                with db() as session:
+                    return handler(*args, db = session, **kwargs)
+
+            @functools.wraps(handler)
+            async def route(*args, **kwargs):
+                return await _timed(lambda work: get_executor(lane).run(work, call, *args, **kwargs))
+
+        route.__signature__ = signature.replace(parameters = parameters)
+        return route
+    return decorate
@@ -0,0 +1,67 @@
+import re
+import hashlib
+from fastapi import Response, HTTPException, Header, Query
+
+"""
+ETag helpers for conditional requests. A product's ETag is derived from its version column
+(bumped by triggers on the product row and every child row), so it can be checked
+without hydrating the product; a list's ETag hashes the (id, version) pairs it contains.
+Writes take the same version back, from If-Match or expected_version, for optimistic concurrency.
+"""
+
+
+def product_etag(product_id, version):
+    return f'"p{product_id}-v{version}"'
+
+def collection_etag(versions, *parts):
+    # versions: [(id, version), ...] in response order; parts: anything else that shapes the body
+    digest = hashlib.sha1(repr((list(versions), parts)).encode()).hexdigest()[:20]
+    return f'"c{digest}"'
+
+def etag_matches(if_none_match, etag):
+    # If-None-Match may hold several (possibly weak) tags, or *
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in candidates)
+
+def not_modified(etag, headers = None):
+    return Response(status_code = 304, headers = {"ETag": etag, **(headers or {})})
+
+# Writes
+
+def single_version(*versions):
+    # The one expected version given (If-Match, ?expected_version=, body field), or None
+    given = {v for v in versions if v is not None}
+    if len(given) > 1:
+        raise HTTPException(status_code = 400, detail = "If-Match and expected_version disagree")
+    return given.pop() if given else None
+
+def if_match_version(if_match, product_id):
+    # Version named by an If-Match header holding the product's ETag; None for no header or *.
+    # Weak or foreign tags can never match (strong comparison), so they fail the precondition
+    if not if_match or if_match.strip() == "*":
+        return None
+    versions = {int(m.group(1)) for tag in if_match.split(",")
+                if (m := re.fullmatch(rf'"p{product_id}-v(\d+)"', tag.strip()))}
+    if len(versions) != 1:
+        raise HTTPException(status_code = 412, detail = "If-Match does not name a version of this product")
+    return versions.pop()
+
+def expected_version(product_id: int, if_match: str = Header(None), expected_version: int = Query(None)):
+    # Dependency for writes to /products/{product_id}/...: the version the client's change is based
+    # on, or None for an unconditional write
+    return single_version(if_match_version(if_match, product_id), expected_version)
+
+def deferred_expected_version(if_match: str = Header(None), expected_version: int = Query(None)):
+    # Dependency for writes whose product is only known once the row is read (PATCH /quotes/{quote_id}):
+    # returns version(product_id), which reads If-Match and expected_version as expected_version does
+    return lambda product_id: single_version(if_match_version(if_match, product_id), expected_version)
+
+def precondition_failed(conflict):
+    # 412 for a VersionConflict, with the current ETag so the client can refetch and retry
+    return HTTPException(status_code = 412,
+                         detail = {"message": str(conflict), "current_version": conflict.current_version},
+                         headers = {"ETag": product_etag(conflict.product_id, conflict.current_version)})
@@ -2,19 +2,26 @@ from fastapi import Depends, HTTPException, APIRouter
 from crud.crud import *
 from models import *
 from database.connection import get_db
+from api.dispatch import db_route
+from api.etag import expected_version, precondition_failed
 import logging
 import sqlite3
 
 router = APIRouter()
 
 @router.post("/products/{product_id}/images/", response_model = Product, status_code = 201)
-def create_images_endpoint(image:ImageList, product_id:int, db = Depends(get_db)):
+@db_route("write")
+def create_images_endpoint(image:ImageList, product_id:int,
+                           version: Optional[int] = Depends(expected_version), db = Depends(get_db)):
     conn, cursor = db
     try:
+        check_version(conn, cursor, product_id, version)
         add_image(conn, cursor, product_id, image.imgs)
         conn.commit()
         logging.info(f"Image created: {image.imgs}")
         return format_product (conn, cursor, product_id)
+    except VersionConflict as e:
+        raise precondition_failed(e)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
@@ -22,12 +29,17 @@ def create_images_endpoint(image:ImageList, product_id:int, db = Depends(get_db)
         raise HTTPException(status_code=500, detail=f"Failed to add image: {e}")
 
 @router.delete("/products/{product_id}/images/{image_id}", status_code=204)
-def delete_image_api(image_id: int, db: tuple = Depends(get_db)):
+@db_route("write")
+def delete_image_api(product_id: int, image_id: int,
+                     version: Optional[int] = Depends(expected_version), db: tuple = Depends(get_db)):
     conn, cursor = db
     try:
-        delete_image(conn, cursor, image_id)
+        check_version(conn, cursor, product_id, version)
+        delete_image(conn, cursor, image_id, product_id)
         conn.commit()
         logging.info(f"Deleted image with ID: {image_id}")
+    except VersionConflict as e:
+        raise precondition_failed(e)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
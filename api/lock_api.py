@@ -0,0 +1,75 @@
+from fastapi import Depends, HTTPException, APIRouter, Query
+from crud.crud import *
+from crud.lock_crud import acquire_lock, acquire_locks, renew_lock, release_locks, LockConflict
+from models import *
+from database.connection import get_db
+from api.dispatch import db_route
+import logging
+import config
+
+router = APIRouter()
+
+def raise_409(e: LockConflict):
+    raise HTTPException(status_code=409, detail={"message": str(e),
+                                                 "holders": {str(pid): user for pid, user in e.holders.items()}})
+
+@router.patch("/products/{product_id}/lock", response_model = Product)
+@db_route("lock")
+def set_lock_status(product_id: int, lock: LockStatus, user: str,
+                    wait: float = Query(0, ge = 0, le = config.LOCK_MAX_WAIT),
+                    db: tuple = Depends(get_db)):
+    """
+    locked=true takes (or renews) a lease lock for user, expiring after PM_LOCK_TTL seconds;
+    locked=false releases it. 409 if another user holds the lock; wait= retries for that many seconds, on the lock lane.
+    """
+    conn, cursor = db
+    try:
+        if lock.locked:
+            acquire_lock(conn, cursor, product_id, user, wait = wait)
+        else:
+            release_locks(conn, cursor, [product_id], user)
+        logging.info(f"Set lock status for product ID: {product_id}")
+        return format_product(conn, cursor, product_id)
+    except LockConflict as e:
+        raise_409(e)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logging.error(f"Failed to update lock status: {e}", exc_info = True)
+        raise HTTPException(status_code=500, detail=f"Failed to update lock status: {e}")
+
+@router.post("/products/{product_id}/lock/renew", response_model = Product)
+@db_route("lock")
+def renew_lock_api(product_id: int, user: str, db: tuple = Depends(get_db)):
+    conn, cursor = db
+    try:
+        renew_lock(conn, cursor, product_id, user)
+        return format_product(conn, cursor, product_id)
+    except LockConflict as e:
+        raise_409(e)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logging.error(f"Failed to renew lock: {e}", exc_info = True)
+        raise HTTPException(status_code=500, detail=f"Failed to renew lock: {e}")
+
+@router.post("/locks", response_model = BulkLockResult)
+@db_route("lock")
+def bulk_lock_api(request: BulkLock, db: tuple = Depends(get_db)):
+    """Lock (or release) every listed product for user, all or nothing; 409 names the holders."""
+    conn, cursor = db
+    try:
+        if request.locked:
+            product_ids = acquire_locks(conn, cursor, request.product_ids, request.user,
+                                        wait = min(request.wait, config.LOCK_MAX_WAIT))
+        else:
+            product_ids = release_locks(conn, cursor, request.product_ids, request.user)
+        logging.info(f"{'Locked' if request.locked else 'Released'} {len(product_ids)} products for {request.user}")
+        return {"product_ids": product_ids, "locked_by": request.user if request.locked else None}
+    except LockConflict as e:
+        raise_409(e)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logging.error(f"Failed to update locks: {e}", exc_info = True)
+        raise HTTPException(status_code=500, detail=f"Failed to update locks: {e}")
@@ -0,0 +1,240 @@
+import time
+import bisect
+import threading
+import contextvars
+import config
+from database.pool import pool_stats
+from database.executor import executor_stats
+from database.writer import writer_stats
+from crud.cache import product_cache
+from crud.lock_crud import lock_metrics
+
+"""
+Request-level metrics in Prometheus text exposition format, served at GET /metrics.
+MetricsMiddleware times every HTTP request by route template (not raw path) and counts
+responses by status; routes going through db_route (api/dispatch.py) also report how long
+they waited for a DB worker / the writer, how long the handler ran there (connection checkout
+and queries included) and how long FastAPI then took to validate and serialize the result.
+Pool, executor, writer, cache and lock gauges are read from their stats() at scrape time.
+"""
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNMATCHED = "<unmatched>"  # 404s for unknown paths share one label instead of one per path
+
+
+class RequestTiming:
+    # Per-request timings filled in by db_route, read by the middleware when the request ends
+    __slots__ = ("db", "queue", "handler_done", "response_start")
+
+    def __init__(self):
+        self.db = None
+        self.queue = None
+        self.handler_done = None
+        self.response_start = None
+
+_timing = contextvars.ContextVar("request_timing", default = None)
+
+def current_timing():
+    # RequestTiming of the request being handled, or None outside MetricsMiddleware
+    return _timing.get()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    # Cumulative-bucket histogram per label values; callers serialize access
+    def __init__(self, name, help, label_names, buckets = BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}   # label values -> [bucket counts (last is +Inf), sum]
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.label_names + ('le',), labels + (_number(bound),))} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+    def clear(self):
+        self._series.clear()
+
+
+def _family(name, kind, help, samples):
+    # samples: [(label names, label values, value)]
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    lines.extend(f"{name}{_labels(names, values)} {_number(value)}" for names, values, value in samples)
+    return lines
+
+
+class RequestMetrics:
+    """Per-route request metrics; thread-safe. render() returns the whole /metrics page."""
+
+    def __init__(self, enabled = config.METRICS_ENABLED):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._responses = {}   # (method, route, status) -> count
+        route = ("method", "route")
+        self._duration = Histogram("pm_http_request_duration_seconds",
+                                   "Time from request start to the end of the response body.", route)
+        self._queue = Histogram("pm_http_db_queue_seconds",
+                                "Time a request waited for a DB worker, or for the writer and its group commit.", route)
+        self._db = Histogram("pm_http_db_seconds",
+                             "Time the route handler ran on the DB worker / writer, queries included.", route)
+        self._serialize = Histogram("pm_http_serialize_seconds",
+                                    "Time from the handler's result to the response start (validation, "
+                                    "serialization).", route)
+
+    def started(self):
+        with self._lock:
+            self._in_flight += 1
+
+    def finished(self, method, route, status, seconds, timing):
+        labels = (method, route)
+        with self._lock:
+            self._in_flight -= 1
+            key = (method, route, str(status))
+            self._responses[key] = self._responses.get(key, 0) + 1
+            self._duration.observe(labels, seconds)
+            if timing.db is not None:
+                self._db.observe(labels, timing.db)
+                self._queue.observe(labels, timing.queue)
+                if timing.response_start is not None:
+                    self._serialize.observe(labels, max(timing.response_start - timing.handler_done, 0.0))
+
+    def reset(self):
+        with self._lock:
+            self._responses.clear()
+            for histogram in (self._duration, self._queue, self._db, self._serialize):
+                histogram.clear()
+
+    def render(self):
+        with self._lock:
+            lines = _family("pm_http_requests_in_flight", "gauge", "Requests being handled.",
+                            [((), (), self._in_flight)])
+            lines += _family("pm_http_responses_total", "counter", "Responses by route and status code.",
+                             [(("method", "route", "status"), key, count)
+                              for key, count in sorted(self._responses.items())])
+            for histogram in (self._duration, self._queue, self._db, self._serialize):
+                lines += histogram.render()
+        lines += _resource_gauges()
+        return "\n".join(lines) + "\n"
+
+request_metrics = RequestMetrics()
+
+
+def _resource_gauges():
+    lines = []
+    pools = pool_stats()
+    db = ("db",)
+    for name, key, kind, help in (
+            ("pm_db_pool_size", "size", "gauge", "Open pooled connections."),
+            ("pm_db_pool_in_use", "in_use", "gauge", "Pooled connections checked out."),
+            ("pm_db_pool_idle", "idle", "gauge", "Idle pooled connections."),
+            ("pm_db_pool_max_size", "max_size", "gauge", "Pool size limit."),
+            ("pm_db_pool_checkouts_total", "checkouts", "counter", "Connection checkouts."),
+            ("pm_db_pool_waits_total", "waits", "counter", "Checkouts that had to wait for a connection."),
+            ("pm_db_pool_wait_seconds_total", "wait_time", "counter", "Time spent waiting for a connection."),
+            ("pm_db_pool_timeouts_total", "timeouts", "counter", "Checkouts that timed out.")):
+        lines += _family(name, kind, help, [(db, (pool["db_name"],), pool[key]) for pool in pools])
+
+    executors = executor_stats()
+    lane = ("lane",)
+    for name, key, kind, help in (
+            ("pm_db_executor_workers", "workers", "gauge", "Worker threads per DB lane."),
+            ("pm_db_executor_active", "active", "gauge", "Calls running on a DB lane."),
+            ("pm_db_executor_queued", "queued", "gauge", "Calls waiting for a DB lane worker."),
+            ("pm_db_executor_max_queue", "max_queue", "gauge", "Queue limit before a DB lane sheds load."),
+            ("pm_db_executor_completed_total", "completed", "counter", "Calls completed per DB lane."),
+            ("pm_db_executor_failed_total", "failed", "counter", "Calls that raised per DB lane."),
+            ("pm_db_executor_rejected_total", "rejected", "counter", "Calls rejected with 503 per DB lane.")):
+        lines += _family(name, kind, help, [(lane, (lane_name,), stats[key]) for lane_name, stats in executors.items()])
+
+    writers = writer_stats()
+    for name, key, kind, help in (
+            ("pm_db_writer_queued", "queued", "gauge", "Write jobs waiting for the writer."),
+            ("pm_db_writer_jobs_total", "jobs", "counter", "Write jobs run."),
+            ("pm_db_writer_failed_total", "failed", "counter", "Write jobs that raised."),
+            ("pm_db_writer_rejected_total", "rejected", "counter", "Write jobs rejected with 503."),
+            ("pm_db_writer_batches_total", "batches", "counter", "Group-commit transactions."),
+            ("pm_db_writer_transaction_seconds_total", "transaction_time", "counter",
+             "Time spent in group-commit transactions.")):
+        lines += _family(name, kind, help, [(db, (db_name,), stats[key]) for db_name, stats in writers.items()])
+
+    cache = product_cache.stats()
+    for name, key, kind, help in (
+            ("pm_cache_entries", "entries", "gauge", "Products in the hydrated product cache."),
+            ("pm_cache_bytes", "bytes", "gauge", "Approximate size of the product cache."),
+            ("pm_cache_hits_total", "hits", "counter", "Product cache hits."),
+            ("pm_cache_misses_total", "misses", "counter", "Product cache misses."),
+            ("pm_cache_evictions_total", "evictions", "counter", "Product cache evictions."),
+            ("pm_cache_invalidations_total", "invalidations", "counter", "Product cache invalidations.")):
+        lines += _family(name, kind, help, [((), (), cache[key])])
+
+    locks = lock_metrics.stats()
+    for name, key, help in (
+            ("pm_locks_acquired_total", "acquired", "Product locks acquired."),
+            ("pm_locks_conflicts_total", "conflicts", "Lock requests refused because another user holds the lock."),
+            ("pm_locks_timeouts_total", "timeouts", "Lock waits that timed out."),
+            ("pm_locks_reaped_total", "reaped", "Expired locks cleared by the reaper.")):
+        lines += _family(name, "counter", help, [((), (), locks[key])])
+    return lines
+
+
+class MetricsMiddleware:
+    # Pure ASGI middleware (no BaseHTTPMiddleware), so streaming and contextvars are untouched
+
+    def __init__(self, app, metrics = request_metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.metrics.enabled:
+            return await self.app(scope, receive, send)
+
+        timing = RequestTiming()
+        token = _timing.set(timing)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timing.response_start = time.perf_counter()
+            await send(message)
+
+        self.metrics.started()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _timing.reset(token)
+            route = getattr(scope.get("route"), "path", None) or UNMATCHED
+            self.metrics.finished(scope["method"], route, status, time.perf_counter() - started, timing)
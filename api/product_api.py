@@ -1,13 +1,28 @@
-from fastapi import Depends, HTTPException, APIRouter
+from fastapi import Depends, HTTPException, APIRouter, Query, Response, Request, Header
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from typing import Literal
 from crud.crud import *
 from models import *
-from database.connection import get_db
+from database.connection import get_db, get_db_factory
+from api.dispatch import db_route
+from database.executor import get_executor
+from database.writer import get_db_writer
+from crud.utils import decode_cursor
+from api.etag import product_etag, collection_etag, etag_matches, not_modified
+from api.etag import single_version, if_match_version, precondition_failed
 import logging
 import sqlite3
+import config
+import csv
+import io
+import json
 
 router = APIRouter()
 
 @router.post("/products/", response_model=Product, status_code = 201)
+@db_route("write")
 def create_product_endpoint(product: ProductCreate, db = Depends(get_db)):
     """404 if not found, 409 on duplication"""
     conn, cursor = db
@@ -28,7 +43,120 @@ def create_product_endpoint(product: ProductCreate, db = Depends(get_db)):
         logging.error(f"Failed to add product: {e}", exc_info = True)
         raise HTTPException(status_code=500, detail=f"Failed to add product: {e}")
 
+# Bulk import
+
+BULK_INT_FIELDS = {"barcode", "pcs_innerbox", "pcs_ctn"}
+BULK_FLOAT_FIELDS = {"weight", "price_usd", "price_rmb"}
+BULK_LIST_FIELDS = {"customers", "imgs", "tags"}
+
+def csv_row_to_product(row):
+    # CSV cells are strings: numbers are converted, lists are "|"-separated, quote is a JSON object
+    product = {}
+    for key, value in row.items():
+        if key is None or value is None or value == "":
+            continue
+        if key in BULK_INT_FIELDS:
+            value = int(value)
+        elif key in BULK_FLOAT_FIELDS:
+            value = float(value)
+        elif key in BULK_LIST_FIELDS:
+            value = [v.strip() for v in value.split("|") if v.strip()]
+        elif key == "quote":
+            value = json.loads(value)
+        product[key] = value
+    return product
+
+def parse_bulk_rows(content_type, body, csv_row = csv_row_to_product):
+    # Yields (raw row or None, parse error or None) for a JSON array, NDJSON lines or CSV with a header;
+    # csv_row converts a CSV row (a dict of strings) into the row's JSON shape
+    text = body.decode("utf-8-sig")
+    if "csv" in content_type:
+        for row in csv.DictReader(io.StringIO(text)):
+            try:
+                yield csv_row(row), None
+            except ValueError as e:
+                yield row, str(e)
+    elif "ndjson" in content_type:
+        for line in text.splitlines():
+            if line.strip():
+                try:
+                    yield json.loads(line), None
+                except ValueError as e:
+                    yield None, f"Invalid JSON: {e}"
+    else:
+        rows = json.loads(text)
+        if not isinstance(rows, list):
+            raise ValueError("Expected a JSON array")
+        for row in rows:
+            yield row, None
+
+def validate_bulk_rows(parsed, model = ProductCreate):
+    # Validate every row as model; returns (valid rows, original indexes, row errors)
+    products, indexes, errors = [], [], []
+    for index, (row, error) in enumerate(parsed):
+        ref_num = row.get("ref_num") if isinstance(row, dict) else None
+        if error is None:
+            try:
+                products.append(model.model_validate(row))
+                indexes.append(index)
+                continue
+            except ValidationError as e:
+                error = "; ".join(f"{'.'.join(str(l) for l in err['loc'])}: {err['msg']}" for err in e.errors())
+        errors.append({"index": index, "ref_num": ref_num if isinstance(ref_num, str) else None, "error": error})
+    return products, indexes, errors
+
+async def run_bulk_import(bulk, rows, chunk_size, db, writer, **kwargs):
+    # Runs bulk(conn, cursor, rows, **kwargs), i.e. add_products_bulk or add_quotes_bulk. With the
+    # single writer every chunk is one writer job, so an import queues behind request writes instead
+    # of holding the write lock against the writer; otherwise it runs on the write lane
+    if not config.WRITER_ENABLED:
+        def run_all():
+            with db() as (conn, cursor):
+                return bulk(conn, cursor, rows, chunk_size = chunk_size, **kwargs)
+        run = get_executor("write").run if config.ASYNC_DB else run_in_threadpool
+        return await run(run_all)
+    result = None
+    for start in range(0, max(len(rows), 1), chunk_size):
+        part = await writer.run(lambda conn, cursor, start = start: bulk(
+            conn, cursor, rows[start:start + chunk_size], chunk_size = chunk_size, start_index = start, **kwargs))
+        if result is None:
+            result = part
+        else:
+            result["created"] += part["created"]
+            result["errors"].extend(part["errors"])
+    return result
+
+@router.post("/products/bulk", response_model = BulkResult)
+async def create_products_bulk_endpoint(request: Request, db = Depends(get_db_factory), writer = Depends(get_db_writer)):
+    """
+    Import many products at once from a JSON array of ProductCreate, NDJSON (application/x-ndjson)
+    or CSV (text/csv). Rows are inserted in chunked transactions; invalid or conflicting rows are
+    reported in errors by their position in the upload and do not abort the rest.
+    """
+    body = await request.body()
+    try:
+        products, indexes, errors = validate_bulk_rows(
+            list(parse_bulk_rows(request.headers.get("content-type", ""), body)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Could not parse upload: {e}")
+    try:
+        result = await run_bulk_import(add_products_bulk, products, SQL_CHUNK_SIZE, db, writer)
+    except sqlite3.OperationalError as e:
+        logging.error(f"Database operation error: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="A database operation failed.")
+    except Exception as e:
+        logging.error(f"Failed to bulk add products: {e}", exc_info = True)
+        raise HTTPException(status_code=500, detail=f"Failed to bulk add products: {e}")
+
+    # Map positions within the validated list back to positions in the upload
+    for entry in result["created"] + result["errors"]:
+        entry["index"] = indexes[entry["index"]]
+    result["errors"] = sorted(errors + result["errors"], key = lambda e: e["index"])
+    logging.info(f"Bulk import: {len(result['created'])} created, {len(result['errors'])} rejected")
+    return result
+
 @router.delete("/products/{product_id}", status_code=204)
+@db_route("write")
 def delete_product_api(product_id: int, db: tuple = Depends(get_db)):
     conn, cursor = db
     try:
@@ -45,18 +173,27 @@ def delete_product_api(product_id: int, db: tuple = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Failed to delete product: {e}")
     
 @router.put("/products/{product_id}", response_model = Product)
-def edit_product_api(product_id: int, updates: ProductUpdate, db: tuple = Depends(get_db)):
+@db_route("write")
+def edit_product_api(product_id: int, updates: ProductUpdate, response: Response,
+                     if_match: str = Header(None), db: tuple = Depends(get_db)):
     """
     This endpoint only updates fields in the product_manager table.
     Nested fields like customers, tags, quotes, and imgs should be edited via their respective endpoints.
+    Send If-Match: <ETag> (or expected_version) to have the edit rejected with 412 if the product
+    changed since it was read.
     """
     conn, cursor = db
+    updates = updates.model_dump(exclude_unset = True)
+    version = single_version(if_match_version(if_match, product_id), updates.pop("expected_version", None))
     try:
-        edit_product(conn, cursor, product_id, **updates.model_dump(exclude_unset = True))
+        edit_product(conn, cursor, product_id, expected_version = version, **updates)
         result = format_product(conn, cursor, product_id)
         conn.commit()
+        response.headers["ETag"] = product_etag(product_id, result["version"])
         logging.info(f"Edited product with ID: {product_id}")
         return result
+    except VersionConflict as e:
+        raise precondition_failed(e)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except sqlite3.OperationalError as e:
@@ -66,16 +203,110 @@ def edit_product_api(product_id: int, updates: ProductUpdate, db: tuple = Depend
         logging.error(f"Failed to update product: {e}", exc_info = True)
         raise HTTPException(status_code=500, detail=f"Failed to update product: {e}")
 
+def validate_cursor(after):
+    if after:
+        try:
+            decode_cursor(after)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/products", response_model = ProductPage)
+@db_route("query")
+def list_products_api(response: Response,
+                      after: str = None,
+                      limit: int = Query(config.PAGE_SIZE, ge = 1, le = config.MAX_PAGE_SIZE),
+                      order_by: Literal["id", "last_updated"] = "id",
+                      fields: str = None,
+                      if_none_match: str = Header(None),
+                      db: tuple = Depends(get_db)):
+    """
+    Keyset-paginated catalog listing; pass next_cursor back as after= to get the next page.
+    fields=base (or a comma-separated list of base columns) skips the image/tag/customer/quote joins.
+    Sends an ETag; a matching If-None-Match gets 304 without hydrating the page.
+    """
+    conn, cursor = db
+    validate_cursor(after)
+    try:
+        if fields not in (None, "full"):
+            # Projected pages are cheap to build; tag them by their content
+            page = list_products_page(conn, cursor, after = after, limit = limit, order_by = order_by, fields = fields)
+            etag = collection_etag(page["items"], fields, page["next_cursor"])
+            if etag_matches(if_none_match, etag):
+                return not_modified(etag)
+            response.headers["ETag"] = etag
+            return page
+
+        page = list_products_page(conn, cursor, after = after, limit = limit, order_by = order_by, fields = "id")
+        product_ids = [item["id"] for item in page["items"]]
+        etag = collection_etag(product_versions(conn, cursor, product_ids), page["next_cursor"])
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        page["items"] = format_products(conn, cursor, product_ids, cache = product_cache)
+        # Tag what is actually sent, in case a write landed between the two reads
+        response.headers["ETag"] = collection_etag([(p["id"], p["version"]) for p in page["items"]],
+                                                   page["next_cursor"])
+        return page
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except sqlite3.OperationalError as e:
+        logging.error(f"Database operation error: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="A database operation failed.")
+    except Exception as e:
+        logging.error(f"Failed to list products: {e}", exc_info = True)
+        raise HTTPException(status_code=500, detail=f"Failed to list products: {e}")
+
 @router.get("/products/search", response_model = List[Product])
-def search_products_api(name: str = None,
-                        tag: str = None,
-                        customer: str = None,
+@db_route("query")
+def search_products_api(response: Response,
+                        name: str = None,
+                        tag: List[str] = Query(None),
+                        customer: List[str] = Query(None),
                         barcode: int = None,
                         ref_num: str = None,
+                        q: str = None,
+                        tag_mode: Literal["any", "all"] = "any",
+                        customer_mode: Literal["any", "all"] = "any",
+                        price_usd_min: float = None,
+                        price_usd_max: float = None,
+                        price_rmb_min: float = None,
+                        price_rmb_max: float = None,
+                        weight_min: float = None,
+                        weight_max: float = None,
+                        limit: int = Query(None, ge = 1),
+                        after: str = None,
+                        if_none_match: str = Header(None),
                         db: tuple = Depends(get_db)):
+    """
+    All filters are combined with AND into one query.
+    q: ranked full-text prefix search across name, ref_num, remarks, packing, tags and customers.
+    name: products whose name has words starting with these (ranked first), plus any other name
+    containing it as a substring.
+    tag / customer may be repeated; tag_mode / customer_mode pick whether any or all must match.
+    limit / after: page through hits in id order; the next page's cursor is sent in X-Next-Cursor.
+    Sends an ETag; a matching If-None-Match gets 304 without hydrating the results.
+    """
     conn, cursor = db
+    filters = dict(name = name, tag = tag, customer = customer, barcode = barcode, ref_num = ref_num, q = q,
+                   tag_mode = tag_mode, customer_mode = customer_mode,
+                   price_usd_min = price_usd_min, price_usd_max = price_usd_max,
+                   price_rmb_min = price_rmb_min, price_rmb_max = price_rmb_max,
+                   weight_min = weight_min, weight_max = weight_max)
+    validate_cursor(after)
     try:
-        result = search_products(conn, cursor, name, tag, customer, barcode, ref_num)
+        headers = {}
+        if limit is None and after is None:
+            product_ids = search_product_ids(conn, cursor, **filters)
+        else:
+            page = search_product_ids_page(conn, cursor, after = after, limit = limit or config.PAGE_SIZE, **filters)
+            product_ids = page["ids"]
+            if page["next_cursor"]:
+                headers["X-Next-Cursor"] = page["next_cursor"]
+        etag = collection_etag(product_versions(conn, cursor, product_ids), headers.get("X-Next-Cursor"))
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag, headers)
+        result = format_products(conn, cursor, product_ids, cache = product_cache)
+        etag = collection_etag([(p["id"], p["version"]) for p in result], headers.get("X-Next-Cursor"))
+        response.headers.update({"ETag": etag, **headers})
         logging.info(f"Search successful")
         return result
     except ValueError as e:
@@ -87,11 +318,65 @@ def search_products_api(name: str = None,
         logging.error(f"Failed to search: {e}", exc_info = True)
         raise HTTPException(status_code=500, detail=f"Failed to search: {e}")
 
+# Export
+
+EXPORT_CSV_COLUMNS = list(BASE_COLUMNS) + ["tags", "customers", "imgs", "quote"]
+
+def products_to_ndjson(products):
+    for product in products:
+        yield json.dumps(product, ensure_ascii = False) + "\n"
+
+def products_to_csv(products):
+    # Lists are flattened to "|"-separated names; quotes keep their structure as a JSON cell
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_CSV_COLUMNS)
+    for product in products:
+        row = [product[c] for c in BASE_COLUMNS]
+        row.append("|".join(t["tag_name"] for t in product["tags"]))
+        row.append("|".join(c["customer_name"] for c in product["customers"]))
+        row.append("|".join(i["img"] for i in product["imgs"]))
+        row.append(json.dumps(product["quote"], ensure_ascii = False))
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+
+@router.get("/products/export")
+def export_products_api(format: Literal["ndjson", "csv"] = "ndjson", open_db = Depends(get_db_factory)):
+    """
+    Stream the whole catalog, hydrated, as NDJSON (one product per line) or CSV.
+    Rows are read in batches from a single read transaction, so memory stays flat.
+    """
+    def stream():
+        try:
+            with open_db() as (conn, cursor):
+                products = iter_products(conn, cursor)
+                yield from (products_to_csv(products) if format == "csv" else products_to_ndjson(products))
+            logging.info(f"Exported products as {format}")
+        except Exception as e:
+            # Headers are already sent; the truncated body is the only signal the client gets
+            logging.error(f"Failed to export products: {e}", exc_info = True)
+            raise
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(stream(), media_type = media_type,
+                             headers = {"Content-Disposition": f"attachment; filename=products.{format}"})
+
 @router.get("/products/{product_id}", response_model = Product)
-def get_product_api(product_id: int, db: tuple = Depends(get_db)):
+@db_route("read")
+def get_product_api(product_id: int, response: Response, if_none_match: str = Header(None),
+                    db: tuple = Depends(get_db)):
     conn, cursor = db
     try:
-        result = format_product(conn, cursor, product_id)
+        versions = product_versions(conn, cursor, [product_id])
+        if not versions:
+            raise ValueError("Product not found")
+        etag = product_etag(*versions[0])
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        result = format_product(conn, cursor, product_id, cache = product_cache)
+        response.headers["ETag"] = product_etag(product_id, result["version"])
         logging.info(f"Searched product with ID: {product_id}")
         return result
     except ValueError as e:
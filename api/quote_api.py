@@ -1,33 +1,115 @@
-from fastapi import Depends, HTTPException, APIRouter
+from fastapi import Depends, HTTPException, APIRouter, Query, Request
 from crud.crud import *
 from models import *
-from database.connection import get_db
+from database.connection import get_db, get_db_factory
+from database.writer import get_db_writer
+from api.dispatch import db_route
+from api.etag import expected_version, deferred_expected_version, precondition_failed
+from api.product_api import parse_bulk_rows, validate_bulk_rows, run_bulk_import
+from typing import Literal
+import config
 import logging
 import sqlite3
 
 router = APIRouter()
 
 @router.post("/products/{product_id}/quotes/", response_model = Product, status_code = 201)
-def create_quotes_endpoint(quotes:QuoteDict, product_id:int, db = Depends(get_db)):
+@db_route("write")
+def create_quotes_endpoint(quotes:QuoteDict, product_id:int,
+                           version: Optional[int] = Depends(expected_version), db = Depends(get_db)):
     conn, cursor = db
     try:
+        check_version(conn, cursor, product_id, version)
         add_quote(conn, cursor, product_id, quotes.quotes)
         conn.commit()
         logging.info(f"Quote created: {quotes.quotes}")
         return format_product (conn, cursor, product_id)
+    except VersionConflict as e:
+        raise precondition_failed(e)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         logging.error(f"Failed to add quote: {e}", exc_info = True)
         raise HTTPException(status_code=500, detail=f"Failed to add quote: {e}")
 
+# Bulk ingest
+
+def csv_row_to_quote(row):
+    # CSV cells are strings; empty cells are left out and pydantic converts the numbers
+    return {key: value for key, value in row.items() if key is not None and value not in (None, "")}
+
+@router.post("/quotes/bulk", response_model = BulkQuoteResult)
+async def create_quotes_bulk_endpoint(request: Request, customer: str = None,
+                                      db = Depends(get_db_factory), writer = Depends(get_db_writer)):
+    """
+    Load a price list: a JSON array of QuoteRow, NDJSON (application/x-ndjson) or CSV (text/csv)
+    with product_id or ref_num, customer, quote and optionally remark and timestamp. customer=
+    applies to rows without one. Customer names are resolved once per chunk through the customer
+    name cache; rows naming an unknown product or customer are reported in errors by their
+    position in the upload and do not abort the rest.
+    """
+    body = await request.body()
+    try:
+        rows, indexes, errors = validate_bulk_rows(
+            list(parse_bulk_rows(request.headers.get("content-type", ""), body, csv_row = csv_row_to_quote)),
+            model = QuoteRow)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Could not parse upload: {e}")
+    try:
+        result = await run_bulk_import(add_quotes_bulk, rows, QUOTE_BULK_CHUNK_SIZE, db, writer,
+                                       customer = customer, cache = customer_name_cache)
+    except sqlite3.OperationalError as e:
+        logging.error(f"Database operation error: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="A database operation failed.")
+    except Exception as e:
+        logging.error(f"Failed to bulk add quotes: {e}", exc_info = True)
+        raise HTTPException(status_code=500, detail=f"Failed to bulk add quotes: {e}")
+
+    # Map positions within the validated list back to positions in the upload
+    for entry in result["errors"]:
+        entry["index"] = indexes[entry["index"]]
+    result["errors"] = sorted(errors + result["errors"], key = lambda e: e["index"])
+    logging.info(f"Bulk quote import: {result['created']} created, {len(result['errors'])} rejected")
+    return result
+
+@router.get("/products/{product_id}/quotes/history", response_model = QuoteHistory)
+@db_route("query")
+def quote_history_api(product_id: int, customer_id: int = None, since: str = None, until: str = None,
+                      bucket: Literal["day", "week", "month"] = None,
+                      limit: int = Query(config.QUOTE_HISTORY_LIMIT, ge = 1, le = config.MAX_QUOTE_HISTORY_LIMIT),
+                      db: tuple = Depends(get_db)):
+    """
+    Quote history in [since, until) (ISO dates or datetimes), per customer in time order.
+    bucket=day|week|month downsamples to one point per customer and period. Product.quote only
+    carries the current quote per customer; older quotes are read here.
+    """
+    conn, cursor = db
+    for name, value in (("since", since), ("until", until)):
+        try:
+            parse_history_bound(value, name)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    try:
+        return quote_history(conn, cursor, product_id, customer_id = customer_id, since = since, until = until,
+                             bucket = bucket, limit = limit)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logging.error(f"Failed to read quote history: {e}", exc_info = True)
+        raise HTTPException(status_code=500, detail=f"Failed to read quote history: {e}")
+
 @router.delete("/products/{product_id}/quotes/{quote_id}", status_code=204)
-def delete_quote_api(quote_id: int, db: tuple = Depends(get_db)):
+@db_route("write")
+def delete_quote_api(product_id: int, quote_id: int,
+                     version: Optional[int] = Depends(expected_version), db: tuple = Depends(get_db)):
     conn, cursor = db
     try:
-        delete_quote(conn, cursor, quote_id)
+        check_version(conn, cursor, product_id, version)
+        delete_quote(conn, cursor, quote_id, product_id)
         conn.commit()
         logging.info(f"Deleted quote with ID: {quote_id}")
+    except VersionConflict as e:
+        raise precondition_failed(e)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
@@ -36,9 +118,17 @@ def delete_quote_api(quote_id: int, db: tuple = Depends(get_db)):
 
 
 @router.patch("/quotes/{quote_id}", response_model = QuoteOut)
-def edit_quote_api(quote_id: int, new_quote: QuoteUpdate, db: tuple = Depends(get_db)):
+@db_route("write")
+def edit_quote_api(quote_id: int, new_quote: QuoteUpdate,
+                   version = Depends(deferred_expected_version), db: tuple = Depends(get_db)):
+    """If-Match / expected_version name the version of the quote's product, as for its other child writes."""
     conn, cursor = db
+    quote = get_quote_by_id(cursor, quote_id)
+    if not quote:
+        raise HTTPException(status_code=404, detail="Quote not found")
+    expected = version(quote["product_id"])
     try:
+        check_version(conn, cursor, quote["product_id"], expected)
         update_data = new_quote.model_dump(exclude_unset = True)
         edit_quote(conn, cursor, quote_id, **update_data)
         conn.commit()
@@ -49,6 +139,8 @@ def edit_quote_api(quote_id: int, new_quote: QuoteUpdate, db: tuple = Depends(ge
         return QuoteOut(quote_id = quote["quote_id"], customer_id=quote["customer_id"],
                         customer_name = quote["customer_name"], quote=quote["quote"],
                         quote_remark = quote["quote_remark"])
+    except VersionConflict as e:
+        raise precondition_failed(e)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
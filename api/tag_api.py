@@ -2,6 +2,8 @@ from fastapi import Depends, HTTPException, APIRouter
 from crud.crud import *
 from models import *
 from database.connection import get_db
+from api.dispatch import db_route
+from api.etag import expected_version, precondition_failed
 import logging
 import sqlite3
 
@@ -9,13 +11,18 @@ router = APIRouter()
 
 
 @router.post("/products/{product_id}/tags/", response_model = Product, status_code = 201)
-def create_tags_endpoint(tags:TagList, product_id:int, db = Depends(get_db)):
+@db_route("write")
+def create_tags_endpoint(tags:TagList, product_id:int,
+                         version: Optional[int] = Depends(expected_version), db = Depends(get_db)):
     conn, cursor = db
     try:
+        check_version(conn, cursor, product_id, version)
         add_tag(conn, cursor, product_id, tags.tags)
         conn.commit()
         logging.info(f"Tag created: {tags.tags}")
         return format_product (conn, cursor, product_id)
+    except VersionConflict as e:
+        raise precondition_failed(e)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
@@ -23,12 +30,17 @@ def create_tags_endpoint(tags:TagList, product_id:int, db = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Failed to add tag: {e}")
 
 @router.delete("/products/{product_id}/tags/{tag_id}", status_code=204)
-def delete_tag_from_product_api(product_id: int, tag_id: int, db: tuple = Depends(get_db)):
+@db_route("write")
+def delete_tag_from_product_api(product_id: int, tag_id: int,
+                                version: Optional[int] = Depends(expected_version), db: tuple = Depends(get_db)):
     conn, cursor = db
     try:
+        check_version(conn, cursor, product_id, version)
         delete_tag_from_product(conn, cursor, product_id, tag_id)
         conn.commit()
         logging.info(f"Deleted tag with ID: {tag_id} from product: {product_id}")
+    except VersionConflict as e:
+        raise precondition_failed(e)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
@@ -36,6 +48,7 @@ def delete_tag_from_product_api(product_id: int, tag_id: int, db: tuple = Depend
         raise HTTPException(status_code=500, detail=f"Failed to delete tag from product: {e}")
 
 @router.patch("/tags/{tag_id}", response_model = TagOut)
+@db_route("write")
 def edit_tag_api(tag_id: int, new_name: TagUpdate, db: tuple = Depends(get_db)):
     conn, cursor = db
     try:
@@ -51,6 +64,7 @@ def edit_tag_api(tag_id: int, new_name: TagUpdate, db: tuple = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Failed to update tag: {e}")
 
 @router.get("/tags", response_model = List[TagOut])
+@db_route("query")
 def list_tag_api(db: tuple = Depends(get_db)):
     conn, cursor = db
     try:
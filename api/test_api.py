@@ -1,12 +1,18 @@
 import pytest
 from fastapi.testclient import TestClient
 import sqlite3
+import contextlib
+import csv
+import json
 
 from api.api import app
 from crud.crud import *
 from database.schema import create_table, create_index
-from database.connection import get_db
+from database.migrations import migrate
+from database.connection import get_db, get_db_factory
+from database.writer import get_db_writer, InlineWriter
 from models import QuoteDetail
+from api.metrics import request_metrics
 
 # ========== API TEST SUITE MEGA BLOCK ==========
 
@@ -23,6 +29,11 @@ def test_client():
         yield conn, cursor
     
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_db_factory] = lambda: (lambda: contextlib.nullcontext((conn, cursor)))
+    app.dependency_overrides[get_db_writer] = lambda: InlineWriter(conn)
+    product_cache.clear()
+    quote_analytics.clear()
+    customer_name_cache.clear()
     yield TestClient(app)
     print(app.routes)
 
@@ -41,6 +52,11 @@ def test_client_and_db():
         yield conn, cursor
     
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_db_factory] = lambda: (lambda: contextlib.nullcontext((conn, cursor)))
+    app.dependency_overrides[get_db_writer] = lambda: InlineWriter(conn)
+    product_cache.clear()
+    quote_analytics.clear()
+    customer_name_cache.clear()
     client = TestClient(app)
     yield client, conn, cursor
 
@@ -59,6 +75,7 @@ def reset_database(conn, cursor):
         cursor.execute("DROP TABLE IF EXISTS product_manager")
         cursor.execute("PRAGMA foreign_keys = ON")
         create_table(conn, cursor)
+    migrate(conn, cursor)
 
 def sample_product_payload():
     return {
@@ -141,6 +158,47 @@ def test_create_product_api(test_client):
     assert "customers" in fields
     assert "quote" in fields
 
+def test_create_products_bulk_api(test_client):
+    rows = []
+    for i in range(3):
+        payload = sample_product_payload()
+        payload["ref_num"] = f"BULK{i}"
+        rows.append(payload)
+    rows.append({"ref_num": "BULK0"})
+    rows.append({"ref_num": "BAD", "price_usd": -1})
+
+    response = test_client.post("/products/bulk", json = rows)
+    assert response.status_code == 200
+    result = response.json()
+    assert [c["ref_num"] for c in result["created"]] == ["BULK0", "BULK1", "BULK2"]
+    assert [(e["index"], e["ref_num"]) for e in result["errors"]] == [(3, "BULK0"), (4, "BAD")]
+    assert "price_usd" in result["errors"][1]["error"]
+    created = test_client.get(f"/products/{result['created'][1]['id']}").json()
+    assert created["tags"][0]["tag_name"] == "summer"
+
+def test_create_products_bulk_api_csv_and_ndjson(test_client):
+    csv_body = ("ref_num,name,price_usd,tags,customers,quote\n"
+                "CSV1,csv one,1.5,a|b,Shop,\"{\"\"Shop\"\": {\"\"quote\"\": 2}}\"\n"
+                "CSV2,csv two,not a number,,,\n")
+    response = test_client.post("/products/bulk", content = csv_body, headers = {"Content-Type": "text/csv"})
+    assert response.status_code == 200
+    result = response.json()
+    assert [c["ref_num"] for c in result["created"]] == ["CSV1"]
+    assert result["errors"][0]["index"] == 1
+    product = test_client.get(f"/products/{result['created'][0]['id']}").json()
+    assert [t["tag_name"] for t in product["tags"]] == ["a", "b"]
+    assert product["quote"][0]["quote"] == 2
+
+    ndjson_body = '{"ref_num": "ND1"}\nnot json\n{"ref_num": "ND2", "tags": ["x"]}\n'
+    response = test_client.post("/products/bulk", content = ndjson_body,
+                                headers = {"Content-Type": "application/x-ndjson"})
+    result = response.json()
+    assert [c["ref_num"] for c in result["created"]] == ["ND1", "ND2"]
+    assert [e["index"] for e in result["errors"]] == [1]
+
+    response = test_client.post("/products/bulk", json = {"ref_num": "not a list"})
+    assert response.status_code == 400
+
 def test_create_images_api(test_client):
     payload = sample_product_payload()
     add_result = test_client.post("/products/", json = payload)
@@ -188,9 +246,11 @@ def test_create_quotes_api(test_client):
 
     assert response.status_code == 201
     data = response.json()
-    assert "CustomerA" in data["quote"][1]["customer_name"]
-    assert data["quote"][1]["quote"] == 13
-    assert data["quote"][1]["quote_remark"] == "yes"
+    # The new quote replaces CustomerA's current one; the old one stays in the history
+    assert len(data["quote"]) == 1
+    assert "CustomerA" in data["quote"][0]["customer_name"]
+    assert data["quote"][0]["quote"] == 13
+    assert data["quote"][0]["quote_remark"] == "yes"
     print("STATUS:", response.status_code)
     print("BODY:", response.text)
 
@@ -269,6 +329,55 @@ def test_delete_tag_from_product_api(test_client_and_db):
     print("STATUS:", response.status_code)
     print("BODY:", response.text)
 
+def test_quote_history_api(test_client):
+    product_id = test_client.post("/products/", json = sample_product_payload()).json()["id"]
+    test_client.post(f"/products/{product_id}/quotes", json = {"quotes": {"CustomerA": {"quote": 13}}})
+
+    history = test_client.get(f"/products/{product_id}/quotes/history").json()
+    assert [p["quote"] for p in history["points"]] == [12, 13]
+    assert history["points"][0]["quote_remark"] == "bulk"
+    daily = test_client.get(f"/products/{product_id}/quotes/history", params = {"bucket": "day"}).json()
+    assert [(p["open"], p["quote"], p["count"]) for p in daily["points"]] == [(12, 13, 2)]
+
+    assert test_client.get(f"/products/{product_id}/quotes/history", params = {"since": "soon"}).status_code == 400
+    assert test_client.get(f"/products/{product_id}/quotes/history", params = {"bucket": "hour"}).status_code == 422
+    assert test_client.get("/products/999/quotes/history").status_code == 404
+
+def test_quote_analytics_api(test_client):
+    product_id = test_client.post("/products/", json = sample_product_payload()).json()["id"]
+    summary = test_client.get("/analytics/quotes").json()
+    customer = summary["customers"][0]
+    assert (customer["customer_name"], customer["quotes"]["median"]) == ("CustomerA", 12)
+    assert customer["margin"]["avg"] == round((12 - 9.99) / 12, 4)
+
+    test_client.post(f"/products/{product_id}/quotes", json = {"quotes": {"CustomerA": {"quote": 15}}})
+    assert test_client.get("/analytics/quotes").json()["customers"][0]["quotes"]["median"] == 15
+    assert test_client.get("/analytics/quotes", params = {"history": True}).json()["overall"]["count"] == 2
+    drift = test_client.get("/analytics/quotes/drift", params = {"bucket": "day"}).json()
+    assert drift["points"][0]["ratio"]["max"] == 1.25
+    assert test_client.get("/analytics/quotes/drift", params = {"since": "soon"}).status_code == 400
+    assert test_client.get("/analytics/quotes", params = {"currency": "eur"}).status_code == 422
+
+def test_bulk_quote_api(test_client):
+    product_id = test_client.post("/products/", json = sample_product_payload()).json()["id"]
+    csv_body = ("ref_num,product_id,quote,remark,timestamp\n"
+                f"TST123,,13.5,FOB,\n,{product_id},11,,2024-03-01\n,999,1,,\nNOPE,,1,,\n")
+    response = test_client.post("/quotes/bulk", params = {"customer": "customera"}, content = csv_body,
+                                headers = {"Content-Type": "text/csv"})
+    assert response.status_code == 200
+    result = response.json()
+    assert result["created"] == 2
+    assert [(e["index"], e["error"]) for e in result["errors"]] == [(2, "Product 999 not found"),
+                                                                    (3, "Product NOPE not found")]
+    quotes = test_client.get(f"/products/{product_id}").json()["quote"]
+    assert [(q["quote"], q["quote_remark"]) for q in quotes] == [(13.5, "FOB")]
+
+    rows = [{"product_id": product_id, "customer": "Unknown", "quote": 1}, {"product_id": product_id, "quote": -1}]
+    result = test_client.post("/quotes/bulk", json = rows).json()
+    assert result["created"] == 0
+    assert [e["index"] for e in result["errors"]] == [0, 1]
+    assert test_client.post("/quotes/bulk", json = {"not": "a list"}).status_code == 400
+
 def test_delete_quote_api(test_client_and_db):
     client, conn, cursor = test_client_and_db
     payload = sample_product_payload()
@@ -396,6 +505,169 @@ def test_get_product_api(test_client):
     print("STATUS:", response.status_code)
     print("BODY:", response.text)
 
+def test_get_product_api_is_cached_until_edited(test_client):
+    product_id = test_client.post("/products/", json = sample_product_payload()).json()["id"]
+    test_client.get(f"/products/{product_id}")
+    test_client.get(f"/products/{product_id}")
+    stats = test_client.get("/debug/cache").json()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+    test_client.put(f"/products/{product_id}", json = {"name": "Renamed"})
+    assert test_client.get(f"/products/{product_id}").json()["name"] == "Renamed"
+    tag_id = test_client.get(f"/products/{product_id}").json()["tags"][0]["id"]
+    test_client.patch(f"/tags/{tag_id}", json = {"new_name": "renamed tag"})
+    assert test_client.get(f"/products/{product_id}").json()["tags"][0]["tag_name"] == "renamed tag"
+
+def test_get_product_api_etag(test_client):
+    product_id = test_client.post("/products/", json = sample_product_payload()).json()["id"]
+    response = test_client.get(f"/products/{product_id}")
+    etag = response.headers["ETag"]
+    assert etag == f'"p{product_id}-v{response.json()["version"]}"'
+
+    cached = test_client.get(f"/products/{product_id}", headers = {"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["ETag"] == etag
+    assert cached.content == b""
+
+    assert test_client.post(f"/products/{product_id}/images/", json = {"imgs": ["new.jpg"]}).status_code == 201
+    changed = test_client.get(f"/products/{product_id}", headers = {"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert test_client.get("/products/999", headers = {"If-None-Match": "*"}).status_code == 404
+
+def test_list_and_search_api_etag(test_client):
+    payload = sample_product_payload()
+    product_id = test_client.post("/products/", json = payload).json()["id"]
+    for url in ("/products", "/products?fields=base", f"/products/search?ref_num={payload['ref_num']}",
+                f"/products/search?q=test&limit=1"):
+        etag = test_client.get(url).headers["ETag"]
+        assert test_client.get(url, headers = {"If-None-Match": f'W/"other", {etag}'}).status_code == 304
+
+        test_client.put(f"/products/{product_id}", json = {"remarks": f"changed for {url}"})
+        assert test_client.get(url, headers = {"If-None-Match": etag}).status_code == 200
+
+def test_edit_product_api_if_match(test_client):
+    product_id = test_client.post("/products/", json = sample_product_payload()).json()["id"]
+    etag = test_client.get(f"/products/{product_id}").headers["ETag"]
+
+    response = test_client.put(f"/products/{product_id}", json = {"name": "first"}, headers = {"If-Match": etag})
+    assert response.status_code == 200
+    new_etag = response.headers["ETag"]
+    assert new_etag != etag
+
+    stale = test_client.put(f"/products/{product_id}", json = {"name": "stale"}, headers = {"If-Match": etag})
+    assert stale.status_code == 412
+    assert stale.headers["ETag"] == new_etag
+    version = stale.json()["detail"]["current_version"]
+    assert test_client.put(f"/products/{product_id}", json = {"name": "stale", "expected_version": version - 1}).status_code == 412
+    assert test_client.put(f"/products/{product_id}", json = {"name": "x"}, headers = {"If-Match": '"p999-v1"'}).status_code == 412
+    assert test_client.get(f"/products/{product_id}").json()["name"] == "first"
+
+    # Child collections take the same precondition
+    response = test_client.post(f"/products/{product_id}/tags/", json = {"tags": ["new"]}, headers = {"If-Match": etag})
+    assert response.status_code == 412
+    response = test_client.post(f"/products/{product_id}/tags/", json = {"tags": ["new"]}, headers = {"If-Match": new_etag})
+    assert response.status_code == 201
+    tag_id = response.json()["tags"][0]["id"]
+    assert test_client.delete(f"/products/{product_id}/tags/{tag_id}",
+                              params = {"expected_version": version}).status_code == 412
+    assert test_client.delete(f"/products/{product_id}/tags/{tag_id}",
+                              params = {"expected_version": version + 1}).status_code == 204
+
+def test_child_writes_are_checked_against_their_own_product(test_client):
+    product = test_client.post("/products/", json = sample_product_payload()).json()
+    other = test_client.post("/products/", json = {**sample_product_payload(), "ref_num": "OTHER"}).json()
+    image_id, quote_id = product["imgs"][0]["id"], product["quote"][0]["quote_id"]
+
+    # The version checked is the other product's, so the child of this one must not be touched
+    assert test_client.delete(f"/products/{other['id']}/images/{image_id}").status_code == 404
+    assert test_client.delete(f"/products/{other['id']}/quotes/{quote_id}").status_code == 404
+    current = test_client.get(f"/products/{product['id']}")
+    assert (len(current.json()["imgs"]), len(current.json()["quote"])) == (1, 1)
+
+    etag = current.headers["ETag"]
+    assert test_client.patch(f"/quotes/{quote_id}", json = {"quote": 5}, headers = {"If-Match": etag}).status_code == 200
+    stale = test_client.patch(f"/quotes/{quote_id}", json = {"quote": 6}, headers = {"If-Match": etag})
+    assert stale.status_code == 412
+    assert test_client.patch(f"/quotes/{quote_id}", json = {"quote": 6},
+                             params = {"expected_version": stale.json()["detail"]["current_version"]}).status_code == 200
+    assert test_client.patch(f"/quotes/{quote_id}", json = {"quote": 7},
+                             headers = {"If-Match": f'"p{other["id"]}-v1"'}).status_code == 412
+
+def test_routes_run_on_db_executor_lanes(test_client):
+    product_id = test_client.post("/products/", json = sample_product_payload()).json()["id"]
+    before = test_client.get("/debug/executor").json()
+    assert test_client.get(f"/products/{product_id}").status_code == 200
+    assert test_client.get("/products/search", params = {"q": "test"}).status_code == 200
+    assert test_client.patch(f"/products/{product_id}/lock?user=alice", json = {"locked": True}).status_code == 200
+    after = test_client.get("/debug/executor").json()
+    assert after["read"]["completed"] == before["read"]["completed"] + 1
+    assert after["query"]["completed"] == before.get("query", {"completed": 0})["completed"] + 1
+    assert after["lock"]["completed"] == before.get("lock", {"completed": 0})["completed"] + 1
+
+def test_database_is_not_chosen_by_query_parameters():
+    # Dependency parameters become query parameters; the database file must not be one
+    app.dependency_overrides.clear()
+    parameters = {param["name"] for path in TestClient(app).get("/openapi.json").json()["paths"].values()
+                  for operation in path.values() for param in operation.get("parameters", [])}
+    assert "db_name" not in parameters
+
+def test_metrics_endpoint(test_client):
+    request_metrics.reset()
+    product_id = test_client.post("/products/", json = sample_product_payload()).json()["id"]
+    test_client.get(f"/products/{product_id}")
+    test_client.get("/products/999999")
+    test_client.get("/no/such/path")
+
+    response = test_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = response.text.splitlines()
+    assert 'pm_http_responses_total{method="GET",route="/products/{product_id}",status="200"} 1' in lines
+    assert 'pm_http_responses_total{method="GET",route="/products/{product_id}",status="404"} 1' in lines
+    assert 'pm_http_responses_total{method="GET",route="<unmatched>",status="404"} 1' in lines
+    assert 'pm_http_request_duration_seconds_count{method="GET",route="/products/{product_id}"} 2' in lines
+    assert 'pm_http_request_duration_seconds_bucket{method="GET",route="/products/{product_id}",le="+Inf"} 2' in lines
+    assert 'pm_http_db_seconds_count{method="POST",route="/products/"} 1' in lines
+    assert 'pm_http_serialize_seconds_count{method="GET",route="/products/{product_id}"} 2' in lines
+    assert "pm_http_requests_in_flight 1" in lines  # the /metrics request itself
+    assert any(line.startswith("pm_cache_hits_total ") for line in lines)
+
+def test_maintenance_api(test_client):
+    product_id = test_client.post("/products/", json = sample_product_payload()).json()["id"]
+    test_client.delete(f"/products/{product_id}")
+
+    before = test_client.get("/debug/executor").json()
+    response = test_client.post("/admin/maintenance", params = {"max_pages": 10})
+    assert response.status_code == 200
+    after = test_client.get("/debug/executor").json()
+    assert after["write"]["completed"] == before.get("write", {"completed": 0})["completed"] + 1
+    report = response.json()
+    assert report["before"]["auto_vacuum"] == "INCREMENTAL"
+    assert report["vacuum"]["pages"] <= 10
+    assert report["after"]["analyzed"]
+    assert test_client.post("/admin/maintenance", params = {"max_pages": 0}).status_code == 422
+
+    stats = test_client.get("/debug/maintenance").json()
+    assert stats["running"] is False
+    assert stats["last"]["elapsed"] == report["elapsed"]
+    assert stats["database"]["page_count"] == report["after"]["page_count"]
+    assert "removed" in stats["cleanup"]
+
+def test_changes_api(test_client):
+    first_id = test_client.post("/products/", json = sample_product_payload()).json()["id"]
+    feed = test_client.get("/changes").json()
+    assert (feed["upserted"], feed["deleted"], feed["products"]) == ([first_id], [], None)
+
+    second = {**sample_product_payload(), "ref_num": "TST456"}
+    second_id = test_client.post("/products/", json = second).json()["id"]
+    test_client.delete(f"/products/{first_id}")
+    delta = test_client.get("/changes", params = {"since": feed["next_token"], "hydrate": True}).json()
+    assert (delta["upserted"], delta["deleted"]) == ([second_id], [first_id])
+    assert delta["products"][0]["ref_num"] == "TST456"
+
+    assert test_client.get("/changes", params = {"since": "garbage"}).status_code == 400
+
 def test_search_product_name_api(test_client):
     payload = sample_product_payload()
     test_client.post("/products/", json = payload)
@@ -407,6 +679,87 @@ def test_search_product_name_api(test_client):
     data = response.json()
     assert data[0]["name"] == "Test Product"
 
+def test_search_full_text_api(test_client):
+    payload = sample_product_payload()
+    test_client.post("/products/", json = payload)
+    response = test_client.get("/products/search", params={"q": "summ"})
+    assert response.status_code == 200
+    assert response.json()[0]["ref_num"] == "TST123"
+
+    response = test_client.get("/products/search", params={"q": "winter"})
+    assert response.status_code == 404
+
+def test_search_combined_filters_api(test_client):
+    payload = sample_product_payload()
+    test_client.post("/products/", json = payload)
+    payload.update(ref_num = "TST124", price_usd = 20.0, tags = ["summer", "beach"])
+    test_client.post("/products/", json = payload)
+
+    response = test_client.get("/products/search", params = {"tag": ["summer", "beach"], "tag_mode": "all"})
+    assert response.status_code == 200
+    assert [p["ref_num"] for p in response.json()] == ["TST124"]
+
+    response = test_client.get("/products/search", params = {"tag": "summer", "price_usd_max": 10})
+    assert [p["ref_num"] for p in response.json()] == ["TST123"]
+
+    response = test_client.get("/products/search", params = {"tag": "summer", "tag_mode": "some"})
+    assert response.status_code == 422
+
+def test_list_products_api_pagination(test_client):
+    payload = sample_product_payload()
+    for i in range(3):
+        payload["ref_num"] = f"TST{i}"
+        test_client.post("/products/", json = payload)
+
+    response = test_client.get("/products", params = {"limit": 2, "fields": "base"})
+    assert response.status_code == 200
+    page = response.json()
+    assert [p["ref_num"] for p in page["items"]] == ["TST0", "TST1"]
+    assert "tags" not in page["items"][0]
+
+    response = test_client.get("/products", params = {"limit": 2, "after": page["next_cursor"]})
+    page = response.json()
+    assert [p["ref_num"] for p in page["items"]] == ["TST2"]
+    assert page["items"][0]["tags"][0]["tag_name"] == "summer"
+    assert page["next_cursor"] is None
+
+    assert test_client.get("/products", params = {"after": "garbage!"}).status_code == 400
+    assert test_client.get("/products", params = {"fields": "nope"}).status_code == 400
+
+def test_search_products_api_pagination(test_client):
+    payload = sample_product_payload()
+    for i in range(3):
+        payload["ref_num"] = f"TST{i}"
+        test_client.post("/products/", json = payload)
+
+    response = test_client.get("/products/search", params = {"tag": "summer", "limit": 2})
+    assert [p["ref_num"] for p in response.json()] == ["TST0", "TST1"]
+    cursor = response.headers["X-Next-Cursor"]
+    response = test_client.get("/products/search", params = {"tag": "summer", "limit": 2, "after": cursor})
+    assert [p["ref_num"] for p in response.json()] == ["TST2"]
+    assert "X-Next-Cursor" not in response.headers
+
+def test_export_products_api(test_client):
+    payload = sample_product_payload()
+    for i in range(3):
+        payload["ref_num"] = f"TST{i}"
+        test_client.post("/products/", json = payload)
+
+    with test_client.stream("GET", "/products/export") as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in response.iter_lines() if line]
+    assert [p["ref_num"] for p in lines] == ["TST0", "TST1", "TST2"]
+    assert lines[0]["tags"][0]["tag_name"] == "summer"
+    assert lines[0]["imgs"][0]["img"] == "img1.jpg"
+
+    response = test_client.get("/products/export", params = {"format": "csv"})
+    assert response.status_code == 200
+    rows = list(csv.DictReader(response.text.splitlines()))
+    assert [r["ref_num"] for r in rows] == ["TST0", "TST1", "TST2"]
+    assert rows[0]["customers"] == "CustomerA"
+    assert json.loads(rows[0]["quote"])[0]["quote"] == 12
+
 def test_list_tag_api(test_client):
     payload = sample_product_payload()
     test_client.post("/products/", json = payload)
@@ -446,4 +799,32 @@ def test_update_lock_status_api(test_client):
     assert response.status_code == 200
     data = response.json()
     assert data["locked_by"] is None
-    assert data["locked_timestamp"] is None
\ No newline at end of file
+    assert data["locked_timestamp"] is None
+
+
+def test_lock_conflict_api(test_client):
+    product_id = test_client.post("/products/", json = sample_product_payload()).json()["id"]
+    assert test_client.patch(f"/products/{product_id}/lock?user=alice", json={"locked": True}).status_code == 200
+
+    response = test_client.patch(f"/products/{product_id}/lock?user=bob", json={"locked": True})
+    assert response.status_code == 409
+    assert response.json()["detail"]["holders"] == {str(product_id): "alice"}
+    assert test_client.patch(f"/products/{product_id}/lock?user=bob", json={"locked": False}).status_code == 409
+    assert test_client.post(f"/products/{product_id}/lock/renew?user=alice").status_code == 200
+    assert test_client.patch("/products/999999/lock?user=alice", json={"locked": True}).status_code == 404
+
+def test_bulk_lock_api(test_client):
+    first = test_client.post("/products/", json = sample_product_payload()).json()["id"]
+    payload = sample_product_payload()
+    payload["ref_num"] = payload["ref_num"] + "-2"
+    second = test_client.post("/products/", json = payload).json()["id"]
+
+    response = test_client.post("/locks", json = {"product_ids": [first, second], "user": "alice"})
+    assert response.status_code == 200
+    assert response.json() == {"product_ids": [first, second], "locked_by": "alice"}
+    assert test_client.post("/locks", json = {"product_ids": [second], "user": "bob"}).status_code == 409
+    assert test_client.get("/debug/locks").json()["active"] == 2
+
+    response = test_client.post("/locks", json = {"product_ids": [first, second], "user": "alice", "locked": False})
+    assert response.json()["product_ids"] == [first, second]
+    assert test_client.get(f"/products/{first}").json()["locked_by"] is None
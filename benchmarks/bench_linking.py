@@ -0,0 +1,95 @@
+"""
+Statements and latency per product for linking tags and customers: the old per-name
+insert/select/link loop against the set-based add_tag / add_customer.
+Run with: python -m benchmarks.bench_linking [--products 500] [--tags 30] [--customers 5]
+"""
+
+import argparse
+import json
+import sqlite3
+import time
+
+from database.schema import create_table
+from database.migrations import migrate
+from crud.tag_crud import add_tag
+from crud.customer_crud import add_customer
+
+
+def legacy_add_tag(conn, cursor, product_id, tags):
+    for t in tags:
+        cursor.execute("INSERT OR IGNORE INTO tags(tag_name) VALUES (?)", (t,))
+        cursor.execute("SELECT id FROM tags WHERE tag_name =?", (t,))
+        tag_id = cursor.fetchone()[0]
+        cursor.execute("""INSERT OR IGNORE INTO product_tags (product_id, tag_id)
+                            VALUES (?, ?)""", (product_id, tag_id))
+
+def legacy_add_customer(conn, cursor, product_id, customers):
+    for c in customers:
+        cursor.execute("INSERT OR IGNORE INTO customers(customer_name) VALUES(?)", (c,))
+        cursor.execute("SELECT id FROM customers WHERE customer_name =?", (c,))
+        customer_id = cursor.fetchone()[0]
+        cursor.execute("""INSERT OR IGNORE INTO product_customers (product_id, customer_id)
+                            VALUES (?, ?)""", (product_id, customer_id))
+
+def fresh_db():
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA foreign_keys = ON")
+    create_table(conn, cursor)
+    migrate(conn, cursor)
+    return conn, cursor
+
+def run(link_tags, link_customers, products, tags_per_product, customers_per_product):
+    conn, cursor = fresh_db()
+    cursor.executemany("INSERT INTO product_manager(ref_num) VALUES (?)", [(f"P{i}",) for i in range(products)])
+    conn.commit()
+
+    statements = []
+    triggered = []
+    # Trigger bodies are traced as "-- TRIGGER" lines: count them apart from the statements the application issues
+    conn.set_trace_callback(lambda sql: (triggered if sql.startswith("--") else statements).append(sql))
+    timings = []
+    for product_id in range(1, products + 1):
+        tags = [f"tag {(product_id + i) % 200}" for i in range(tags_per_product)]
+        customers = [f"customer {(product_id + i) % 50}" for i in range(customers_per_product)]
+        start = time.perf_counter()
+        link_tags(conn, cursor, product_id, tags)
+        link_customers(conn, cursor, product_id, customers)
+        conn.commit()
+        timings.append(time.perf_counter() - start)
+    conn.set_trace_callback(None)
+    conn.close()
+
+    timings.sort()
+    return {
+        "statements_per_product": round(len(statements) / products, 1),
+        "trigger_statements_per_product": round(len(triggered) / products, 1),
+        "mean_ms": round(sum(timings) / len(timings) * 1000, 3),
+        "p50_ms": round(timings[len(timings) // 2] * 1000, 3),
+        "p99_ms": round(timings[int(len(timings) * 0.99)] * 1000, 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--products", type = int, default = 500)
+    parser.add_argument("--tags", type = int, default = 30)
+    parser.add_argument("--customers", type = int, default = 5)
+    parser.add_argument("--json", help = "write results to this file")
+    args = parser.parse_args()
+
+    results = {
+        "legacy": run(legacy_add_tag, legacy_add_customer, args.products, args.tags, args.customers),
+        "set_based": run(add_tag, add_customer, args.products, args.tags, args.customers),
+    }
+    for name, result in results.items():
+        print(f"{name:>10}: {result['statements_per_product']:>6} statements/product "
+              f"(+{result['trigger_statements_per_product']} in triggers), "
+              f"mean {result['mean_ms']} ms, p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent = 2)
+
+if __name__ == "__main__":
+    main()
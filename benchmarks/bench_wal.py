@@ -0,0 +1,118 @@
+"""
+Read throughput with and without an active writer, per journal mode.
+Run with: python -m benchmarks.bench_wal [--products 2000] [--readers 4] [--seconds 3]
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from database.connection import init_database
+from database.storage import storage_profile, apply_storage_profile
+from crud.crud import add_product, edit_product, format_product
+from models import ProductCreate
+
+
+def seed(db_name, products):
+    conn = sqlite3.connect(db_name)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA foreign_keys = ON")
+    for i in range(products):
+        add_product(conn, cursor, ProductCreate(
+            ref_num = f"BENCH{i:06d}", name = f"bench product {i}", price_usd = 1.0 + i % 50,
+            customers = [f"customer {i % 40}"], quote = {f"customer {i % 40}": {"quote": 2.0}},
+            imgs = [f"img{i}.jpg"], tags = [f"tag {i % 25}", f"tag {i % 7}"]))
+    conn.commit()
+    conn.close()
+
+def connect(db_name, profile):
+    conn = sqlite3.connect(db_name, check_same_thread = False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    apply_storage_profile(conn, profile)
+    return conn
+
+def reader(db_name, profile, products, stop, counts, errors):
+    conn = connect(db_name, profile)
+    cursor = conn.cursor()
+    rng = random.Random()
+    reads = 0
+    while not stop.is_set():
+        try:
+            format_product(conn, cursor, rng.randint(1, products))
+            reads += 1
+        except sqlite3.OperationalError:
+            errors.append(1)
+    counts.append(reads)
+    conn.close()
+
+def writer(db_name, profile, products, stop, counts):
+    conn = connect(db_name, profile)
+    cursor = conn.cursor()
+    rng = random.Random(1)
+    writes = 0
+    while not stop.is_set():
+        try:
+            for _ in range(20):
+                edit_product(conn, cursor, rng.randint(1, products), price_rmb = rng.random() * 100)
+            conn.commit()
+            writes += 1
+        except sqlite3.OperationalError:
+            conn.rollback()
+    counts.append(writes)
+    conn.close()
+
+def run_case(db_name, profile, products, readers, seconds, with_writer):
+    stop = threading.Event()
+    read_counts, write_counts, errors = [], [], []
+    threads = [threading.Thread(target = reader, args = (db_name, profile, products, stop, read_counts, errors))
+               for _ in range(readers)]
+    if with_writer:
+        threads.append(threading.Thread(target = writer, args = (db_name, profile, products, stop, write_counts)))
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return {
+        "reads_per_sec": round(sum(read_counts) / seconds, 1),
+        "write_txns_per_sec": round(sum(write_counts) / seconds, 1),
+        "reader_errors": len(errors),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--products", type = int, default = 2000)
+    parser.add_argument("--readers", type = int, default = 4)
+    parser.add_argument("--seconds", type = float, default = 3.0)
+    parser.add_argument("--json", help = "write results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for journal_mode, synchronous in (("DELETE", "FULL"), ("WAL", "NORMAL")):
+        profile = storage_profile(journal_mode = journal_mode, synchronous = synchronous, busy_timeout = 5000)
+        with tempfile.TemporaryDirectory() as tmp:
+            db_name = os.path.join(tmp, "bench.db")
+            init_database(db_name, profile)
+            seed(db_name, args.products)
+            idle = run_case(db_name, profile, args.products, args.readers, args.seconds, with_writer = False)
+            busy = run_case(db_name, profile, args.products, args.readers, args.seconds, with_writer = True)
+        results[journal_mode] = {"readers_only": idle, "with_writer": busy}
+        retained = busy["reads_per_sec"] / idle["reads_per_sec"] * 100 if idle["reads_per_sec"] else 0
+        print(f"{journal_mode:>6}: {idle['reads_per_sec']:>9} reads/s idle, "
+              f"{busy['reads_per_sec']:>9} reads/s with writer ({retained:.0f}% retained, "
+              f"{busy['write_txns_per_sec']} write txns/s, {busy['reader_errors']} reader errors)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent = 2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Seeded generator for realistic synthetic catalogs. The same (products, seed) always gives the
+same database: tag and customer popularity follow a Zipf-like long tail (a few tags and
+customers are on thousands of products, most on a handful), products have 0-6 images, and
+every linked customer has a quote history spread over the last two years.
+Run with: python -m benchmarks.generator --products 100000 [--seed 42] [--db catalog.db]
+"""
+
+import argparse
+import bisect
+import itertools
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from database.connection import init_database
+from crud.product_crud import add_products_bulk
+from crud.search_crud import suspend_search_index
+from crud.utils import chunked
+from models import ProductCreate
+
+
+WORDS = ("steel", "plastic", "wooden", "glass", "ceramic", "bamboo", "cotton", "leather", "metal", "paper",
+         "pen", "cup", "box", "bag", "lamp", "bottle", "tray", "clip", "brush", "frame", "hook", "jar",
+         "mini", "large", "round", "square", "folding", "magnetic", "kids", "travel", "office", "kitchen",
+         "red", "blue", "black", "white", "green", "clear", "gold", "silver")
+PACKING = ("box", "polybag", "blister", "carton", "shrink wrap", "display box")
+HISTORY_START = datetime(2023, 1, 1)
+HISTORY_DAYS = 730
+
+
+class Zipf:
+    # Draws from population with weight 1 / rank ** s, i.e. a long tail behind a few favourites
+    def __init__(self, population, s = 1.1):
+        self.population = population
+        self.cum_weights = list(itertools.accumulate(1 / (rank ** s) for rank in range(1, len(population) + 1)))
+
+    def sample(self, rng, k):
+        # k distinct items (fewer if the draws keep repeating)
+        total = self.cum_weights[-1]
+        picked = {}
+        for _ in range(k * 3):
+            if len(picked) == k:
+                break
+            item = self.population[bisect.bisect(self.cum_weights, rng.random() * total)]
+            picked[item] = True
+        return list(picked)
+
+
+def catalog_path(products, seed, directory = None):
+    directory = directory or os.path.join(os.path.dirname(__file__), ".data")
+    os.makedirs(directory, exist_ok = True)
+    return os.path.join(directory, f"catalog-{products}-{seed}.db")
+
+def product_rows(products, seed, tags = None, customers = None):
+    # Yields (ProductCreate, quote history) per product; history is [(customer, quote, timestamp)]
+    # for quotes older than the current one, which add_products_bulk inserts
+    rng = random.Random(seed)
+    tags = tags or max(200, products // 50)
+    customers = customers or max(50, products // 200)
+    tag_names = Zipf([f"tag {i}" for i in range(tags)])
+    customer_names = Zipf([f"Customer {i:05d}" for i in range(customers)])
+
+    for i in range(products):
+        linked = customer_names.sample(rng, rng.choice((1, 1, 1, 2, 2, 3, 5)))
+        base_price = round(rng.uniform(0.2, 40.0), 2)
+        quote, history = {}, []
+        for customer in linked:
+            price = base_price
+            when = HISTORY_START + timedelta(days = rng.randrange(HISTORY_DAYS // 2))
+            for _ in range(rng.randint(0, 9)):
+                history.append((customer, price, when.strftime("%Y-%m-%d %H:%M:%S")))
+                price = round(max(0.01, price * rng.uniform(0.9, 1.12)), 2)
+                when += timedelta(days = rng.randint(7, 60), seconds = rng.randrange(86400))
+            quote[customer] = {"quote": price, "remark": rng.choice((None, "FOB", "CIF", "incl. packing"))}
+        yield ProductCreate(
+            ref_num = f"R{i:07d}",
+            name = " ".join(rng.sample(WORDS, rng.randint(2, 4))),
+            barcode = 6900000000000 + i,
+            pcs_innerbox = rng.choice((6, 10, 12, 24)),
+            pcs_ctn = rng.choice((48, 60, 100, 144, 240)),
+            weight = round(rng.uniform(0.01, 3.0), 3),
+            price_usd = base_price,
+            price_rmb = round(base_price * 7.1, 2),
+            remarks = rng.choice(("", "new", "best seller", "discontinued soon", "custom logo available")),
+            packing = rng.choice(PACKING),
+            customers = linked,
+            quote = quote,
+            imgs = [f"img/R{i:07d}-{n}.jpg" for n in range(rng.choice((0, 1, 1, 2, 3, 6)))],
+            tags = tag_names.sample(rng, rng.choice((0, 1, 2, 3, 3, 5, 8)))), history
+
+def generate_catalog(db_name, products, seed = 42, chunk_size = 2000):
+    # Creates db_name (which must not exist) with the catalog for (products, seed); returns counts
+    init_database(db_name)
+    conn = sqlite3.connect(db_name)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA foreign_keys = ON")
+
+    rows = product_rows(products, seed)
+    created = 0
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        result = add_products_bulk(conn, cursor, [product for product, _ in chunk], chunk_size = chunk_size)
+        ids = {entry["ref_num"]: entry["id"] for entry in result["created"]}
+        created += len(ids)
+
+        # Older quotes, with their original timestamps; one version bump / re-index per product
+        history = [(ids[product.ref_num], customer, quote, timestamp)
+                   for product, quotes in chunk for customer, quote, timestamp in quotes]
+        customer_ids = dict(cursor.execute("SELECT customer_name, id FROM customers").fetchall())
+        with suspend_search_index(conn, cursor, list(ids.values())):
+            for batch in chunked(history):
+                cursor.executemany("""INSERT INTO quotes(product_id, customer_id, quote, timestamp)
+                                      VALUES (?, ?, ?, ?)""",
+                                   [(pid, customer_ids[name], quote, ts) for pid, name, quote, ts in batch])
+        conn.commit()
+
+    cursor.execute("ANALYZE")
+    counts = {table: cursor.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for table in ("product_manager", "tags", "customers", "product_tags", "product_customers",
+                            "product_images", "quotes")}
+    conn.close()
+    return counts
+
+def ensure_catalog(products, seed = 42, db_name = None):
+    # Path of the catalog for (products, seed), generating it on first use
+    db_name = db_name or catalog_path(products, seed)
+    if not os.path.exists(db_name):
+        start = time.perf_counter()
+        partial = db_name + ".partial"
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(partial + suffix):
+                os.remove(partial + suffix)
+        counts = generate_catalog(partial, products, seed)
+        # Fold the WAL into the file before renaming it
+        conn = sqlite3.connect(partial)
+        conn.execute("PRAGMA journal_mode = DELETE")
+        conn.close()
+        os.replace(partial, db_name)
+        print(f"Generated {db_name} in {time.perf_counter() - start:.1f}s: {counts}")
+    return db_name
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--products", type = int, default = 100000)
+    parser.add_argument("--seed", type = int, default = 42)
+    parser.add_argument("--db", help = "output path (default: benchmarks/.data/catalog-<products>-<seed>.db)")
+    args = parser.parse_args()
+    ensure_catalog(args.products, args.seed, args.db)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+"""
+Latency / throughput scenarios against a generated catalog (benchmarks/generator.py), at the
+CRUD layer (functions on one connection) and the HTTP layer (TestClient through the full app).
+Every scenario draws its arguments from a seeded RNG and runs on a fresh copy of the catalog,
+so runs are comparable across commits. Results are written as JSON; --compare prints the
+p50/p99 change against an earlier results file.
+Run with: python -m benchmarks.run [--products 100000] [--ops 300] [--layers crud,api]
+          [--scenarios get,search_tag] [--json results.json] [--compare baseline.json]
+"""
+
+import argparse
+import functools
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import config
+from database.connection import get_db, get_db_factory, open_db
+from database.pool import close_pools
+from database.storage import apply_storage_profile
+from database.writer import get_db_writer, get_writer, stop_writers
+from crud.crud import (add_product, delete_product, edit_product, format_product, list_products_page,
+                       search_products_page, acquire_lock, release_lock, LockConflict, clean_orphaned_data,
+                       ProductCache, product_cache)
+from models import ProductCreate
+from benchmarks.generator import ensure_catalog, WORDS
+
+
+def summarize(latencies, elapsed, errors = 0):
+    latencies = sorted(latencies)
+    n = len(latencies)
+    pick = lambda q: round(latencies[min(n - 1, int(n * q))] * 1000, 3) if n else None
+    return {
+        "ops": n,
+        "errors": errors,
+        "p50_ms": pick(0.50),
+        "p90_ms": pick(0.90),
+        "p99_ms": pick(0.99),
+        "max_ms": round(latencies[-1] * 1000, 3) if n else None,
+        "mean_ms": round(sum(latencies) / n * 1000, 3) if n else None,
+        "ops_per_sec": round(n / elapsed, 1) if elapsed else None,
+    }
+
+def measure(op, ops, expected = ()):
+    # Calls op(i) ops times; exceptions listed in expected (e.g. lock conflicts) count as errors
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    for i in range(ops):
+        t = time.perf_counter()
+        try:
+            op(i)
+        except expected:
+            errors += 1
+        latencies.append(time.perf_counter() - t)
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+class Workload:
+    # Seeded arguments for the scenarios, drawn from the catalog itself
+    def __init__(self, db_name, seed):
+        self.rng = random.Random(seed)
+        conn = sqlite3.connect(db_name)
+        self.max_id = conn.execute("SELECT MAX(id) FROM product_manager").fetchone()[0]
+        self.tags = [row[0] for row in conn.execute(
+            "SELECT t.tag_name FROM product_tags pt JOIN tags t ON t.id = pt.tag_id ORDER BY pt.rowid")]
+        self.customers = [row[0] for row in conn.execute(
+            "SELECT c.customer_name FROM product_customers pc JOIN customers c ON c.id = pc.customer_id ORDER BY pc.rowid")]
+        conn.close()
+        self.created = 0
+
+    def product_id(self):
+        return self.rng.randint(1, self.max_id)
+
+    def tag(self):
+        # Sampled per link, so popular tags come up as often as they are used
+        return self.rng.choice(self.tags)
+
+    def customer(self):
+        return self.rng.choice(self.customers)
+
+    def word(self):
+        return self.rng.choice(WORDS)
+
+    def barcode(self):
+        return 6900000000000 + self.product_id() - 1
+
+    def ref_num(self):
+        return f"R{self.product_id() - 1:07d}"
+
+    def new_product(self):
+        self.created += 1
+        return ProductCreate(ref_num = f"BENCH{self.created:07d}-{self.rng.randrange(10 ** 9)}",
+                             name = f"{self.word()} {self.word()}", price_usd = round(self.rng.uniform(1, 20), 2),
+                             customers = [self.customer()], quote = {}, imgs = ["img/bench.jpg"],
+                             tags = list({self.tag() for _ in range(3)}))
+
+
+# Scenarios: name -> (relative op count, factory(ctx) -> op(i), exceptions counted as errors).
+# Searches fetch one page, like the API. ctx holds the workload and, per layer, conn / cursor or client
+
+def crud_scenarios():
+    search = lambda filters: lambda ctx: lambda i: search_products_page(ctx.conn, ctx.cursor, **filters(ctx))
+
+    def create(ctx):
+        def op(i):
+            add_product(ctx.conn, ctx.cursor, ctx.work.new_product())
+            ctx.conn.commit()
+        return op
+
+    def get_cached(ctx):
+        cache = ProductCache()
+        hot = [ctx.work.product_id() for _ in range(200)]
+        return lambda i: format_product(ctx.conn, ctx.cursor, ctx.work.rng.choice(hot), cache = cache)
+
+    def list_pages(ctx):
+        state = {"after": None}
+        def op(i):
+            state["after"] = list_products_page(ctx.conn, ctx.cursor, after = state["after"])["next_cursor"]
+        return op
+
+    def bulk_edit(ctx):
+        def op(i):
+            for _ in range(100):
+                edit_product(ctx.conn, ctx.cursor, ctx.work.product_id(), price_rmb = round(ctx.work.rng.uniform(1, 99), 2))
+            ctx.conn.commit()
+        return op
+
+    def lock_churn(ctx):
+        hot = [ctx.work.product_id() for _ in range(50)]
+        users = ["alice", "bob", "carol", "dave"]
+        def op(i):
+            product_id, user = ctx.work.rng.choice(hot), ctx.work.rng.choice(users)
+            acquire_lock(ctx.conn, ctx.cursor, product_id, user)
+            if ctx.work.rng.random() < 0.7:
+                release_lock(ctx.conn, ctx.cursor, product_id, user)
+        return op
+
+    def cleanup(ctx):
+        def op(i):
+            for _ in range(20):
+                try:
+                    delete_product(ctx.conn, ctx.cursor, ctx.work.product_id())
+                except ValueError:
+                    pass
+            ctx.conn.commit()
+            clean_orphaned_data(ctx.conn, ctx.cursor)
+        return op
+
+    return {
+        "create": (1, create, ()),
+        "get": (2, lambda ctx: lambda i: format_product(ctx.conn, ctx.cursor, ctx.work.product_id()), ()),
+        "get_cached": (2, get_cached, ()),
+        "list_page": (1, list_pages, ()),
+        "search_name": (1, search(lambda ctx: {"name": ctx.work.word()}), (ValueError,)),
+        "search_tag": (1, search(lambda ctx: {"tag": [ctx.work.tag()]}), (ValueError,)),
+        "search_customer": (1, search(lambda ctx: {"customer": [ctx.work.customer()]}), (ValueError,)),
+        "search_barcode": (1, search(lambda ctx: {"barcode": ctx.work.barcode()}), (ValueError,)),
+        "search_ref_num": (1, search(lambda ctx: {"ref_num": ctx.work.ref_num()}), (ValueError,)),
+        "search_text": (1, search(lambda ctx: {"q": f"{ctx.work.word()} {ctx.work.word()}"}), (ValueError,)),
+        "bulk_edit": (0.1, bulk_edit, ()),
+        "lock_churn": (1, lock_churn, (LockConflict,)),
+        "cleanup": (0.02, cleanup, ()),
+    }
+
+def api_scenarios():
+    class HTTPError(Exception):
+        pass
+
+    def call(ctx, method, url, ok = (200, 201, 204), **kwargs):
+        response = ctx.client.request(method, url, **kwargs)
+        if response.status_code not in ok:
+            raise HTTPError(f"{method} {url}: {response.status_code} {response.text[:200]}")
+        return response
+
+    # One page of results, like a client would ask for; no match is a 404
+    search = lambda params: lambda ctx: lambda i: call(ctx, "GET", "/products/search", ok = (200, 404),
+                                                       params = {**params(ctx), "limit": config.PAGE_SIZE})
+
+    def create(ctx):
+        return lambda i: call(ctx, "POST", "/products/", json = ctx.work.new_product().model_dump())
+
+    def get_cached(ctx):
+        hot = [ctx.work.product_id() for _ in range(200)]
+        return lambda i: call(ctx, "GET", f"/products/{ctx.work.rng.choice(hot)}")
+
+    def bulk_edit(ctx):
+        def op(i):
+            for _ in range(100):
+                call(ctx, "PUT", f"/products/{ctx.work.product_id()}",
+                     json = {"price_rmb": round(ctx.work.rng.uniform(1, 99), 2)})
+        return op
+
+    def lock_churn(ctx):
+        hot = [ctx.work.product_id() for _ in range(50)]
+        users = ["alice", "bob", "carol", "dave"]
+        def op(i):
+            product_id, user = ctx.work.rng.choice(hot), ctx.work.rng.choice(users)
+            call(ctx, "PATCH", f"/products/{product_id}/lock", params = {"user": user}, json = {"locked": True})
+            if ctx.work.rng.random() < 0.7:
+                call(ctx, "PATCH", f"/products/{product_id}/lock", params = {"user": user}, json = {"locked": False})
+        return op
+
+    def cleanup(ctx):
+        # Same batch as the CRUD layer, then the maintenance endpoint reclaims the freed pages
+        def op(i):
+            for _ in range(20):
+                call(ctx, "DELETE", f"/products/{ctx.work.product_id()}", ok = (204, 404))
+            call(ctx, "POST", "/admin/maintenance")
+        return op
+
+    return {
+        "create": (1, create, ()),
+        "get": (2, lambda ctx: lambda i: call(ctx, "GET", f"/products/{ctx.work.product_id()}"), ()),
+        "get_cached": (2, get_cached, ()),
+        "list_page": (1, lambda ctx: lambda i: call(ctx, "GET", "/products"), ()),
+        "search_name": (1, search(lambda ctx: {"name": ctx.work.word()}), ()),
+        "search_tag": (1, search(lambda ctx: {"tag": ctx.work.tag()}), ()),
+        "search_customer": (1, search(lambda ctx: {"customer": ctx.work.customer()}), ()),
+        "search_barcode": (1, search(lambda ctx: {"barcode": ctx.work.barcode()}), ()),
+        "search_ref_num": (1, search(lambda ctx: {"ref_num": ctx.work.ref_num()}), ()),
+        "search_text": (1, search(lambda ctx: {"q": f"{ctx.work.word()} {ctx.work.word()}"}), ()),
+        "bulk_edit": (0.1, bulk_edit, ()),
+        "lock_churn": (1, lock_churn, (HTTPError,)),
+        "cleanup": (0.02, cleanup, ()),
+    }
+
+
+class Context:
+    pass
+
+def working_copy(catalog, directory):
+    # Fresh copy of the catalog for one layer, so write scenarios never leak between runs
+    db_name = os.path.join(directory, "bench.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_name + suffix):
+            os.remove(db_name + suffix)
+    source, target = sqlite3.connect(catalog), sqlite3.connect(db_name)
+    source.backup(target)
+    source.close()
+    target.close()
+    return db_name
+
+def run_scenarios(ctx, scenarios, selected, ops, seed):
+    results = {}
+    for name, (weight, factory, expected) in scenarios.items():
+        if selected and name not in selected:
+            continue
+        ctx.work.rng.seed(f"{seed}-{name}")
+        results[name] = measure(factory(ctx), max(1, int(ops * weight)), expected)
+        print(f"  {name:<16} p50 {results[name]['p50_ms']:>9} ms  p99 {results[name]['p99_ms']:>9} ms  "
+              f"{results[name]['ops_per_sec']:>9} ops/s  ({results[name]['errors']} errors)")
+    return results
+
+def run_crud(catalog, tmp, selected, ops, seed):
+    db_name = working_copy(catalog, tmp)
+    ctx = Context()
+    ctx.work = Workload(db_name, seed)
+    ctx.conn = sqlite3.connect(db_name)
+    ctx.conn.row_factory = sqlite3.Row
+    ctx.conn.execute("PRAGMA foreign_keys = ON")
+    apply_storage_profile(ctx.conn)
+    ctx.cursor = ctx.conn.cursor()
+    try:
+        return run_scenarios(ctx, crud_scenarios(), selected, ops, seed)
+    finally:
+        ctx.conn.close()
+
+def run_api(catalog, tmp, selected, ops, seed):
+    from fastapi.testclient import TestClient
+    from api.api import app
+
+    db_name = working_copy(catalog, tmp)
+    def bench_db():
+        with open_db(db_name) as session:
+            yield session
+    app.dependency_overrides[get_db] = bench_db
+    app.dependency_overrides[get_db_factory] = lambda: functools.partial(open_db, db_name)
+    app.dependency_overrides[get_db_writer] = lambda: get_writer(db_name)
+    product_cache.clear()
+    ctx = Context()
+    ctx.work = Workload(db_name, seed)
+    ctx.client = TestClient(app)
+    try:
+        return run_scenarios(ctx, api_scenarios(), selected, ops, seed)
+    finally:
+        app.dependency_overrides.clear()
+        product_cache.clear()
+        stop_writers()
+        close_pools()
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True, text = True,
+                              cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(baseline, results):
+    # Prints p50 / p99 of results against baseline, per layer and scenario
+    for layer, scenarios in results["results"].items():
+        print(f"{layer} vs {baseline['meta'].get('commit')}:")
+        for name, new in scenarios.items():
+            old = baseline["results"].get(layer, {}).get(name)
+            if not old:
+                continue
+            change = lambda key: f"{(new[key] / old[key] - 1) * 100:+6.1f}%" if old[key] and new[key] else "   n/a"
+            print(f"  {name:<16} p50 {old['p50_ms']:>9} -> {new['p50_ms']:>9} ms {change('p50_ms')}  "
+                  f"p99 {old['p99_ms']:>9} -> {new['p99_ms']:>9} ms {change('p99_ms')}")
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type = int, default = 100000)
+    parser.add_argument("--seed", type = int, default = 42)
+    parser.add_argument("--ops", type = int, default = 300, help = "operations per scenario (scaled per scenario)")
+    parser.add_argument("--layers", default = "crud,api")
+    parser.add_argument("--scenarios", help = "comma-separated subset of scenarios")
+    parser.add_argument("--catalog", help = "use this catalog instead of generating one")
+    parser.add_argument("--json", help = "write results to this file")
+    parser.add_argument("--compare", help = "earlier results file to compare against")
+    args = parser.parse_args()
+
+    catalog = args.catalog or ensure_catalog(args.products, args.seed)
+    selected = set(args.scenarios.split(",")) if args.scenarios else None
+    runners = {"crud": run_crud, "api": run_api}
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "time": datetime.now(timezone.utc).isoformat(timespec = "seconds"),
+            "products": args.products,
+            "seed": args.seed,
+            "ops": args.ops,
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "async_db": config.ASYNC_DB,
+            "writer": config.WRITER_ENABLED,
+        },
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for layer in args.layers.split(","):
+            print(f"{layer}:")
+            results["results"][layer] = runners[layer](catalog, tmp, selected, args.ops, args.seed)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent = 2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import os
+
+"""Runtime settings, read once from environment variables (PM_*) with defaults for local use."""
+
+
+def env_str(name, default):
+    return os.environ.get(name, default)
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+def env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value not in (None, "") else default
+
+def env_bool(name, default):
+    value = os.environ.get(name)
+    if value in (None, ""):
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Database
+DB_NAME = env_str("PM_DB_NAME", "product_manager.db")
+
+# Connection pool
+POOL_SIZE = env_int("PM_POOL_SIZE", 10)
+POOL_TIMEOUT = env_float("PM_POOL_TIMEOUT", 30.0)          # seconds to wait for a free connection
+POOL_MAX_USES = env_int("PM_POOL_MAX_USES", 10000)         # recycle a connection after this many checkouts
+POOL_MAX_AGE = env_float("PM_POOL_MAX_AGE", 3600.0)        # recycle a connection after this many seconds
+
+# Async DB execution (see database/executor.py); keep the workers' sum <= POOL_SIZE
+ASYNC_DB = env_bool("PM_ASYNC_DB", True)                   # False: routes run on Starlette's threadpool
+DB_READ_WORKERS = env_int("PM_DB_READ_WORKERS", 3)         # point reads, e.g. GET /products/{id}
+DB_QUERY_WORKERS = env_int("PM_DB_QUERY_WORKERS", 3)       # searches, listings, change feed
+DB_WRITE_WORKERS = env_int("PM_DB_WRITE_WORKERS", 2)
+DB_LOCK_WORKERS = env_int("PM_DB_LOCK_WORKERS", 2)         # lock routes, which may wait up to PM_LOCK_MAX_WAIT
+DB_EXECUTOR_MAX_QUEUE = env_int("PM_DB_EXECUTOR_MAX_QUEUE", 64)  # waiting calls per lane before 503
+
+# Single writer with group commit (see database/writer.py)
+WRITER_ENABLED = env_bool("PM_WRITER_ENABLED", True)      # False: write routes use the write lane's pooled connections
+WRITER_MAX_BATCH = env_int("PM_WRITER_MAX_BATCH", 64)      # jobs per transaction
+WRITER_MAX_DELAY = env_float("PM_WRITER_MAX_DELAY", 0.0)   # seconds to wait for more jobs before committing
+WRITER_MAX_QUEUE = env_int("PM_WRITER_MAX_QUEUE", 1024)    # queued jobs before 503
+WRITER_BEGIN_RETRIES = env_int("PM_WRITER_BEGIN_RETRIES", 4)  # BEGIN retries (after busy_timeout) before a batch fails
+WRITER_BEGIN_BACKOFF = env_float("PM_WRITER_BEGIN_BACKOFF", 0.05)  # seconds before the first retry, doubling
+
+# Storage profile (see database/storage.py)
+JOURNAL_MODE = env_str("PM_JOURNAL_MODE", "WAL")
+SYNCHRONOUS = env_str("PM_SYNCHRONOUS", "NORMAL")
+CACHE_SIZE = env_int("PM_CACHE_SIZE", -65536)              # negative = KiB, so 64 MiB per connection
+MMAP_SIZE = env_int("PM_MMAP_SIZE", 268435456)             # 256 MiB
+TEMP_STORE = env_str("PM_TEMP_STORE", "MEMORY")
+BUSY_TIMEOUT = env_int("PM_BUSY_TIMEOUT", 5000)            # milliseconds
+WAL_AUTOCHECKPOINT = env_int("PM_WAL_AUTOCHECKPOINT", 1000)  # pages
+CHECKPOINT_INTERVAL = env_float("PM_CHECKPOINT_INTERVAL", 60.0)  # seconds; 0 disables
+
+# Online maintenance: ANALYZE, PRAGMA optimize, incremental vacuum (see database/maintenance.py)
+VACUUM_STEP_PAGES = env_int("PM_VACUUM_STEP_PAGES", 256)    # free pages released per write transaction
+MAINTENANCE_PAUSE = env_float("PM_MAINTENANCE_PAUSE", 0.05)  # seconds between maintenance steps
+ANALYSIS_LIMIT = env_int("PM_ANALYSIS_LIMIT", 1000)         # index rows ANALYZE samples per index; 0 = all
+MAINTENANCE_PROBE_ROUNDS = env_int("PM_MAINTENANCE_PROBE_ROUNDS", 5)  # timed probe runs before / after; 0 skips
+
+# Query instrumentation (see database/instrument.py)
+QUERY_STATS = env_bool("PM_QUERY_STATS", False)            # per-statement timing, served at /debug/queries
+SLOW_QUERY_MS = env_float("PM_SLOW_QUERY_MS", 100.0)       # log statements slower than this with their plan
+QUERY_STATS_MAX_STATEMENTS = env_int("PM_QUERY_STATS_MAX_STATEMENTS", 1000)  # distinct statements tracked
+
+# Request metrics (see api/metrics.py)
+METRICS_ENABLED = env_bool("PM_METRICS", True)             # per-route latency / status metrics, served at /metrics
+
+# Listing / pagination
+PAGE_SIZE = env_int("PM_PAGE_SIZE", 50)
+MAX_PAGE_SIZE = env_int("PM_MAX_PAGE_SIZE", 500)
+
+# Quote history (see crud/quote_crud.py)
+QUOTE_HISTORY_LIMIT = env_int("PM_QUOTE_HISTORY_LIMIT", 500)          # default points per history response
+MAX_QUOTE_HISTORY_LIMIT = env_int("PM_MAX_QUOTE_HISTORY_LIMIT", 5000)
+ANALYTICS_CACHE_SIZE = env_int("PM_ANALYTICS_CACHE_SIZE", 64)         # cached analytics results; 0 disables
+
+# Change feed (see crud/change_crud.py)
+CHANGE_RETENTION = env_int("PM_CHANGE_RETENTION", 100000)   # delete tombstones kept, counted in changes; older
+                                                             # ones are pruned by the orphan cleaner
+
+# Product lease locks (see crud/lock_crud.py)
+LOCK_TTL = env_int("PM_LOCK_TTL", 300)                       # seconds a lock lasts without renewal
+LOCK_REAP_INTERVAL = env_float("PM_LOCK_REAP_INTERVAL", 60.0)  # seconds; 0 disables the reaper
+LOCK_MAX_WAIT = env_float("PM_LOCK_MAX_WAIT", 10.0)          # longest a lock request may wait for a holder
+
+# Orphan cleanup (see crud/maintenance_crud.py)
+CLEANUP_INTERVAL = env_float("PM_CLEANUP_INTERVAL", 3600.0)  # seconds between background runs; 0 disables
+CLEANUP_BATCH_SIZE = env_int("PM_CLEANUP_BATCH_SIZE", 1000)  # rows scanned per write transaction
+CLEANUP_PAUSE = env_float("PM_CLEANUP_PAUSE", 0.01)          # seconds the cleaner yields between batches
+
+# Hydrated product cache (see crud/cache.py)
+PRODUCT_CACHE_SIZE = env_int("PM_PRODUCT_CACHE_SIZE", 10000)          # max products; 0 disables the cache
+PRODUCT_CACHE_MAX_BYTES = env_int("PM_PRODUCT_CACHE_MAX_BYTES", 67108864)  # approximate memory budget, 64 MiB
+PRODUCT_CACHE_TTL = env_float("PM_PRODUCT_CACHE_TTL", 300.0)          # seconds; bounds staleness from other writers
+CUSTOMER_CACHE_SIZE = env_int("PM_CUSTOMER_CACHE_SIZE", 50000)        # customer name -> id entries; 0 disables
+CUSTOMER_CACHE_TTL = env_float("PM_CUSTOMER_CACHE_TTL", 300.0)        # seconds; bounds staleness from other writers
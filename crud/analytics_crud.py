@@ -0,0 +1,186 @@
+from models import *
+import math
+import bisect
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+import config
+from crud.quote_crud import QUOTE_BUCKETS, parse_history_bound
+
+logging.basicConfig(level=logging.INFO)
+
+"""
+Catalog-wide quote analytics. Quote rows are read in bulk and transposed into typed columns
+(array.array), sorted by their group key in SQL so every group is one contiguous slice, and
+each slice is aggregated in one pass (plus a sort for the percentiles).
+Results are cached by parameters and tagged with quote_generation (migration 9), so they are
+served from memory until the next write that can change them.
+"""
+
+FETCH_SIZE = 5000
+PRICE_COLUMNS = {"usd": "p.price_usd", "rmb": "p.price_rmb"}
+
+
+class AnalyticsCache:
+    """
+    Analytics results keyed by (name, parameters), each valid while quote_generation is unchanged.
+    The generation is read before the data, so a write landing mid-computation only costs a
+    recompute on the next request. Holds results of one database; tests that swap databases must clear() it.
+    """
+
+    def __init__(self, max_entries = config.ANALYTICS_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (generation, result); most recent last
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, cursor, key, compute):
+        # Cached result for key if still current, else compute(generation) and keep it
+        generation = quote_generation(cursor)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generation:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[1]
+            self._misses += 1
+        result = compute(generation)
+        if self.max_entries > 0:
+            with self._lock:
+                self._entries[key] = (generation, result)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last = False)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._hits = self._misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {"entries": len(self._entries), "max_entries": self.max_entries, "hits": self._hits,
+                    "misses": self._misses, "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0}
+
+# Cache for the application database (config.DB_NAME); used by the analytics API
+quote_analytics = AnalyticsCache()
+
+
+def quote_generation(cursor):
+    return cursor.execute("SELECT generation FROM quote_generation WHERE id = 1").fetchone()[0]
+
+def percentile(ordered, q):
+    # Linear interpolation between the closest ranks of a sorted sequence (NumPy's default)
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * q
+    low, high = math.floor(position), math.ceil(position)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+def summarize(values):
+    # count, min, max, avg, median, p10 and p90 of a column slice
+    if not values:
+        return {"count": 0, "min": None, "max": None, "avg": None, "median": None, "p10": None, "p90": None}
+    ordered = sorted(values)
+    return {"count": len(ordered), "min": ordered[0], "max": ordered[-1],
+            "avg": round(math.fsum(ordered) / len(ordered), 4),
+            "median": round(percentile(ordered, 0.5), 4),
+            "p10": round(percentile(ordered, 0.1), 4),
+            "p90": round(percentile(ordered, 0.9), 4)}
+
+def _load_columns(cursor, sql, params, typecodes):
+    # Runs sql and transposes its rows into one array per column, FETCH_SIZE rows at a time
+    columns = [array(code) for code in typecodes]
+    cursor.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            return columns
+        for column, values in zip(columns, zip(*rows)):
+            column.extend(values)
+
+def _group_slices(keys):
+    # (key, start, end) for each run of equal values in a sorted column
+    start = 0
+    while start < len(keys):
+        end = bisect.bisect_right(keys, keys[start], lo = start)
+        yield keys[start], start, end
+        start = end
+
+def _margins(quotes, prices):
+    # (quote - price) / quote where both are positive; a price of 0 means the product has none
+    return array("d", [(quote - price) / quote for quote, price in zip(quotes, prices) if quote > 0 and price > 0])
+
+
+def quote_summary(conn, cursor, history = False, currency = "usd", cache = None):
+    # Per customer: quote count, distinct products, quote min / max / avg / median / p10 / p90, and
+    # the margin of each quote over the product's price_usd (currency="rmb": price_rmb; the quotes
+    # are taken to be in that currency). Current quotes unless history; deleted products are left out.
+    # cache (an AnalyticsCache) keeps the result until the next quote write
+    if currency not in PRICE_COLUMNS:
+        raise ValueError(f"currency must be one of {', '.join(PRICE_COLUMNS)}")
+    if cache is not None:
+        return cache.get(cursor, ("summary", history, currency),
+                         lambda generation: _quote_summary(cursor, history, currency, generation))
+    return _quote_summary(cursor, history, currency, quote_generation(cursor))
+
+def _quote_summary(cursor, history, currency, generation):
+    table = "quotes" if history else "current_quotes"
+    customers, products, quotes, prices = _load_columns(cursor, f"""
+        SELECT q.customer_id, q.product_id, q.quote, COALESCE({PRICE_COLUMNS[currency]}, 0)
+        FROM {table} q JOIN product_manager p ON p.id = q.product_id
+        WHERE p.deleted = 0 AND q.customer_id IS NOT NULL AND q.quote IS NOT NULL
+        ORDER BY q.customer_id""", (), "qqdd")
+    names = dict(cursor.execute("SELECT id, customer_name FROM customers").fetchall())
+
+    groups = []
+    for customer_id, start, end in _group_slices(customers):
+        if customer_id not in names:
+            continue
+        group_quotes = quotes[start:end]
+        groups.append({"customer_id": customer_id, "customer_name": names[customer_id],
+                       "products": len(set(products[start:end])),
+                       "quotes": summarize(group_quotes),
+                       "margin": summarize(_margins(group_quotes, prices[start:end]))})
+    return {"history": history, "currency": currency, "generation": generation,
+            "overall": summarize(quotes), "overall_margin": summarize(_margins(quotes, prices)),
+            "customers": groups}
+
+
+def quote_drift(conn, cursor, bucket = "month", customer_id = None, since = None, until = None, cache = None):
+    # Price drift per period: every quote in [since, until) divided by the first quote ever given
+    # for its product and customer, summarized per period (median 1.05 = typically 5% above the
+    # opening quote). Reads the quote history in idx_quotes_history order
+    if bucket not in QUOTE_BUCKETS:
+        raise ValueError(f"bucket must be one of {', '.join(QUOTE_BUCKETS)}")
+    since = parse_history_bound(since, "since")
+    until = parse_history_bound(until, "until")
+    if cache is not None:
+        return cache.get(cursor, ("drift", bucket, customer_id, since, until),
+                         lambda generation: _quote_drift(cursor, bucket, customer_id, since, until, generation))
+    return _quote_drift(cursor, bucket, customer_id, since, until, quote_generation(cursor))
+
+def _quote_drift(cursor, bucket, customer_id, since, until, generation):
+    where, params = "", ()
+    if customer_id is not None:
+        where, params = "AND q.customer_id = ?", (customer_id,)
+    rows = cursor.execute(f"""SELECT q.product_id, q.customer_id, q.timestamp, {QUOTE_BUCKETS[bucket]}, q.quote
+                              FROM quotes q JOIN product_manager p ON p.id = q.product_id
+                              WHERE p.deleted = 0 AND q.customer_id IS NOT NULL AND q.quote IS NOT NULL {where}
+                              ORDER BY q.product_id, q.customer_id, q.timestamp""", params)
+
+    ratios = {}   # period -> array of quote / opening quote
+    pair, opening = None, None
+    for product_id, customer, timestamp, period, quote in rows:
+        if (product_id, customer) != pair:
+            pair, opening = (product_id, customer), quote
+        if opening <= 0 or (since is not None and timestamp < since) or (until is not None and timestamp >= until):
+            continue
+        ratios.setdefault(period, array("d")).append(quote / opening)
+    points = [{"period": period, "ratio": summarize(values)} for period, values in sorted(ratios.items())]
+    return {"bucket": bucket, "customer_id": customer_id, "since": since, "until": until,
+            "generation": generation, "points": points}
@@ -0,0 +1,268 @@
+import json
+import time
+import threading
+from collections import OrderedDict
+import config
+from database.connection import on_commit
+
+
+class ProductCache:
+    """
+    In-process LRU cache of hydrated products (format_products dicts) keyed by product id,
+    bounded by entry count, an approximate byte budget and a TTL.
+
+    Writers call invalidate(conn, ids) when they change a product. The entries are dropped
+    right away and again once the writer's transaction ends (see database.connection.on_commit),
+    and every invalidation bumps a generation so a reader that loaded a product before the
+    change was committed cannot put the old version back.
+
+    Cached dicts are shared between callers: treat them as read-only.
+    Holds products of one database; tests that swap databases must clear() it.
+    """
+
+    def __init__(self, max_entries = config.PRODUCT_CACHE_SIZE, max_bytes = config.PRODUCT_CACHE_MAX_BYTES,
+                 ttl = config.PRODUCT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # product_id -> (product, size, expires); most recent last
+        self._bytes = 0
+        self._epoch = 0                 # bumped by every invalidation
+        self._dirty = {}                # product_id -> epoch of its last invalidation
+        self._floor = 0                 # loads that started before this epoch are not cached
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+        self._rejected = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    # Reads
+
+    def get_many(self, product_ids, load):
+        # Cached products for product_ids, in order; load(missing_ids) hydrates the rest.
+        # Unknown ids are skipped, like format_products
+        if not self.enabled:
+            return load(product_ids)
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            token = self._epoch
+            for product_id in product_ids:
+                entry = self._entries.get(product_id)
+                if entry is None:
+                    continue
+                if entry[2] <= now:
+                    self._drop(product_id)
+                    self._expirations += 1
+                    continue
+                self._entries.move_to_end(product_id)
+                found[product_id] = entry[0]
+            missing = [pid for pid in dict.fromkeys(product_ids) if pid not in found]
+            self._hits += len(found)
+            self._misses += len(missing)
+
+        if missing:
+            for product in load(missing):
+                found[product["id"]] = product
+                self._put(product, token)
+        return [found[pid] for pid in product_ids if pid in found]
+
+    def _put(self, product, token):
+        size = len(json.dumps(product, default = str))
+        if size > self.max_bytes:
+            return
+        product_id = product["id"]
+        with self._lock:
+            if token < self._floor or self._dirty.get(product_id, -1) > token:
+                # Changed while it was being loaded; the loaded copy may predate the change
+                self._rejected += 1
+                return
+            self._drop(product_id)
+            self._entries[product_id] = (product, size, time.monotonic() + self.ttl)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._evictions += 1
+
+    def _drop(self, product_id):
+        # Caller holds the lock
+        entry = self._entries.pop(product_id, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    # Writes
+
+    def invalidate(self, conn, product_ids):
+        # Drop products changed on conn now, and again after conn's transaction ends
+        if not self.enabled:
+            return
+        product_ids = set(product_ids)
+        if not product_ids:
+            return
+        self._evict(product_ids)
+        on_commit(conn, self._settle, product_ids)
+
+    def _settle(self, conn, product_ids):
+        self._evict(product_ids)
+
+    def _evict(self, product_ids):
+        with self._lock:
+            self._epoch += 1
+            for product_id in product_ids:
+                if product_id in self._entries:
+                    self._drop(product_id)
+                    self._invalidations += 1
+                self._dirty[product_id] = self._epoch
+            if len(self._dirty) > max(self.max_entries, 1024) * 4:
+                # Forget per-product generations; loads already in flight are simply not cached
+                self._dirty.clear()
+                self._floor = self._epoch
+
+    def clear(self):
+        # Drop every entry and reset the counters
+        with self._lock:
+            self._hits = self._misses = self._evictions = self._expirations = 0
+            self._invalidations = self._rejected = 0
+            self._entries.clear()
+            self._bytes = 0
+            self._dirty.clear()
+            self._epoch += 1
+            self._floor = self._epoch
+
+    # Introspection
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "invalidations": self._invalidations,
+                "rejected": self._rejected,
+            }
+
+
+# Cache for the application database (config.DB_NAME); used by the API read paths
+product_cache = ProductCache()
+
+def invalidate_products(conn, product_ids):
+    product_cache.invalidate(conn, product_ids)
+
+def invalidate_products_where(conn, cursor, sql, params):
+    # Fan-out invalidation: drop every product id returned by sql (first column)
+    if product_cache.enabled:
+        product_cache.invalidate(conn, [row[0] for row in cursor.execute(sql, params).fetchall()])
+
+
+class CustomerNameCache:
+    """
+    Bounded LRU map of customer names (folded like customer_name's NOCASE collation) to ids,
+    for resolving names in bulk without a lookup per row. Only names that exist are cached.
+    Renames, merges and deletions call invalidate(conn) (or invalidate(conn, names)); like
+    ProductCache the entries are dropped now and again when the writer's transaction ends, and
+    a load that started before an invalidation is not cached. Entries also expire after ttl
+    seconds, which bounds staleness from changes made by other processes.
+    Holds customers of one database; tests that swap databases must clear() it.
+    """
+
+    def __init__(self, max_entries = config.CUSTOMER_CACHE_SIZE, ttl = config.CUSTOMER_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # folded name -> (customer id, expires); most recent last
+        self._epoch = 0
+        self._hits = 0
+        self._misses = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get_many(self, keys, load):
+        # {key: id} for the keys that exist; load(missing_keys) -> {key: id} reads the rest
+        if not self.enabled:
+            return load(list(dict.fromkeys(keys)))
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            token = self._epoch
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[1] <= now:
+                    del self._entries[key]
+                    self._expirations += 1
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = entry[0]
+            missing = [key for key in dict.fromkeys(keys) if key not in found]
+            self._hits += len(keys) - len(missing)
+            self._misses += len(missing)
+        if missing:
+            loaded = load(missing)
+            found.update(loaded)
+            with self._lock:
+                if token == self._epoch:
+                    expires = time.monotonic() + self.ttl
+                    self._entries.update((key, (customer_id, expires)) for key, customer_id in loaded.items())
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last = False)
+        return found
+
+    def invalidate(self, conn, keys = None):
+        # Drop keys (None: every entry) now, and again after conn's transaction ends
+        if not self.enabled:
+            return
+        self._evict(keys)
+        on_commit(conn, self._settle, keys)
+
+    def _settle(self, conn, keys):
+        self._evict(keys)
+
+    def _evict(self, keys):
+        with self._lock:
+            self._epoch += 1
+            if keys is None:
+                self._invalidations += len(self._entries)
+                self._entries.clear()
+                return
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self._invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._epoch += 1
+            self._hits = self._misses = self._expirations = self._invalidations = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {"entries": len(self._entries), "max_entries": self.max_entries, "ttl": self.ttl,
+                    "hits": self._hits, "misses": self._misses,
+                    "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                    "expirations": self._expirations, "invalidations": self._invalidations}
+
+# Customer names of the application database (config.DB_NAME)
+customer_name_cache = CustomerNameCache()
+
@@ -0,0 +1,66 @@
+from models import *
+import logging
+import config
+from crud.utils import encode_cursor, decode_cursor
+
+logging.basicConfig(level=logging.INFO)
+
+
+class ChangesPruned(Exception):
+    # The client's token predates pruned tombstones; it has to resync the full catalog
+    pass
+
+
+def encode_change_token(seq):
+    return encode_cursor(["seq", seq])
+
+def decode_change_token(token):
+    # None / "" -> 0, i.e. everything
+    if not token:
+        return 0
+    values = decode_cursor(token)
+    if len(values) != 2 or values[0] != "seq" or not isinstance(values[1], int) or values[1] < 0:
+        raise ValueError("Invalid token")
+    return values[1]
+
+def list_changes(conn, cursor, since=None, limit=config.MAX_PAGE_SIZE):
+    # Products changed after the since token (None: all of them, i.e. a full sync), oldest change
+    # first, compacted to their latest state.
+    # Returns {"upserted": [ids], "deleted": [ids], "next_token": str, "has_more": bool};
+    # read every page until has_more is false, then keep next_token for the next sync.
+    # Cost is one index range scan over the changes, independent of catalog size
+    since_seq = decode_change_token(since)
+    limit = max(1, min(int(limit), config.MAX_PAGE_SIZE))
+    pruned_seq = cursor.execute("SELECT pruned_seq FROM change_sequence WHERE id = 1").fetchone()[0]
+    if since and since_seq < pruned_seq:
+        raise ChangesPruned("Token is older than the retained change history; resync from scratch")
+
+    rows = cursor.execute("""SELECT product_id, seq, deleted FROM product_changes
+                             WHERE seq > ? ORDER BY seq LIMIT ?""", (since_seq, limit + 1)).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "upserted": [row[0] for row in rows if not row[2]],
+        "deleted": [row[0] for row in rows if row[2]],
+        # Only advance past what was returned, so a change committed meanwhile is never skipped
+        "next_token": encode_change_token(rows[-1][1] if rows else since_seq),
+        "has_more": has_more,
+    }
+
+def current_change_token(conn, cursor):
+    # Token meaning "up to date now", e.g. to hand out after a full download
+    return encode_change_token(cursor.execute("SELECT seq FROM change_sequence WHERE id = 1").fetchone()[0])
+
+def prune_changes(conn, cursor, keep=config.CHANGE_RETENTION):
+    # Drop tombstones of all but the newest keep changes; clients holding an older token get
+    # ChangesPruned and resync. Live products keep their row, so their latest change is never lost
+    seq = cursor.execute("SELECT seq FROM change_sequence WHERE id = 1").fetchone()[0]
+    floor = cursor.execute("SELECT MAX(seq) FROM product_changes WHERE deleted = 1 AND seq <= ?",
+                           (seq - keep,)).fetchone()[0]
+    if floor is None:
+        return 0
+    cursor.execute("DELETE FROM product_changes WHERE deleted = 1 AND seq <= ?", (floor,))
+    pruned = cursor.rowcount
+    cursor.execute("UPDATE change_sequence SET pruned_seq = MAX(pruned_seq, ?) WHERE id = 1", (floor,))
+    logging.info("Pruned %d change tombstones up to seq %d", pruned, floor)
+    return pruned
@@ -4,6 +4,12 @@ from crud.customer_crud import *
 from crud.tag_crud import *
 from crud.quote_crud import *
 from crud.misc_crud import *
+from crud.search_crud import *
+from crud.cache import *
+from crud.change_crud import *
+from crud.lock_crud import *
+from crud.analytics_crud import *
+from crud.maintenance_crud import *
 
 
 """Entry file for all CRUD functions at database level.
@@ -12,11 +18,17 @@ Following naming convention e.g. add_product in this layer"""
 
 """
 Here are all function names, up to date as of June 8, 2025
-from crud.product_crud import add_product, delete_product, search_products, search_product_name, edit_product, format_product, list_products
+from crud.product_crud import add_product, add_products_bulk, check_version, VersionConflict, delete_product, search_products, search_product_ids, search_products_page, search_product_ids_page, product_versions, search_product_name, search_products_text, edit_product, format_product, format_products, iter_products, list_products, list_products_page
 from crud.image_crud import add_image, delete_image, list_images
-from crud.customer_crud import add_customer, delete_customer_from_product, search_by_customer, edit_customer, list_customer, list_product_customer
-from crud.tag_crud import add_tag, delete_tag_from_product, edit_tag, list_tag, list_product_tag
-from crud.quote_crud import add_quote, delete_quote, edit_quote, list_quote
-from crud.misc_crud import search_by_barcode, search_by_ref_num, locked_product, unlock_product, clean_orphaned_data
+from crud.customer_crud import add_customer, resolve_customer_ids, lookup_customer_ids, delete_customer_from_product, search_by_customer, edit_customer, list_customer, list_product_customer
+from crud.tag_crud import add_tag, resolve_tag_ids, delete_tag_from_product, edit_tag, list_tag, list_product_tag
+from crud.quote_crud import add_quote, add_quotes_bulk, delete_quote, edit_quote, list_quote, get_quote_by_id, quote_history, parse_history_bound
+from crud.misc_crud import search_by_barcode, search_by_ref_num, locked_product, unlock_product
+from crud.search_crud import build_product_search, find_product_ids, reindex_search, suspend_search_index
+from crud.cache import ProductCache, product_cache, invalidate_products, invalidate_products_where, CustomerNameCache, customer_name_cache
+from crud.change_crud import list_changes, current_change_token, prune_changes, encode_change_token, decode_change_token, ChangesPruned
+from crud.lock_crud import acquire_lock, acquire_locks, renew_lock, release_lock, release_locks, force_unlock, reap_expired_locks, count_active_locks, start_lock_reaper, LockConflict, LockMetrics, lock_metrics
+from crud.analytics_crud import quote_summary, quote_drift, quote_generation, summarize, percentile, AnalyticsCache, quote_analytics
+from crud.maintenance_crud import clean_orphaned_data, clean_orphans, delete_orphans_batch, start_orphan_cleaner, CleanupMetrics, cleanup_metrics
 
 """
\ No newline at end of file
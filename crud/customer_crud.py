@@ -1,34 +1,73 @@
 from models import *
 import logging
-from crud.utils import raise_value_error_if_not_found, raise_value_error_if_empty
+from crud.utils import raise_value_error_if_not_found, raise_value_error_if_empty, chunked, nocase
+from crud.search_crud import suspend_search_index
+from crud.cache import invalidate_products, invalidate_products_where, customer_name_cache
 
 logging.basicConfig(level=logging.INFO)
 
 def add_customer(conn, cursor, product_id, customers):
     # Link customers to product
-    # Create customer entries if they don't exist
-    for c in customers:
-        cursor.execute("INSERT OR IGNORE INTO customers(customer_name) VALUES(?)",
-                            (c,))
-        cursor.execute("SELECT id FROM customers WHERE customer_name =?", (c,))
-        customer_id = cursor.fetchone()[0]
-        cursor.execute("""INSERT OR IGNORE INTO product_customers (product_id, customer_id)
-                            VALUES (?, ?)""", (product_id, customer_id))
+    # Create customer entries if they don't exist: one lookup, one multi-row insert for the new names,
+    # then a single executemany for the links, re-indexing the product for search once
+    customers = list(dict.fromkeys(customers or []))
+    if not customers:
+        return
+    invalidate_products(conn, [product_id])
+    customer_ids = resolve_customer_ids(conn, cursor, customers)
+    with suspend_search_index(conn, cursor, [product_id]):
+        cursor.executemany("""INSERT OR IGNORE INTO product_customers (product_id, customer_id)
+                                VALUES (?, ?)""", [(product_id, customer_ids[c]) for c in customers])
+
+def lookup_customer_ids(conn, cursor, customer_names, cache=None):
+    # Map existing customer names to ids (case-insensitive, like customer_name's NOCASE collation);
+    # unknown names are left out. Where a name was stored twice, the oldest row wins.
+    # cache (a crud.cache.CustomerNameCache) serves names resolved before
+    def load(keys):
+        found = {}
+        for chunk in chunked(keys):
+            cursor.execute(f"""SELECT MIN(id), customer_name FROM customers
+                               WHERE customer_name IN ({','.join('?' * len(chunk))})
+                               GROUP BY customer_name""", chunk)
+            found.update({nocase(name): customer_id for customer_id, name in cursor.fetchall()})
+        return found
+
+    keys = [nocase(name) for name in customer_names]
+    found = cache.get_many(keys, load) if cache is not None else load(list(dict.fromkeys(keys)))
+    return {name: found[key] for name, key in zip(customer_names, keys) if key in found}
+
+def resolve_customer_ids(conn, cursor, customer_names):
+    # Map customer names to ids, creating the missing customers with one multi-row insert per chunk
+    customer_ids = lookup_customer_ids(conn, cursor, customer_names)
+    missing = {}
+    for name in customer_names:
+        if name not in customer_ids:
+            missing.setdefault(nocase(name), name)  # first spelling of a new name is the one stored
+    missing = list(missing.values())
+    for chunk in chunked(missing):
+        cursor.execute(f"INSERT INTO customers(customer_name) VALUES {','.join(['(?)'] * len(chunk))}", chunk)
+    if missing:
+        # Not committed yet: a cached lookup in this transaction must not outlive a rollback
+        customer_name_cache.invalidate(conn, [nocase(name) for name in missing])
+        customer_ids.update(lookup_customer_ids(conn, cursor, [n for n in customer_names if n not in customer_ids]))
+    return customer_ids
 
 def delete_customer_from_product(conn, cursor, product_id, customer_id):
     # Unlink customer from product (customer stays in table)
     cursor.execute("DELETE FROM product_customers WHERE product_id = ? AND customer_id = ?",
                     (product_id, customer_id))
     raise_value_error_if_not_found(cursor, msg = "Customer was not linked to this product")
+    invalidate_products(conn, [product_id])
 
 def search_by_customer(conn, cursor, customer_name):
+    # Products linked to any customer whose name contains customer_name
     cursor.execute("SELECT id FROM customers WHERE customer_name LIKE ?", (f"%{customer_name}%",))
-    customer = cursor.fetchone()
-    raise_value_error_if_empty(customer,"Customer not found")
-    
-    customer_id = customer[0]
+    customer_ids = [row[0] for row in cursor.fetchall()]
+    raise_value_error_if_empty(customer_ids, "Customer not found")
 
-    cursor.execute("SELECT product_id FROM product_customers WHERE customer_id = ?", (customer_id,))
+    placeholders = ",".join("?" * len(customer_ids))
+    cursor.execute(f"""SELECT DISTINCT product_id FROM product_customers
+                       WHERE customer_id IN ({placeholders}) ORDER BY product_id""", customer_ids)
     product_ids = [row[0] for row in cursor.fetchall()]
 
     return product_ids
@@ -38,6 +77,11 @@ def edit_customer(conn, cursor, customer_id, new_name):
     cursor.execute("UPDATE customers SET customer_name = ? WHERE id = ?",
                     (new_name, customer_id))
     raise_value_error_if_not_found(cursor, msg = "Customer not found")
+    customer_name_cache.invalidate(conn)
+    # Every product linked to or quoted for this customer changes
+    invalidate_products_where(conn, cursor, """SELECT product_id FROM product_customers WHERE customer_id = ?
+                                               UNION SELECT product_id FROM quotes WHERE customer_id = ?""",
+                              (customer_id, customer_id))
     return cursor.execute("SELECT id, customer_name FROM customers WHERE id = ?", (customer_id,)).fetchone()
 
 def list_customer(cursor):
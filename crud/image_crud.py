@@ -1,6 +1,7 @@
 from models import *
 import logging
 from crud.utils import raise_value_error_if_not_found, raise_value_error_if_empty
+from crud.cache import invalidate_products
 
 logging.basicConfig(level=logging.INFO)
 
@@ -9,12 +10,15 @@ def add_image(conn, cursor, product_id, img):
     # img is a list of strings (paths)
     cursor.executemany("INSERT INTO product_images(product_id, img) VALUES(?, ?)",
                         [(product_id, i) for i in img])
+    invalidate_products(conn, [product_id])
     return {"img": img}
     
-def delete_image(conn, cursor, image_id):
-    cursor.execute("DELETE FROM product_images WHERE id = ?",
-                        (image_id,))
-    raise_value_error_if_not_found(cursor, msg = "Image was not linked to this product")
+def delete_image(conn, cursor, image_id, product_id=None):
+    # With product_id, only an image of that product is deleted
+    rows = cursor.execute("""DELETE FROM product_images WHERE id = ? AND (? IS NULL OR product_id = ?)
+                             RETURNING product_id""", (image_id, product_id, product_id)).fetchall()
+    raise_value_error_if_empty(rows, msg = "Image was not linked to this product")
+    invalidate_products(conn, [rows[0][0]])
     return image_id
 
 def list_images(cursor):
@@ -0,0 +1,238 @@
+from models import *
+import time
+import logging
+import threading
+import config
+from crud.cache import invalidate_products
+from database.connection import open_db
+from database.scheduler import PeriodicTask
+
+logging.basicConfig(level=logging.INFO)
+
+"""
+Lease locks on products. A lock is the (locked_by, locked_timestamp) pair on product_manager;
+it expires ttl seconds after locked_timestamp, after which anyone may take it over and the
+reaper clears it. Acquire, renew and release are each one conditional UPDATE, so two users
+racing for a product cannot both win. Each call commits its own transaction, like the
+original locked_product / unlock_product; acquisition called inside an open transaction joins
+it instead and leaves the commit to the caller.
+"""
+
+
+class LockConflict(Exception):
+    # Raised when a product is held by someone else; holders maps product_id -> locked_by
+    def __init__(self, holders):
+        self.holders = holders
+        super().__init__("Locked by another user: " +
+                         ", ".join(f"product {pid} by {user}" for pid, user in holders.items()))
+
+
+class LockMetrics:
+    # Process-wide lock counters, served by GET /debug/locks
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.acquired = 0
+            self.renewed = 0
+            self.released = 0
+            self.reaped = 0
+            self.conflicts = 0      # attempts that found the product held by someone else
+            self.waits = 0          # acquisitions that had to wait for a holder
+            self.wait_time = 0.0
+            self.max_wait = 0.0
+            self.timeouts = 0       # gave up after waiting
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def record_wait(self, waited, acquired):
+        with self._lock:
+            self.waits += 1
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+            if not acquired:
+                self.timeouts += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "acquired": self.acquired,
+                "renewed": self.renewed,
+                "released": self.released,
+                "reaped": self.reaped,
+                "conflicts": self.conflicts,
+                "waits": self.waits,
+                "wait_time": round(self.wait_time, 6),
+                "max_wait": round(self.max_wait, 6),
+                "timeouts": self.timeouts,
+            }
+
+lock_metrics = LockMetrics()
+
+
+def _expired_before(ttl):
+    # datetime() modifier for "locked_timestamp is at least ttl seconds old";
+    # a lock without a timestamp (set before leases existed) counts as expired
+    return f"-{int(ttl)} seconds"
+
+def _holders(cursor, product_ids, user, ttl):
+    # Products among product_ids held by someone other than user (unexpired); raises if one does not exist
+    placeholders = ",".join("?" * len(product_ids))
+    rows = cursor.execute(f"""SELECT id, locked_by, locked_by IS NOT NULL AND locked_by != ?
+                                     AND locked_timestamp > datetime('now', ?)
+                              FROM product_manager WHERE id IN ({placeholders})""",
+                          [user, _expired_before(ttl)] + list(product_ids)).fetchall()
+    found = {row[0] for row in rows}
+    missing = [pid for pid in product_ids if pid not in found]
+    if missing:
+        raise ValueError(f"Product not found: {missing[0]}")
+    return {row[0]: row[1] for row in rows if row[2]}
+
+def _try_lock(conn, cursor, product_ids, user, ttl):
+    # One conditional UPDATE over every id, all or nothing; not committed. Returns the conflicting holders
+    placeholders = ",".join("?" * len(product_ids))
+    cursor.execute("SAVEPOINT lock_attempt")
+    try:
+        cursor.execute(f"""UPDATE product_manager SET locked_by = ?, locked_timestamp = CURRENT_TIMESTAMP
+                           WHERE id IN ({placeholders})
+                           AND (locked_by IS NULL OR locked_by = ? OR locked_timestamp IS NULL
+                                OR locked_timestamp <= datetime('now', ?))""",
+                       [user] + list(product_ids) + [user, _expired_before(ttl)])
+        holders = {} if cursor.rowcount == len(product_ids) else _holders(cursor, product_ids, user, ttl)
+    except:
+        cursor.execute("ROLLBACK TO lock_attempt")
+        cursor.execute("RELEASE lock_attempt")
+        raise
+    if holders:
+        # Undo the products that were free, so a partial lock never becomes visible
+        cursor.execute("ROLLBACK TO lock_attempt")
+    cursor.execute("RELEASE lock_attempt")
+    if not holders:
+        invalidate_products(conn, product_ids)
+    return holders
+
+def acquire_locks(conn, cursor, product_ids, user, ttl=config.LOCK_TTL, wait=0):
+    # Lock every product for user, or none of them. Free, expired and user's own locks are taken
+    # (re-acquiring renews). Held elsewhere: retry for up to wait seconds, then raise LockConflict.
+    # Commits only the transaction it starts: inside the caller's open transaction the lock joins it,
+    # and waiting is refused, since sleeping there would hold the write lock for the whole wait
+    product_ids = list(dict.fromkeys(product_ids))
+    if not user:
+        raise ValueError("user is required to lock a product")
+    if len(product_ids) > config.MAX_PAGE_SIZE:
+        raise ValueError(f"Cannot lock more than {config.MAX_PAGE_SIZE} products at once")
+    if not product_ids:
+        return []
+
+    wait = min(max(wait, 0), config.LOCK_MAX_WAIT)
+    owned = not conn.in_transaction
+    if wait and not owned:
+        raise ValueError("Cannot wait for a lock inside an open transaction")
+    start = time.monotonic()
+    delay = 0.01
+    waited = False
+    while True:
+        holders = _try_lock(conn, cursor, product_ids, user, ttl)
+        if owned:
+            conn.commit()  # also ends the write transaction before a retry sleeps
+        if not holders:
+            lock_metrics.add(acquired = len(product_ids))
+            if waited:
+                lock_metrics.record_wait(time.monotonic() - start, acquired = True)
+            return product_ids
+        lock_metrics.add(conflicts = 1)
+        remaining = wait - (time.monotonic() - start)
+        if remaining <= 0:
+            if waited:
+                lock_metrics.record_wait(time.monotonic() - start, acquired = False)
+            raise LockConflict(holders)
+        waited = True
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.5)
+
+def acquire_lock(conn, cursor, product_id, user, ttl=config.LOCK_TTL, wait=0):
+    acquire_locks(conn, cursor, [product_id], user, ttl = ttl, wait = wait)
+
+def renew_lock(conn, cursor, product_id, user):
+    # Extend user's lease without changing the holder (so the product version is not bumped).
+    # Fails with LockConflict if the lock was lost, e.g. reaped or taken over after expiry
+    with conn:
+        cursor.execute("""UPDATE product_manager SET locked_timestamp = CURRENT_TIMESTAMP
+                          WHERE id = ? AND locked_by = ?""", (product_id, user))
+        renewed = cursor.rowcount == 1
+        if renewed:
+            invalidate_products(conn, [product_id])
+    if not renewed:
+        holder = cursor.execute("SELECT locked_by FROM product_manager WHERE id = ?", (product_id,)).fetchone()
+        if holder is None:
+            raise ValueError("Product not found")
+        lock_metrics.add(conflicts = 1)
+        raise LockConflict({product_id: holder[0]})
+    lock_metrics.add(renewed = 1)
+
+def release_locks(conn, cursor, product_ids, user, ttl=config.LOCK_TTL):
+    # Release user's locks on product_ids; products that are free, expired or already released are
+    # skipped. Raises LockConflict (and releases nothing) if any is held by another user
+    product_ids = list(dict.fromkeys(product_ids))
+    if len(product_ids) > config.MAX_PAGE_SIZE:
+        raise ValueError(f"Cannot unlock more than {config.MAX_PAGE_SIZE} products at once")
+    if not product_ids:
+        return []
+    holders = _holders(cursor, product_ids, user, ttl)
+    if holders:
+        lock_metrics.add(conflicts = 1)
+        raise LockConflict(holders)
+    placeholders = ",".join("?" * len(product_ids))
+    with conn:
+        released = [row[0] for row in cursor.execute(
+            f"""UPDATE product_manager SET locked_by = NULL, locked_timestamp = NULL
+                WHERE id IN ({placeholders}) AND locked_by = ? RETURNING id""", product_ids + [user]).fetchall()]
+        invalidate_products(conn, released)
+    lock_metrics.add(released = len(released))
+    return released
+
+def release_lock(conn, cursor, product_id, user, ttl=config.LOCK_TTL):
+    return release_locks(conn, cursor, [product_id], user, ttl = ttl)
+
+def force_unlock(conn, cursor, product_id):
+    # Administrative unlock regardless of holder
+    with conn:
+        cursor.execute("""UPDATE product_manager SET locked_by = NULL, locked_timestamp = NULL
+                          WHERE id = ? AND locked_by IS NOT NULL""", (product_id,))
+        if cursor.rowcount:
+            invalidate_products(conn, [product_id])
+            lock_metrics.add(released = 1)
+
+def reap_expired_locks(conn, cursor, ttl=config.LOCK_TTL):
+    # Clear every lease older than ttl; returns the product ids that were unlocked
+    with conn:
+        reaped = [row[0] for row in cursor.execute(
+            """UPDATE product_manager SET locked_by = NULL, locked_timestamp = NULL
+               WHERE locked_by IS NOT NULL AND (locked_timestamp IS NULL OR locked_timestamp <= datetime('now', ?))
+               RETURNING id""", (_expired_before(ttl),)).fetchall()]
+        invalidate_products(conn, reaped)
+    if reaped:
+        lock_metrics.add(reaped = len(reaped))
+        logging.info(f"Reaped {len(reaped)} expired product locks")
+    return reaped
+
+def count_active_locks(conn, cursor, ttl=config.LOCK_TTL):
+    return cursor.execute("""SELECT COUNT(*) FROM product_manager
+                             WHERE locked_by IS NOT NULL AND locked_timestamp > datetime('now', ?)""",
+                          (_expired_before(ttl),)).fetchone()[0]
+
+def start_lock_reaper(db_name=config.DB_NAME, interval=config.LOCK_REAP_INTERVAL, ttl=config.LOCK_TTL):
+    # Background task clearing expired leases; returns the PeriodicTask, or None when interval is 0
+    if not interval:
+        return None
+
+    def reap():
+        with open_db(db_name) as (conn, cursor):
+            return len(reap_expired_locks(conn, cursor, ttl))
+
+    return PeriodicTask("lock-reaper", interval, reap).start()
@@ -0,0 +1,154 @@
+from models import *
+import time
+import logging
+import threading
+import config
+from crud.cache import customer_name_cache
+from crud.change_crud import prune_changes
+from database.connection import open_db, run_commit_hooks
+from database.scheduler import PeriodicTask
+from database.writer import get_writer
+
+logging.basicConfig(level=logging.INFO)
+
+"""
+Orphan cleanup in bounded batches. Each table is walked in id order, batch_size ids at a time,
+and each window is one short write transaction: a DELETE whose anti-join (NOT EXISTS against the
+join indexes) only looks at those ids. Between batches the write lock is released (and the
+cleaner pauses) so request writes are never held up by more than one batch. In the API process
+the batches are queued on the single writer like any other write job.
+Each run ends by pruning change-feed tombstones beyond PM_CHANGE_RETENTION (prune_changes).
+"""
+
+# Anti-join per table on alias o; quotes go first so customers only they referenced are freed too
+ORPHANS = {
+    "quotes": "NOT EXISTS (SELECT 1 FROM product_manager p WHERE p.id = o.product_id)",
+    "tags": "NOT EXISTS (SELECT 1 FROM product_tags pt WHERE pt.tag_id = o.id)",
+    "customers": """NOT EXISTS (SELECT 1 FROM product_customers pc WHERE pc.customer_id = o.id)
+                    AND NOT EXISTS (SELECT 1 FROM quotes q WHERE q.customer_id = o.id)""",
+}
+
+
+class CleanupMetrics:
+    # Process-wide cleanup totals and the latest report, served by GET /debug/maintenance
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.runs = 0
+            self.removed = {table: 0 for table in (*ORPHANS, "product_changes")}
+            self.batches = 0
+            self.elapsed = 0.0
+            self.max_lock_hold = 0.0
+            self.last = None
+
+    def record(self, report):
+        with self._lock:
+            self.runs += 1
+            for table, count in report["removed"].items():
+                self.removed[table] += count
+            self.batches += report["batches"]
+            self.elapsed += report["elapsed"]
+            self.max_lock_hold = max(self.max_lock_hold, report["max_lock_hold"])
+            self.last = report
+
+    def stats(self):
+        with self._lock:
+            return {"runs": self.runs, "removed": dict(self.removed), "batches": self.batches,
+                    "elapsed": round(self.elapsed, 6), "max_lock_hold": round(self.max_lock_hold, 6),
+                    "last": self.last}
+
+cleanup_metrics = CleanupMetrics()
+
+
+def delete_orphans_batch(conn, cursor, table, after, batch_size=config.CLEANUP_BATCH_SIZE):
+    # One bounded step: deletes the orphans among the batch_size rows of table after id `after`.
+    # Returns (rows removed, last id looked at), or (0, None) once the table is done
+    end = cursor.execute(f"SELECT MAX(id) FROM (SELECT id FROM {table} WHERE id > ? ORDER BY id LIMIT ?)",
+                         (after, batch_size)).fetchone()[0]
+    if end is None:
+        return 0, None
+    removed = cursor.execute(f"DELETE FROM {table} AS o WHERE o.id > ? AND o.id <= ? AND {ORPHANS[table]}",
+                             (after, end)).rowcount
+    if removed and table == "customers":
+        customer_name_cache.invalidate(conn)
+    return removed, end
+
+def clean_orphans(run_batch, batch_size=config.CLEANUP_BATCH_SIZE, pause=config.CLEANUP_PAUSE,
+                  keep=config.CHANGE_RETENTION):
+    # Removes orphaned quotes, tags and customers, then prunes change-feed tombstones (reported as
+    # product_changes). run_batch(step) runs step(conn, cursor) in a write transaction of its own
+    # and returns (its result, seconds the write lock was held for it).
+    # Returns {"removed": {table: n}, "batches": n, "elapsed": s, "max_lock_hold": s}
+    started = time.perf_counter()
+    report = {"removed": {}, "batches": 0, "elapsed": 0.0, "max_lock_hold": 0.0}
+    for table in ORPHANS:
+        removed, after = 0, 0
+        while after is not None:
+            if report["batches"] and pause:
+                time.sleep(pause)
+            (count, after), held = run_batch(
+                lambda conn, cursor, after=after: delete_orphans_batch(conn, cursor, table, after, batch_size))
+            removed += count
+            report["batches"] += 1
+            report["max_lock_hold"] = max(report["max_lock_hold"], held)
+        report["removed"][table] = removed
+    if pause:
+        time.sleep(pause)
+    pruned, held = run_batch(lambda conn, cursor: prune_changes(conn, cursor, keep))
+    report["removed"]["product_changes"] = pruned
+    report["batches"] += 1
+    report["max_lock_hold"] = max(report["max_lock_hold"], held)
+    report["elapsed"] = time.perf_counter() - started
+    cleanup_metrics.record(report)
+    logging.info("Orphan cleanup removed %s in %d batches, %.3fs (longest lock hold %.1f ms)",
+                 report["removed"], report["batches"], report["elapsed"], report["max_lock_hold"] * 1000)
+    return report
+
+def clean_orphaned_data(conn, cursor, batch_size=config.CLEANUP_BATCH_SIZE, pause=0.0):
+    """
+    Removes unused tags, customers, and quotes not associated with any active product, and
+    change-feed tombstones beyond CHANGE_RETENTION. Should be called periodically for data hygiene. Runs on conn in batches, each committed on
+    its own (pending work on conn is committed first); returns the report of clean_orphans.
+    """
+    if conn.in_transaction:
+        conn.commit()
+
+    def run_batch(step):
+        cursor.execute("BEGIN IMMEDIATE")
+        started = time.perf_counter()
+        try:
+            result = step(conn, cursor)
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+        finally:
+            run_commit_hooks(conn)
+        return result, time.perf_counter() - started
+
+    return clean_orphans(run_batch, batch_size, pause)
+
+def start_orphan_cleaner(db_name=config.DB_NAME, interval=config.CLEANUP_INTERVAL,
+                         batch_size=config.CLEANUP_BATCH_SIZE, pause=config.CLEANUP_PAUSE):
+    # Background orphan cleanup; returns the PeriodicTask, or None when interval is 0.
+    # With the single writer enabled each batch is a writer job, otherwise a pooled transaction
+    if not interval:
+        return None
+
+    def timed(step):
+        def job(conn, cursor):
+            started = time.perf_counter()
+            return step(conn, cursor), time.perf_counter() - started
+        return job
+
+    def run_batch(step):
+        if config.WRITER_ENABLED:
+            return get_writer(db_name).call(timed(step))
+        with open_db(db_name) as (conn, cursor):
+            cursor.execute("BEGIN IMMEDIATE")
+            return timed(step)(conn, cursor)
+
+    return PeriodicTask("orphan-cleaner", interval, lambda: clean_orphans(run_batch, batch_size, pause)).start()
@@ -1,6 +1,7 @@
 from models import *
 import logging
 from crud.utils import raise_value_error_if_not_found, raise_value_error_if_empty
+from crud.lock_crud import acquire_lock, release_lock, force_unlock
 
 logging.basicConfig(level=logging.INFO)
 
@@ -17,50 +18,12 @@ def search_by_ref_num(conn, cursor, ref_num):
     return product_ids
 
 def locked_product(conn, cursor, product_id, user):
-    with conn:
-        cursor.execute("""UPDATE product_manager
-                       SET locked_by = ?, locked_timestamp = CURRENT_TIMESTAMP WHERE id = ?""",
-                       (user, product_id))
-
-def unlock_product(conn, cursor, product_id):
-    with conn:
-        cursor.execute("""UPDATE product_manager
-                       SET locked_by = NULL, locked_timestamp = NULL WHERE id = ?""",
-                       (product_id,))
-        
-def clean_orphaned_data(conn, cursor):
-    """
-    Removes unused tags, customers, and quotes not associated with any active product.
-    Should be called periodically for data hygiene.
-    """
-    logging.info("Starting cleanup of orphaned data...")
-
-    with conn:
-        # Remove unused tags
-        cursor.execute("""
-            DELETE FROM tags
-            WHERE id NOT IN (
-                SELECT DISTINCT tag_id FROM product_tags
-            )
-        """)
-
-        # Remove unused customers
-        cursor.execute("""
-            DELETE FROM customers
-            WHERE id NOT IN (
-                SELECT DISTINCT customer_id FROM product_customers
-            )
-            AND id NOT IN (
-                SELECT DISTINCT customer_id FROM quotes
-            )
-        """)
-
-        # Remove quotes whose product_id no longer exists (in theory CASCADE should handle this)
-        cursor.execute("""
-            DELETE FROM quotes
-            WHERE product_id NOT IN (
-                SELECT id FROM product_manager
-            )
-        """)
-
-    logging.info("Cleanup complete.")
\ No newline at end of file
+    # Lease lock for user; raises LockConflict if someone else holds an unexpired lock (see crud/lock_crud.py)
+    acquire_lock(conn, cursor, product_id, user)
+
+def unlock_product(conn, cursor, product_id, user=None):
+    # Release user's lock; without user, unlock regardless of the holder
+    if user is None:
+        force_unlock(conn, cursor, product_id)
+    else:
+        release_lock(conn, cursor, product_id, user)
@@ -1,39 +1,57 @@
 from models import *
 import logging
+import sqlite3
+import config
 from crud.image_crud import add_image
-from crud.customer_crud import add_customer, search_by_customer
-from crud.tag_crud import add_tag, search_by_tag
+from crud.customer_crud import add_customer, lookup_customer_ids, resolve_customer_ids
+from crud.tag_crud import add_tag, resolve_tag_ids
 from crud.quote_crud import add_quote
-from crud.misc_crud import search_by_barcode, search_by_ref_num
-from crud.utils import raise_value_error_if_not_found, raise_value_error_if_empty
+from crud.search_crud import find_product_ids, suspend_search_index
+from crud.cache import invalidate_products
+from crud.utils import raise_value_error_if_not_found, raise_value_error_if_empty, chunked, nocase, fts_query, SQL_CHUNK_SIZE
+from crud.utils import encode_cursor, decode_cursor
 
 
 logging.basicConfig(level=logging.INFO)
 
+
+class VersionConflict(Exception):
+    # Optimistic concurrency: the product is no longer at the version the client read
+    def __init__(self, product_id, expected_version, current_version):
+        self.product_id = product_id
+        self.expected_version = expected_version
+        self.current_version = current_version
+        super().__init__(f"Product {product_id} is at version {current_version}, not {expected_version}")
+
+
 def add_product(conn, cursor, product: ProductCreate):
     # Insert new product and link images, tags, customers, and quotes
     # Assumes product.ref_num is unique
-    cursor.execute(
-    """INSERT INTO product_manager(ref_num, name, barcode, pcs_innerbox, pcs_ctn, weight, 
-    price_usd, price_rmb, remarks, packing, deleted, locked_by, locked_timestamp) 
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, NULL, NULL)""",
-    (product.ref_num,
-    product.name,
-    product.barcode,
-    product.pcs_innerbox,
-    product.pcs_ctn,
-    product.weight, 
-    product.price_usd,
-    product.price_rmb,
-    product.remarks,
-    product.packing)
-    )
-
-    product_id = cursor.lastrowid
-    add_image(conn, cursor, product_id, product.imgs)
-    add_customer(conn, cursor, product_id, product.customers)
-    add_tag(conn, cursor, product_id, product.tags)
-    add_quote(conn, cursor, product_id, product.quote)
+    # The search row is built once at the end instead of once per inserted row and link
+    product_ids = []
+    with suspend_search_index(conn, cursor, product_ids):
+        cursor.execute(
+        """INSERT INTO product_manager(ref_num, name, barcode, pcs_innerbox, pcs_ctn, weight, 
+        price_usd, price_rmb, remarks, packing, deleted, locked_by, locked_timestamp) 
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, NULL, NULL)""",
+        (product.ref_num,
+        product.name,
+        product.barcode,
+        product.pcs_innerbox,
+        product.pcs_ctn,
+        product.weight, 
+        product.price_usd,
+        product.price_rmb,
+        product.remarks,
+        product.packing)
+        )
+
+        product_id = cursor.lastrowid
+        product_ids.append(product_id)
+        add_image(conn, cursor, product_id, product.imgs or [])
+        add_customer(conn, cursor, product_id, product.customers or [])
+        add_tag(conn, cursor, product_id, product.tags or [])
+        add_quote(conn, cursor, product_id, product.quote or {})
 
     logging.info("Added products: %s", product.ref_num)
 
@@ -55,35 +73,192 @@ def add_product(conn, cursor, product: ProductCreate):
     "tags": product.tags,
     }
 
+def add_products_bulk(conn, cursor, products, chunk_size=SQL_CHUNK_SIZE, start_index=0):
+    # Insert many ProductCreate rows, committing once per chunk of chunk_size products.
+    # Bad rows (duplicate ref_num, quote for an unknown customer) are reported and skipped
+    # without aborting the batch. Returns {"created": [{index, id, ref_num}], "errors": [{index, ref_num, error}]},
+    # where index is the row's position in products (offset by start_index)
+    result = {"created": [], "errors": []}
+    for start in range(0, len(products), chunk_size):
+        rows = list(enumerate(products[start:start + chunk_size], start_index + start))
+        try:
+            product_ids = []
+            with suspend_search_index(conn, cursor, product_ids):
+                created, errors = _add_product_chunk(conn, cursor, rows)
+                product_ids.extend(row["id"] for row in created)
+            conn.commit()
+        except sqlite3.DatabaseError as e:
+            # Something the up-front checks did not catch: redo this chunk row by row to isolate it
+            conn.rollback()
+            logging.warning(f"Bulk chunk at row {start_index + start} failed ({e}); retrying row by row")
+            created, errors = _add_product_rows(conn, cursor, rows)
+            conn.commit()
+        result["created"].extend(created)
+        result["errors"].extend(sorted(errors, key=lambda e: e["index"]))
+    logging.info("Bulk added %d products, %d rejected", len(result["created"]), len(result["errors"]))
+    return result
+
+def _add_product_chunk(conn, cursor, rows):
+    # Set-based insert of one chunk: a fixed number of statements regardless of the chunk size
+    errors = []
+
+    def reject(index, product, error):
+        errors.append({"index": index, "ref_num": product.ref_num, "error": error})
+
+    # Duplicate ref_nums, against the table and within the chunk
+    ref_nums = [product.ref_num for _, product in rows]
+    placeholders = ",".join("?" * len(ref_nums))
+    existing = {row[0] for row in cursor.execute(
+        f"SELECT ref_num FROM product_manager WHERE ref_num IN ({placeholders})", ref_nums).fetchall()}
+    valid, seen = [], set()
+    for index, product in rows:
+        if product.ref_num in existing or product.ref_num in seen:
+            reject(index, product, "Product with this ref_num already exists.")
+        else:
+            seen.add(product.ref_num)
+            valid.append((index, product))
+
+    # Quotes may only name customers that exist or are being linked in this chunk; names compare
+    # like the NOCASE column, as they do in add_product
+    linked = {nocase(name) for _, product in valid for name in (product.customers or [])}
+    quoted = {name for _, product in valid for name in (product.quote or {}) if nocase(name) not in linked}
+    known = {nocase(name) for name in lookup_customer_ids(conn, cursor, list(quoted))} | linked
+    rows, valid = valid, []
+    for index, product in rows:
+        unknown = [name for name in (product.quote or {}) if nocase(name) not in known]
+        if unknown:
+            reject(index, product, f"Customer {unknown[0]} not found")
+        else:
+            valid.append((index, product))
+    if not valid:
+        return [], errors
+
+    cursor.executemany(
+        """INSERT INTO product_manager(ref_num, name, barcode, pcs_innerbox, pcs_ctn, weight,
+        price_usd, price_rmb, remarks, packing, deleted, locked_by, locked_timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, NULL, NULL)""",
+        [(p.ref_num, p.name, p.barcode, p.pcs_innerbox, p.pcs_ctn, p.weight,
+          p.price_usd, p.price_rmb, p.remarks, p.packing) for _, p in valid])
+    ref_nums = [product.ref_num for _, product in valid]
+    product_ids = dict(cursor.execute(
+        f"SELECT ref_num, id FROM product_manager WHERE ref_num IN ({','.join('?' * len(ref_nums))})",
+        ref_nums).fetchall())
+
+    tag_ids = resolve_tag_ids(conn, cursor, [t for _, p in valid for t in (p.tags or [])])
+    # Only names of rows that made it this far; rejected rows must not create customers
+    customer_ids = resolve_customer_ids(conn, cursor, list(dict.fromkeys(
+        name for _, p in valid for name in [*(p.customers or []), *(p.quote or {})])))
+
+    cursor.executemany("INSERT INTO product_images(product_id, img) VALUES(?, ?)",
+                       [(product_ids[p.ref_num], img) for _, p in valid for img in (p.imgs or [])])
+    cursor.executemany("INSERT OR IGNORE INTO product_tags(product_id, tag_id) VALUES (?, ?)",
+                       [(product_ids[p.ref_num], tag_ids[t]) for _, p in valid for t in (p.tags or [])])
+    cursor.executemany("INSERT OR IGNORE INTO product_customers(product_id, customer_id) VALUES (?, ?)",
+                       [(product_ids[p.ref_num], customer_ids[c]) for _, p in valid for c in (p.customers or [])])
+    cursor.executemany("""INSERT INTO quotes(product_id, customer_id, quote, quote_remark)
+                          VALUES(?, ?, ?, ?)""",
+                       [(product_ids[p.ref_num], customer_ids[name],
+                         round(data.quote, 2) if data.quote is not None else None, data.remark)
+                        for _, p in valid for name, data in (p.quote or {}).items()])
+
+    created = [{"index": index, "id": product_ids[p.ref_num], "ref_num": p.ref_num} for index, p in valid]
+    return created, errors
+
+def _add_product_rows(conn, cursor, rows):
+    # Slow path: one savepoint per row, so a failing row is rolled back on its own
+    created, errors = [], []
+    for index, product in rows:
+        cursor.execute("SAVEPOINT bulk_row")
+        try:
+            product_id = add_product(conn, cursor, product)["id"]
+            cursor.execute("RELEASE bulk_row")
+            created.append({"index": index, "id": product_id, "ref_num": product.ref_num})
+        except (sqlite3.DatabaseError, ValueError) as e:
+            cursor.execute("ROLLBACK TO bulk_row")
+            cursor.execute("RELEASE bulk_row")
+            errors.append({"index": index, "ref_num": product.ref_num, "error": str(e)})
+    return created, errors
+
 def delete_product(conn, cursor, product_id):
     # Switched to hard delete
     cursor.execute("DELETE FROM product_manager WHERE id = ?", (product_id,))
     raise_value_error_if_not_found(cursor, msg = "Product not found")
+    invalidate_products(conn, [product_id])
 
-def search_products(conn, cursor, name=None, tag=None, customer=None, barcode=None, ref_num=None):
-    product_ids = []
-    if name:
-        product_ids = search_product_name(conn, cursor, name)
-    if tag:
-        product_ids = search_by_tag(conn, cursor, tag)
-    if customer:
-        product_ids = search_by_customer(conn, cursor, customer)
-    if barcode:
-        product_ids = search_by_barcode(conn, cursor, barcode)
-    if ref_num:
-        product_ids = search_by_ref_num(conn, cursor, ref_num)
-    return [format_product(conn, cursor, pid) for pid in product_ids]
+def search_products(conn, cursor, cache=None, **filters):
+    # All given filters are intersected in a single SQL statement (see crud/search_crud.py);
+    # tag and customer accept one name or a list, matched with tag_mode / customer_mode ("any" or "all")
+    product_ids = search_product_ids(conn, cursor, **filters)
+    return format_products(conn, cursor, product_ids, cache=cache)
+
+def search_product_ids(conn, cursor, name=None, tag=None, customer=None, barcode=None, ref_num=None, q=None,
+                       tag_mode="any", customer_mode="any", **ranges):
+    # Ids matched by search_products, best match first, without hydrating them
+    return find_product_ids(conn, cursor, q=q, name=name, ref_num=ref_num, barcode=barcode,
+                            tags=tag, tag_mode=tag_mode, customers=customer,
+                            customer_mode=customer_mode, **ranges)
+
+def search_products_page(conn, cursor, after=None, limit=config.PAGE_SIZE, cache=None, **filters):
+    # Keyset-paged search ordered by id; same filters as search_products.
+    # Returns {"items": [...], "next_cursor": str or None}
+    page = search_product_ids_page(conn, cursor, after=after, limit=limit, **filters)
+    return {"items": format_products(conn, cursor, page["ids"], cache=cache), "next_cursor": page["next_cursor"]}
+
+def search_product_ids_page(conn, cursor, after=None, limit=config.PAGE_SIZE, **filters):
+    # One page of search_products_page as ids: {"ids": [...], "next_cursor": str or None}
+    limit = max(1, min(int(limit), config.MAX_PAGE_SIZE))
+    after_id = None
+    if after:
+        values = decode_cursor(after)
+        if len(values) != 2 or values[0] != "id" or not isinstance(values[1], int):
+            raise ValueError("Invalid cursor")
+        after_id = values[1]
+    tag = filters.pop("tag", None)
+    customer = filters.pop("customer", None)
+    try:
+        product_ids = find_product_ids(conn, cursor, tags=tag, customers=customer,
+                                       after_id=after_id, limit=limit + 1, **filters)
+    except ValueError:
+        if after_id is None:
+            raise
+        product_ids = []  # past the last page
+
+    next_cursor = None
+    if len(product_ids) > limit:
+        product_ids = product_ids[:limit]
+        next_cursor = encode_cursor(["id", product_ids[-1]])
+    return {"ids": product_ids, "next_cursor": next_cursor}
 
 def search_product_name(conn, cursor, name):
-    # search by product name, return id
-    rows = cursor.execute("SELECT id FROM product_manager WHERE name LIKE ?",
-                        (f"%{name}%",)).fetchall()
+    # search by product name, return ids best match first
+    # Word-prefix matches on the FTS index come first, by rank; every other name containing
+    # name as a substring (e.g. a fragment in the middle of a word) follows in id order, found
+    # through the trigram index (migration 11)
+    ids = []
+    query = fts_query(name, columns = ["name"])
+    if query:
+        ids = [row["id"] for row in cursor.execute("""SELECT rowid AS id FROM product_search
+                                                      WHERE product_search MATCH ? ORDER BY rank""", (query,))]
+    ranked = set(ids)
+    ids += [row["id"] for row in cursor.execute("""SELECT rowid AS id FROM product_name_trigram
+                                                   WHERE name LIKE ? ORDER BY rowid""", (f"%{name}%",))
+            if row["id"] not in ranked]
+    raise_value_error_if_empty(ids, msg = "Resource not found")
+    return ids
+
+def search_products_text(conn, cursor, text):
+    # Ranked full-text search over name, ref_num, remarks, packing, tag and customer names
+    query = fts_query(text)
+    raise_value_error_if_empty(query, msg = "Resource not found")
+    rows = cursor.execute("""SELECT rowid AS id FROM product_search
+                             WHERE product_search MATCH ? ORDER BY rank""", (query,)).fetchall()
     raise_value_error_if_empty(rows, msg = "Resource not found")
     return [row["id"] for row in rows]
 
-def edit_product(conn, cursor, product_id, **kwargs):
+def edit_product(conn, cursor, product_id, expected_version=None, **kwargs):
     # Edit fields given product_id, e.g. edit_product (1, name="new name", price_rmb=3);
-    # ref_num cannot be edited; auto-updates last_updated timestamp
+    # ref_num cannot be edited; auto-updates last_updated timestamp.
+    # With expected_version the UPDATE only matches that version (raises VersionConflict otherwise)
     if "ref_num" in kwargs:
         raise ValueError("ref_num cannot be edited")
     
@@ -102,56 +277,193 @@ def edit_product(conn, cursor, product_id, **kwargs):
     fields.append("last_updated = CURRENT_TIMESTAMP")
     values.append(product_id)
     sql = f"UPDATE product_manager SET {','.join(fields)} WHERE id = ?"
-    result = cursor.execute(sql, tuple(values))
-    raise_value_error_if_empty(result, msg = "Product not found")
+    if expected_version is not None:
+        sql += " AND version = ?"
+        values.append(expected_version)
+    cursor.execute(sql, tuple(values))
+    if cursor.rowcount == 0:
+        _raise_version_mismatch(cursor, product_id, expected_version)
+    invalidate_products(conn, [product_id])
+
+def check_version(conn, cursor, product_id, expected_version):
+    # Optimistic concurrency guard for writes to a product's images, tags, customers and quotes:
+    # a no-op UPDATE that matches only while the product is at expected_version. It runs in the
+    # caller's transaction and takes the write lock, so the version cannot move before the child
+    # write commits (which then bumps it). None skips the check
+    if expected_version is None:
+        return
+    cursor.execute("UPDATE product_manager SET id = id WHERE id = ? AND version = ?", (product_id, expected_version))
+    if cursor.rowcount == 0:
+        _raise_version_mismatch(cursor, product_id, expected_version)
+
+def _raise_version_mismatch(cursor, product_id, expected_version):
+    # Only read on the failure path: tell a missing product from a stale version
+    row = cursor.execute("SELECT version FROM product_manager WHERE id = ?", (product_id,)).fetchone()
+    if row is None:
+        raise ValueError("Product not found")
+    raise VersionConflict(product_id, expected_version, row[0])
 
 def list_products(cursor):
     # List all active (non-deleted) products
     cursor.execute("SELECT * FROM product_manager WHERE deleted = 0")
     return cursor.fetchall()
 
+# Columns a listing can project without touching the child tables
+BASE_COLUMNS = ("id", "ref_num", "name", "barcode", "pcs_innerbox", "pcs_ctn", "weight", "price_usd",
+                "price_rmb", "remarks", "packing", "last_updated", "locked_by", "locked_timestamp", "version")
 
-def format_product(conn, cursor, product_id):
-    # Return full product info, including images, tags, customers, and quotes; formatted as dict
-    cursor.execute("SELECT * FROM product_manager WHERE id = ?", (product_id,))
-    raw_row = cursor.fetchone()
-    raise_value_error_if_empty(raw_row, msg = "Product not found")
-    
-    column_names = [desc[0] for desc in cursor.description]
-    product = dict(zip(column_names, raw_row))  # includes locked_by, locked_timestamp
-
-    # Images
-    cursor.execute("SELECT id, img FROM product_images WHERE product_id = ?", (product_id,))
-    product["imgs"] = [{"id": img_id, "img": img} for img_id, img in cursor.fetchall()]
-
-    # Tags
-    cursor.execute("""SELECT t.id, t.tag_name
-                      FROM product_tags pt
-                      JOIN tags t ON pt.tag_id = t.id
-                      WHERE pt.product_id = ?""", (product_id,))
-    product["tags"] = [{"id": tag_id, "tag_name": tag_name} for tag_id, tag_name in cursor.fetchall()]
-
-    # Customers
-    cursor.execute("""SELECT c.id, c.customer_name
-                      FROM product_customers pc
-                      JOIN customers c ON pc.customer_id = c.id
-                      WHERE pc.product_id = ?""", (product_id,))
-    product["customers"] = [{"id": customer_id, "customer_name": name} for customer_id, name in cursor.fetchall()]
-
-    # Quotes
-    cursor.execute("""SELECT q.id, c.id, c.customer_name, q.quote, q.quote_remark
-                      FROM quotes q
-                      JOIN customers c ON q.customer_id = c.id
-                      WHERE q.product_id = ?""", (product_id,))
-    product["quote"] = [
-        {
-            "quote_id": quote_id,
-            "customer_id": customer_id,
-            "customer_name": customer_name,
-            "quote": quote,
-            "quote_remark": remark
-        }
-        for quote_id, customer_id, customer_name, quote, remark in cursor.fetchall()
-    ]
-
-    return product
+def _projection(fields):
+    # None / "full" -> hydrated products; "base" -> every base column; else a list of base columns
+    if fields in (None, "full"):
+        return None
+    if fields == "base":
+        return list(BASE_COLUMNS)
+    if isinstance(fields, str):
+        fields = fields.split(",")
+    columns = [f.strip() for f in fields if f.strip()]
+    unknown = [c for c in columns if c not in BASE_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return ["id"] + [c for c in columns if c != "id"]
+
+def list_products_page(conn, cursor, after=None, limit=config.PAGE_SIZE, order_by="id", fields=None, cache=None):
+    # Keyset pagination over active products, ordered by id or by (last_updated, id).
+    # after is the next_cursor of the previous page; returns {"items": [...], "next_cursor": str or None}
+    if order_by not in ("id", "last_updated"):
+        raise ValueError(f"Invalid order_by: {order_by}")
+    limit = max(1, min(int(limit), config.MAX_PAGE_SIZE))
+    columns = _projection(fields)
+
+    conditions = ["deleted = 0"]
+    params = []
+    if after:
+        values = decode_cursor(after)
+        if values[:1] != [order_by] or not isinstance(values[-1], int) or len(values) != (2 if order_by == "id" else 3):
+            raise ValueError("Invalid cursor")
+        if order_by == "id":
+            conditions.append("id > ?")
+        else:
+            conditions.append("(last_updated, id) > (?, ?)")
+        params.extend(values[1:])
+
+    sort = "id" if order_by == "id" else "last_updated, id"
+    select = list(dict.fromkeys((columns or []) + ["id", "last_updated"]))
+    cursor.execute(f"""SELECT {', '.join(select)} FROM product_manager
+                       WHERE {' AND '.join(conditions)} ORDER BY {sort} LIMIT ?""", params + [limit + 1])
+    rows = [dict(zip(select, row)) for row in cursor.fetchall()]
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        key = [last["id"]] if order_by == "id" else [last["last_updated"], last["id"]]
+        next_cursor = encode_cursor([order_by] + key)
+
+    if columns:
+        items = [{c: row[c] for c in columns} for row in rows]
+    else:
+        items = format_products(conn, cursor, [row["id"] for row in rows], cache=cache)
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def iter_products(conn, cursor, batch_size=SQL_CHUNK_SIZE):
+    # Yield every active product, hydrated, in id order, batch_size products at a time.
+    # Runs inside one read transaction so a long export sees a consistent snapshot
+    started = not conn.in_transaction
+    if started:
+        cursor.execute("BEGIN")
+    try:
+        last_id = 0
+        while True:
+            cursor.execute("""SELECT id FROM product_manager WHERE deleted = 0 AND id > ?
+                              ORDER BY id LIMIT ?""", (last_id, batch_size))
+            product_ids = [row[0] for row in cursor.fetchall()]
+            if not product_ids:
+                break
+            yield from format_products(conn, cursor, product_ids)
+            last_id = product_ids[-1]
+    finally:
+        if started:
+            conn.rollback()  # read-only; just ends the snapshot
+
+def product_versions(conn, cursor, product_ids):
+    # [(id, version)] for the existing products among product_ids, in order; cheap enough to
+    # answer conditional requests before hydrating anything
+    versions = {}
+    for chunk in chunked(list(dict.fromkeys(product_ids)), SQL_CHUNK_SIZE):
+        placeholders = ",".join("?" * len(chunk))
+        versions.update(cursor.execute(f"SELECT id, version FROM product_manager WHERE id IN ({placeholders})",
+                                       chunk).fetchall())
+    return [(pid, versions[pid]) for pid in product_ids if pid in versions]
+
+def format_product(conn, cursor, product_id, cache=None):
+    # Return full product info, including images, tags, customers, and current quotes; formatted as dict
+    products = format_products(conn, cursor, [product_id], cache=cache)
+    raise_value_error_if_empty(products, msg = "Product not found")
+    return products[0]
+
+def format_products(conn, cursor, product_ids, cache=None):
+    # Batched version of format_product: hydrates every id with one query per table
+    # (per chunk of ids) instead of five queries per product.
+    # Returns dicts in the order of product_ids; unknown ids are skipped.
+    # cache (a crud.cache.ProductCache) serves and keeps hydrated products; only pass it on
+    # read-only paths, never after a write in the same transaction
+    if cache is not None:
+        return cache.get_many(product_ids, lambda missing: format_products(conn, cursor, missing))
+    products = {}
+    for chunk in chunked(list(dict.fromkeys(product_ids)), SQL_CHUNK_SIZE):
+        placeholders = ",".join("?" * len(chunk))
+
+        cursor.execute(f"SELECT * FROM product_manager WHERE id IN ({placeholders})", chunk)
+        column_names = [desc[0] for desc in cursor.description]
+        for raw_row in cursor.fetchall():
+            product = dict(zip(column_names, raw_row))  # includes locked_by, locked_timestamp
+            product["imgs"] = []
+            product["tags"] = []
+            product["customers"] = []
+            product["quote"] = []
+            products[product["id"]] = product
+
+        # Images
+        cursor.execute(f"""SELECT product_id, id, img FROM product_images
+                           WHERE product_id IN ({placeholders})
+                           ORDER BY id""", chunk)
+        for product_id, img_id, img in cursor.fetchall():
+            products[product_id]["imgs"].append({"id": img_id, "img": img})
+
+        # Tags
+        cursor.execute(f"""SELECT pt.product_id, t.id, t.tag_name
+                           FROM product_tags pt
+                           JOIN tags t ON pt.tag_id = t.id
+                           WHERE pt.product_id IN ({placeholders})
+                           ORDER BY pt.product_id, t.id""", chunk)
+        for product_id, tag_id, tag_name in cursor.fetchall():
+            products[product_id]["tags"].append({"id": tag_id, "tag_name": tag_name})
+
+        # Customers
+        cursor.execute(f"""SELECT pc.product_id, c.id, c.customer_name
+                           FROM product_customers pc
+                           JOIN customers c ON pc.customer_id = c.id
+                           WHERE pc.product_id IN ({placeholders})
+                           ORDER BY pc.product_id, c.id""", chunk)
+        for product_id, customer_id, name in cursor.fetchall():
+            products[product_id]["customers"].append({"id": customer_id, "customer_name": name})
+
+        # Current quote per customer (see migration 8); the history is served by quote_history
+        cursor.execute(f"""SELECT cq.product_id, cq.quote_id, c.id, c.customer_name, cq.quote, cq.quote_remark,
+                                  cq.timestamp
+                           FROM current_quotes cq
+                           JOIN customers c ON cq.customer_id = c.id
+                           WHERE cq.product_id IN ({placeholders})
+                           ORDER BY cq.quote_id""", chunk)
+        for product_id, quote_id, customer_id, customer_name, quote, remark, timestamp in cursor.fetchall():
+            products[product_id]["quote"].append({
+                "quote_id": quote_id,
+                "customer_id": customer_id,
+                "customer_name": customer_name,
+                "quote": quote,
+                "quote_remark": remark,
+                "timestamp": timestamp
+            })
+
+    return [products[pid] for pid in product_ids if pid in products]
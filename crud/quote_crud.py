@@ -1,36 +1,109 @@
 from models import *
 import logging
-from crud.utils import raise_value_error_if_not_found, raise_value_error_if_empty
+import itertools
+from datetime import datetime, timezone
+import config
+from crud.utils import raise_value_error_if_not_found, raise_value_error_if_empty, chunked
+from crud.cache import invalidate_products
+from crud.customer_crud import lookup_customer_ids
 
 logging.basicConfig(level=logging.INFO)
 
+# Rows per transaction in add_quotes_bulk
+QUOTE_BULK_CHUNK_SIZE = 5000
+
 def add_quote(conn, cursor, product_id, quote_dict):
     # Add quote info per customer; raises if customer not found
     # quote_dict is a dictionary of quotes in the following structure:
     # {customer: {quote: int, remark: str}}
-    for customer_name, data in quote_dict.items():
-        quote_value = round(data.quote,2)
-        quote_remark = data.remark
-        cursor.execute("SELECT id FROM customers WHERE customer_name = ?", (customer_name,))
-        customer = cursor.fetchone()
-        raise_value_error_if_empty(customer, f"Customer {customer_name} not found")
-
-        customer_id = customer[0]
-        cursor.execute("""INSERT INTO quotes(product_id, customer_id, quote, quote_remark)
-                        VALUES(?, ?, ?, ?)""",
-                        (product_id, customer_id, quote_value, quote_remark))
-            
-def delete_quote(conn, cursor, quote_id):
-    cursor.execute("DELETE FROM quotes WHERE id = ?", (quote_id,))
-    raise_value_error_if_not_found(cursor, msg = "quote not found")
+    # Names are resolved with one lookup and nothing is inserted if any is unknown
+    if not quote_dict:
+        return
+    customer_ids = lookup_customer_ids(conn, cursor, list(quote_dict))
+    for customer_name in quote_dict:
+        raise_value_error_if_empty(customer_ids.get(customer_name), f"Customer {customer_name} not found")
+    invalidate_products(conn, [product_id])
+    cursor.executemany("""INSERT INTO quotes(product_id, customer_id, quote, quote_remark)
+                          VALUES(?, ?, ?, ?)""",
+                       [(product_id, customer_ids[customer_name],
+                         round(data.quote, 2) if data.quote is not None else None, data.remark)
+                        for customer_name, data in quote_dict.items()])
+
+def add_quotes_bulk(conn, cursor, rows, customer=None, cache=None, chunk_size=QUOTE_BULK_CHUNK_SIZE, start_index=0):
+    # Insert many QuoteRow rows (a price list), committing once per chunk of chunk_size rows.
+    # Products are given by product_id or ref_num; customer fills in rows without one. Names are
+    # resolved once per chunk (through cache, a crud.cache.CustomerNameCache, when given) and the
+    # quotes go in with one executemany. Rows naming an unknown product or customer are reported
+    # and skipped. Returns {"created": n, "errors": [{index, ref_num, error}]}
+    result = {"created": 0, "errors": []}
+    for start in range(0, len(rows), chunk_size):
+        chunk = list(enumerate(rows[start:start + chunk_size], start_index + start))
+        valid, errors = _resolve_quote_rows(conn, cursor, chunk, customer, cache)
+        invalidate_products(conn, {product_id for _, product_id, _, _ in valid})
+        # Quotes are not searchable, so there is no search re-index to batch; the quote triggers still
+        # fire per row: the product version bump (and with it the change feed), current_quote_insert
+        # and quote_generation_insert
+        cursor.executemany("""INSERT INTO quotes(product_id, customer_id, quote, quote_remark, timestamp)
+                              VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))""",
+                           [(product_id, customer_id, round(row.quote, 2), row.remark, timestamp)
+                            for row, product_id, customer_id, timestamp in valid])
+        conn.commit()
+        result["created"] += len(valid)
+        result["errors"].extend(errors)
+    logging.info("Bulk added %d quotes, %d rejected", result["created"], len(result["errors"]))
+    return result
+
+def _resolve_quote_rows(conn, cursor, chunk, customer, cache):
+    # [(row, product_id, customer_id, timestamp)] for the rows whose product and customer exist, and errors
+    ref_nums = list({row.ref_num for _, row in chunk if row.product_id is None and row.ref_num})
+    by_ref_num = {}
+    for part in chunked(ref_nums):
+        by_ref_num.update(cursor.execute(f"""SELECT ref_num, id FROM product_manager
+                                             WHERE ref_num IN ({','.join('?' * len(part))})""", part).fetchall())
+    ids = list({row.product_id for _, row in chunk if row.product_id is not None})
+    existing = set()
+    for part in chunked(ids):
+        existing.update(row[0] for row in cursor.execute(
+            f"SELECT id FROM product_manager WHERE id IN ({','.join('?' * len(part))})", part).fetchall())
+    customer_ids = lookup_customer_ids(conn, cursor, list({row.customer or customer for _, row in chunk
+                                                           if row.customer or customer}), cache = cache)
+
+    valid, errors = [], []
+    for index, row in chunk:
+        product_id = row.product_id if row.product_id in existing else by_ref_num.get(row.ref_num)
+        name = row.customer or customer
+        if row.product_id is None and not row.ref_num:
+            error = "product_id or ref_num is required"
+        elif product_id is None:
+            error = f"Product {row.product_id if row.product_id is not None else row.ref_num} not found"
+        elif not name:
+            error = "customer is required"
+        elif name not in customer_ids:
+            error = f"Customer {name} not found"
+        else:
+            try:
+                valid.append((row, product_id, customer_ids[name], parse_history_bound(row.timestamp, "timestamp")))
+                continue
+            except ValueError as e:
+                error = str(e)
+        errors.append({"index": index, "ref_num": row.ref_num, "error": error})
+    return valid, errors
+
+def delete_quote(conn, cursor, quote_id, product_id=None):
+    # With product_id, only a quote of that product is deleted
+    rows = cursor.execute("DELETE FROM quotes WHERE id = ? AND (? IS NULL OR product_id = ?) RETURNING product_id",
+                          (quote_id, product_id, product_id)).fetchall()
+    raise_value_error_if_empty(rows, msg = "quote not found")
+    invalidate_products(conn, [rows[0][0]])
 
 def edit_quote(conn, cursor, quote_id, quote=None, quote_remark=None):
     if quote is not None:
         quote = round(quote,2)
-    cursor.execute("UPDATE quotes SET quote = ?, quote_remark = ? WHERE id = ?",
-                    (quote, quote_remark, quote_id))
+    rows = cursor.execute("UPDATE quotes SET quote = ?, quote_remark = ? WHERE id = ? RETURNING product_id",
+                    (quote, quote_remark, quote_id)).fetchall()
     
-    raise_value_error_if_not_found(cursor, "No matching quote found to update")
+    raise_value_error_if_empty(rows, "No matching quote found to update")
+    invalidate_products(conn, [rows[0][0]])
 
 def list_quote(cursor):
     # List all quotes associated with a customer
@@ -44,9 +117,86 @@ def list_quote(cursor):
 def get_quote_by_id(cursor, quote_id):
     # List a specific quote given quote_id
     result = cursor.execute("""
-        SELECT q.id as quote_id, q. customer_id, q.quote, q.quote_remark, c.customer_name
+        SELECT q.id as quote_id, q. customer_id, q.quote, q.quote_remark, c.customer_name, q.product_id
         FROM quotes q
         JOIN customers c ON q.customer_id = c.id
         WHERE q.id =?
     """, (quote_id,)).fetchone()
-    return result
\ No newline at end of file
+    return result
+
+
+# Period start for each downsampling bucket; weeks start on Monday
+QUOTE_BUCKETS = {
+    "day": "date(q.timestamp)",
+    "week": "date(q.timestamp, '-6 days', 'weekday 1')",
+    "month": "strftime('%Y-%m-01', q.timestamp)",
+}
+
+def parse_history_bound(value, name):
+    # ISO date or datetime -> the quotes.timestamp format (UTC "YYYY-MM-DD HH:MM:SS"). A value
+    # with a UTC offset is converted to UTC; one without is taken to be UTC already
+    if value is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO date or datetime, not {value!r}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc)
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+def quote_history(conn, cursor, product_id, customer_id = None, since = None, until = None,
+                  bucket = None, limit = config.QUOTE_HISTORY_LIMIT):
+    # Quote history of a product in [since, until), ordered by customer then time.
+    # bucket=None returns every quote; "day" / "week" / "month" downsample to one point per customer
+    # and period (last quote, plus open / low / high / avg / count), read from the covering
+    # idx_quotes_history index alone. At most limit points are returned, the latest ones; truncated
+    # says whether older points were left out
+    if bucket is not None and bucket not in QUOTE_BUCKETS:
+        raise ValueError(f"bucket must be one of {', '.join(QUOTE_BUCKETS)}")
+    since = parse_history_bound(since, "since")
+    until = parse_history_bound(until, "until")
+    cursor.execute("SELECT 1 FROM product_manager WHERE id = ?", (product_id,))
+    raise_value_error_if_empty(cursor.fetchone(), "Product not found")
+
+    where, params = ["q.product_id = ?"], [product_id]
+    for clause, value in (("q.customer_id = ?", customer_id), ("q.timestamp >= ?", since), ("q.timestamp < ?", until)):
+        if value is not None:
+            where.append(clause)
+            params.append(value)
+    where = " AND ".join(where)
+    names = dict(cursor.execute(f"""SELECT c.id, c.customer_name FROM customers c
+                                    WHERE c.id IN (SELECT DISTINCT q.customer_id FROM quotes q WHERE {where})""",
+                                params).fetchall())
+
+    if bucket is None:
+        # Latest limit + 1 quotes, then back into customer / time order
+        rows = cursor.execute(f"""SELECT q.customer_id, q.timestamp, q.id, q.quote, q.quote_remark FROM quotes q
+                                  WHERE {where} ORDER BY q.timestamp DESC, q.id DESC LIMIT ?""",
+                              params + [limit + 1]).fetchall()
+        truncated = len(rows) > limit
+        points = [{"customer_id": customer, "customer_name": names[customer], "period": timestamp,
+                   "quote": quote, "quote_id": quote_id, "quote_remark": remark, "count": 1}
+                  for customer, timestamp, quote_id, quote, remark in sorted(rows[:limit], key = lambda r: r[:3])
+                  if customer in names]
+        return {"product_id": product_id, "bucket": None, "since": since, "until": until,
+                "points": points, "truncated": truncated}
+
+    rows = cursor.execute(f"""SELECT q.customer_id, {QUOTE_BUCKETS[bucket]}, q.quote FROM quotes q
+                              WHERE {where} ORDER BY q.customer_id, q.timestamp""", params)
+    points = []
+    for (customer, period), group in itertools.groupby(rows, key = lambda row: (row[0], row[1])):
+        if customer not in names:
+            continue
+        quotes = [row[2] for row in group]
+        values = [quote for quote in quotes if quote is not None]
+        points.append({"customer_id": customer, "customer_name": names[customer], "period": period,
+                       "quote": quotes[-1], "open": quotes[0], "count": len(quotes),
+                       "low": min(values, default = None), "high": max(values, default = None),
+                       "avg": round(sum(values) / len(values), 4) if values else None})
+    truncated = len(points) > limit
+    if truncated:
+        latest = {id(point) for point in sorted(points, key = lambda p: p["period"])[-limit:]}
+        points = [point for point in points if id(point) in latest]
+    return {"product_id": product_id, "bucket": bucket, "since": since, "until": until,
+            "points": points, "truncated": truncated}
@@ -0,0 +1,172 @@
+from models import *
+import logging
+from contextlib import contextmanager
+from crud.utils import raise_value_error_if_empty, fts_query, chunked
+from database.schema import SEARCH_ROWS_SQL
+
+logging.basicConfig(level=logging.INFO)
+
+
+# Numeric range filters: parameter name -> (column, comparison)
+RANGE_FILTERS = {
+    "price_usd_min": ("p.price_usd", ">="),
+    "price_usd_max": ("p.price_usd", "<="),
+    "price_rmb_min": ("p.price_rmb", ">="),
+    "price_rmb_max": ("p.price_rmb", "<="),
+    "weight_min": ("p.weight", ">="),
+    "weight_max": ("p.weight", "<="),
+}
+
+# Link filters: filter name -> (link table, link column, name table, name column)
+LINK_FILTERS = {
+    "tags": ("product_tags", "tag_id", "tags", "tag_name"),
+    "customers": ("product_customers", "customer_id", "customers", "customer_name"),
+}
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = [value]
+    return [v for v in value if v]
+
+def _link_condition(filter_name, names, mode):
+    # Names match like search_by_tag / search_by_customer (substring, LIKE).
+    # "any": the product is linked to at least one matching name; "all": to a match for every name.
+    # Written as id IN (...) so SQLite scans the small name table and probes the link index,
+    # instead of scanning the link table or every product
+    link_table, link_column, name_table, name_column = LINK_FILTERS[filter_name]
+    name_ids = f"SELECT id FROM {name_table} WHERE {name_column} LIKE ?"
+    params = [f"%{name}%" for name in names]
+    if mode == "any":
+        likes = " OR ".join(f"{name_column} LIKE ?" for _ in names)
+        return f"""p.id IN (SELECT product_id FROM {link_table}
+                            WHERE {link_column} IN (SELECT id FROM {name_table} WHERE {likes}))""", params
+    if mode != "all":
+        raise ValueError(f"Invalid match mode: {mode}")
+    # The first name drives the candidate set; the rest are checked per candidate
+    conditions = [f"p.id IN (SELECT product_id FROM {link_table} WHERE {link_column} IN ({name_ids}))"]
+    conditions += [f"""EXISTS (SELECT 1 FROM {link_table} l WHERE l.product_id = p.id
+                               AND l.{link_column} IN ({name_ids}))""" for _ in names[1:]]
+    return " AND ".join(conditions), params
+
+def build_product_search(q = None, name = None, ref_num = None, barcode = None,
+                         tags = None, tag_mode = "any", customers = None, customer_mode = "any",
+                         name_like = False, after_id = None, limit = None, **ranges):
+    """
+    Compile any combination of product filters into one SELECT of matching product ids.
+    All filters are ANDed; full-text terms (q, name) drive the FTS index and rank the result,
+    otherwise ids come back in id order. name_like switches name to a substring LIKE match.
+    With limit, results are paged by id (after_id = last id of the previous page) instead of rank.
+    Returns (sql, params), or (None, []) when no filter is set.
+    """
+    unknown = set(ranges) - set(RANGE_FILTERS)
+    if unknown:
+        raise TypeError(f"Unknown search filters: {', '.join(sorted(unknown))}")
+
+    conditions = ["p.deleted = 0"]
+    params = []
+    has_filter = False
+
+    match_parts = []
+    if q:
+        match_parts.append(fts_query(q))
+    if name and not name_like:
+        match_parts.append(fts_query(name, columns = ["name"]))
+    if name and name_like:
+        # Answered from the trigram index on names (migration 11) rather than a table scan
+        conditions.append("p.id IN (SELECT rowid FROM product_name_trigram WHERE name LIKE ?)")
+        params.append(f"%{name}%")
+    if any(part is None for part in match_parts):
+        # Text without any searchable word can never match
+        conditions.append("0")
+        match_parts = []
+        has_filter = True
+
+    if ref_num:
+        conditions.append("p.ref_num = ?")
+        params.append(ref_num)
+    if barcode:
+        conditions.append("p.barcode = ?")
+        params.append(barcode)
+
+    for filter_name, names, mode in (("tags", _as_list(tags), tag_mode),
+                                     ("customers", _as_list(customers), customer_mode)):
+        if names:
+            condition, condition_params = _link_condition(filter_name, names, mode)
+            conditions.append(condition)
+            params.extend(condition_params)
+
+    for key, value in ranges.items():
+        if value is not None:
+            column, op = RANGE_FILTERS[key]
+            conditions.append(f"{column} {op} ?")
+            params.append(value)
+
+    has_filter = has_filter or bool(match_parts) or len(conditions) > 1
+    if not has_filter:
+        return None, []
+
+    if after_id is not None:
+        conditions.append("p.id > ?")
+        params.append(after_id)
+    order = "p.id" if limit is not None or not match_parts else "product_search.rank"
+
+    if match_parts:
+        sql = f"""SELECT p.id FROM product_search
+                  JOIN product_manager p ON p.id = product_search.rowid
+                  WHERE product_search MATCH ? AND {' AND '.join(conditions)}
+                  ORDER BY {order}"""
+        params.insert(0, " AND ".join(f"({part})" for part in match_parts))
+    else:
+        sql = f"SELECT p.id FROM product_manager p WHERE {' AND '.join(conditions)} ORDER BY {order}"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return sql, params
+
+def find_product_ids(conn, cursor, **filters):
+    # Run the compiled search. A full-text name match is completed with the substring matches it
+    # misses (fragments inside a word), like search_product_name: ranked hits first, the rest in
+    # id order; with limit both are pages by id and are merged into one.
+    # Raises if filters were given but nothing matched
+    sql, params = build_product_search(**filters)
+    if sql is None:
+        return []
+    product_ids = [row[0] for row in cursor.execute(sql, params).fetchall()]
+    if filters.get("name") and not filters.get("name_like"):
+        sql, params = build_product_search(**{**filters, "name_like": True})
+        found = set(product_ids)
+        product_ids += [row[0] for row in cursor.execute(sql, params).fetchall() if row[0] not in found]
+        if filters.get("limit") is not None:
+            product_ids = sorted(product_ids)[:filters["limit"]]
+    raise_value_error_if_empty(product_ids, msg = "Resource not found")
+    return product_ids
+
+
+def reindex_search(conn, cursor, product_ids):
+    # Rebuild the product_search rows of these products in one delete + one insert per chunk,
+    # and bump their version once
+    for chunk in chunked(list(dict.fromkeys(product_ids))):
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(f"DELETE FROM product_search WHERE rowid IN ({placeholders})", chunk)
+        cursor.execute(SEARCH_ROWS_SQL.format(where = f"p.id IN ({placeholders})"), chunk)
+        cursor.execute(f"""UPDATE product_manager SET version = version + 1, last_updated = CURRENT_TIMESTAMP
+                           WHERE id IN ({placeholders})""", chunk)
+
+@contextmanager
+def suspend_search_index(conn, cursor, product_ids):
+    # Silence the per-row search and version triggers while inserting many products/links, then
+    # re-index and bump the affected products once. product_ids may be filled in inside the block
+    # (e.g. after inserts). The flag row lives only in this connection's uncommitted transaction;
+    # nested use is a no-op
+    cursor.execute("INSERT OR IGNORE INTO search_index_suspended(flag) VALUES (1)")
+    if cursor.rowcount == 0:
+        yield
+        return
+    try:
+        yield
+    finally:
+        cursor.execute("DELETE FROM search_index_suspended")
+    reindex_search(conn, cursor, product_ids)
@@ -1,41 +1,60 @@
 from models import *
 import logging
-from crud.utils import raise_value_error_if_not_found, raise_value_error_if_empty
+from crud.utils import raise_value_error_if_not_found, raise_value_error_if_empty, chunked
+from crud.search_crud import suspend_search_index
+from crud.cache import invalidate_products, invalidate_products_where
 
 logging.basicConfig(level=logging.INFO)
 
 def add_tag(conn, cursor, product_id, tags):
     # Link tags to product
-    # Create tag entries if they don't exist
-    for t in tags:
-        cursor.execute("INSERT OR IGNORE INTO tags(tag_name) VALUES (?)",
-                            (t,))
-        cursor.execute("SELECT id FROM tags WHERE tag_name =?", (t,))
-        tag_id = cursor.fetchone()[0]
-        cursor.execute("""INSERT OR IGNORE INTO product_tags (product_id, tag_id)
-                            VALUES (?, ?)""", (product_id, tag_id))
+    # Create tag entries if they don't exist: one multi-row insert and one lookup for all names,
+    # then a single executemany for the links, re-indexing the product for search once
+    tags = list(dict.fromkeys(tags or []))
+    if not tags:
+        return
+    invalidate_products(conn, [product_id])
+    tag_ids = resolve_tag_ids(conn, cursor, tags)
+    with suspend_search_index(conn, cursor, [product_id]):
+        cursor.executemany("""INSERT OR IGNORE INTO product_tags (product_id, tag_id)
+                                VALUES (?, ?)""", [(product_id, tag_ids[t]) for t in tags])
+
+def resolve_tag_ids(conn, cursor, tag_names):
+    # Map tag names to ids, creating the missing tags; one multi-row insert and one
+    # IN (...) lookup per chunk of names instead of two statements per name
+    names = list(dict.fromkeys(tag_names))
+    tag_ids = {}
+    for chunk in chunked(names):
+        cursor.execute(f"INSERT OR IGNORE INTO tags(tag_name) VALUES {','.join(['(?)'] * len(chunk))}", chunk)
+        cursor.execute(f"SELECT id, tag_name FROM tags WHERE tag_name IN ({','.join('?' * len(chunk))})", chunk)
+        tag_ids.update({name: tag_id for tag_id, name in cursor.fetchall()})
+    return tag_ids
 
 def delete_tag_from_product(conn, cursor, product_id, tag_id):
     # Unlink a tag from a product (tag stays in table)
     cursor.execute("DELETE FROM product_tags WHERE product_id = ? AND tag_id = ?",
                     (product_id, tag_id))
     raise_value_error_if_not_found(cursor, msg = "Tag was not linked to this product")
+    invalidate_products(conn, [product_id])
 
 def edit_tag(conn, cursor, tag_id, new_name):
     # Rename tag by ID
     cursor.execute("UPDATE tags SET tag_name = ? WHERE id = ?",
                     (new_name, tag_id))
     raise_value_error_if_not_found(cursor, msg = "Tag not found")
+    # Every product showing this tag changes
+    invalidate_products_where(conn, cursor, "SELECT product_id FROM product_tags WHERE tag_id = ?", (tag_id,))
     return cursor.execute("SELECT id, tag_name FROM tags WHERE id = ?", (tag_id,)).fetchone()
     
 def search_by_tag(conn, cursor, tag_name):
+    # Products linked to any tag whose name contains tag_name
     cursor.execute("SELECT id FROM tags WHERE tag_name LIKE ?", (f"%{tag_name}%",))
-    tag = cursor.fetchone()
-    raise_value_error_if_empty(tag, msg = "Tag not found")
-    
-    tag_id = tag[0]
+    tag_ids = [row[0] for row in cursor.fetchall()]
+    raise_value_error_if_empty(tag_ids, msg = "Tag not found")
 
-    cursor.execute("SELECT product_id FROM product_tags WHERE tag_id = ?", (tag_id,))
+    placeholders = ",".join("?" * len(tag_ids))
+    cursor.execute(f"""SELECT DISTINCT product_id FROM product_tags
+                       WHERE tag_id IN ({placeholders}) ORDER BY product_id""", tag_ids)
     product_ids = [row[0] for row in cursor.fetchall()]
 
     return product_ids
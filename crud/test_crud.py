@@ -1,4 +1,6 @@
+import re
 import sqlite3
+import json
 import pytest
 from crud.product_crud import *
 from crud.image_crud import *
@@ -6,8 +8,15 @@ from crud.customer_crud import *
 from crud.tag_crud import *
 from crud.quote_crud import *
 from crud.misc_crud import *
+from crud.search_crud import *
+from crud.cache import ProductCache, product_cache, CustomerNameCache, customer_name_cache
+from crud.change_crud import *
+from crud.lock_crud import *
+from crud.analytics_crud import *
+from crud.maintenance_crud import *
 
 from database.schema import create_table, create_index
+from database.migrations import migrate
 from models import *
 
 # ========== CRUD TEST SUITE MEGA BLOCK ==========
@@ -41,6 +50,7 @@ def reset_database(conn, cursor):
         cursor.execute("PRAGMA table_info(product_manager)")
         for row in cursor.fetchall():
             print(row)
+    migrate(conn, cursor)
 
 def create_test_product(conn, cursor):
     product = ProductCreate(
@@ -79,6 +89,61 @@ def test_add_product(test_db):
     assert result[0][9] == "test remarks"
     assert result[0][10] == "box"
 
+def test_add_products_bulk(test_db):
+    conn, cursor = test_db
+    products = [
+        ProductCreate(ref_num = "BULK1", name = "bulk one", customers = ["test customer", "New Co"],
+                      quote = {"New Co": {"quote": 3.456, "remark": "bulk"}}, imgs = ["b1.jpg"], tags = ["test tag", "bulk"]),
+        ProductCreate(ref_num = "TEST001", name = "duplicate of fixture"),
+        ProductCreate(ref_num = "BULK2", name = "quotes nobody", quote = {"Ghost": {"quote": 1}}),
+        ProductCreate(ref_num = "BULK1", name = "duplicate within batch"),
+        ProductCreate(ref_num = "BULK3", name = "bulk three", tags = ["bulk"]),
+    ]
+    result = add_products_bulk(conn, cursor, products, chunk_size = 2)
+
+    assert [(c["index"], c["ref_num"]) for c in result["created"]] == [(0, "BULK1"), (4, "BULK3")]
+    assert [(e["index"], e["ref_num"]) for e in result["errors"]] == [(1, "TEST001"), (2, "BULK2"), (3, "BULK1")]
+    assert "Ghost" in result["errors"][1]["error"]
+
+    bulk_one = format_product(conn, cursor, result["created"][0]["id"])
+    assert [t["tag_name"] for t in bulk_one["tags"]] == ["test tag", "bulk"]
+    # Existing customer is matched case-insensitively instead of being duplicated
+    assert [c["customer_name"] for c in bulk_one["customers"]] == ["Test Customer", "New Co"]
+    assert len(list_customer(cursor)) == 2
+    assert bulk_one["quote"][0]["quote"] == 3.46
+    assert bulk_one["imgs"][0]["img"] == "b1.jpg"
+    assert len(list_tag(cursor)) == 2
+
+def test_add_products_bulk_rejected_rows_create_no_customers(test_db):
+    conn, cursor = test_db
+    products = [
+        ProductCreate(ref_num = "A", customers = ["Acme"], quote = {"Ghost": {"quote": 1}}),
+        ProductCreate(ref_num = "B", customers = ["Acme"]),
+        # A quote for a customer linked in the same row matches case-insensitively, as in add_product
+        ProductCreate(ref_num = "C", customers = ["Yak"], quote = {"yak": {"quote": 2}}),
+    ]
+    result = add_products_bulk(conn, cursor, products)
+    assert [c["ref_num"] for c in result["created"]] == ["B", "C"]
+    assert [e["ref_num"] for e in result["errors"]] == ["A"]
+    assert sorted(row["customer_name"] for row in list_customer(cursor)) == ["Acme", "Test Customer", "Yak"]
+    assert format_product(conn, cursor, result["created"][1]["id"])["quote"][0]["quote"] == 2
+
+def test_add_products_bulk_statement_count_is_constant(test_db):
+    conn, cursor = test_db
+    conn.commit()
+    def count_statements(products):
+        statements = []
+        conn.set_trace_callback(statements.append)
+        add_products_bulk(conn, cursor, products)
+        conn.set_trace_callback(None)
+        # executemany and triggers report once per row; everything else must not grow with the batch
+        return len([sql for sql in statements if not sql.startswith(("INSERT INTO product_", "INSERT INTO quotes",
+                                                                      "INSERT OR IGNORE INTO product_", "--",
+                                                                      "UPDATE product_manager SET version"))])
+    small = count_statements([ProductCreate(ref_num = f"S{i}", tags = [f"t{i}"], customers = [f"c{i}"]) for i in range(3)])
+    large = count_statements([ProductCreate(ref_num = f"L{i}", tags = [f"t{i}"], customers = [f"c{i}"]) for i in range(300)])
+    assert small == large
+
 def test_add_image(test_db):
     conn, cursor = test_db
     result_img = list_images(cursor)
@@ -110,6 +175,21 @@ def test_add_product_tag(test_db):
     assert len(result_product_tag) == 1
     assert result_product_tag[0] == "test tag"
 
+def test_add_tag_and_customer_are_set_based(test_db):
+    conn, cursor = test_db
+    statements = []
+    conn.set_trace_callback(statements.append)
+    add_tag(conn, cursor, 1, ["alpha", "beta", "test tag", "alpha"])
+    add_customer(conn, cursor, 1, ["Zenith", "test customer", "Orbit"])
+    conn.set_trace_callback(None)
+
+    assert list_product_tag(cursor, 1) == ["test tag", "alpha", "beta"]
+    assert list_product_customer(cursor, 1) == ["Test Customer", "Zenith", "Orbit"]
+    # The search row is rebuilt once per call, not once per linked name, and the suspension is lifted
+    assert len([sql for sql in statements if sql.startswith("DELETE FROM product_search")]) == 2
+    assert cursor.execute("SELECT COUNT(*) FROM search_index_suspended").fetchone()[0] == 0
+    assert search_products_text(conn, cursor, "beta zenith") == [1]
+
 def test_add_quote(test_db):
     conn, cursor = test_db
     result_quote = list_quote(cursor)
@@ -206,6 +286,123 @@ def test_search_by_ref_num(test_db):
 
     assert product_id == 1
 
+def test_search_product_name_prefix_and_rank(test_db):
+    conn, cursor = test_db
+    add_product(conn, cursor, ProductCreate(ref_num = "TEST002", name = "blue pencil case",
+                                            customers = [], quote = {}, imgs = [], tags = []))
+    add_product(conn, cursor, ProductCreate(ref_num = "TEST003", name = "pencil",
+                                            customers = [], quote = {}, imgs = [], tags = []))
+
+    assert set(search_product_name(conn, cursor, "pen")) == {1, 2, 3}
+    assert search_product_name(conn, cursor, "pencil")[0] == 3
+    assert search_product_name(conn, cursor, "blue pen") == [2]
+    # Fragments inside a word match through the trigram index, after the prefix matches
+    assert search_product_name(conn, cursor, "ncil") == [2, 3]
+    add_product(conn, cursor, ProductCreate(ref_num = "TEST004", name = "ballpen",
+                                            customers = [], quote = {}, imgs = [], tags = []))
+    assert search_product_name(conn, cursor, "pen")[-1] == 4
+    assert search_product_name(conn, cursor, "BALLP") == [4]
+
+    # The search filters complete word-prefix matches the same way, also when paged by id
+    assert find_product_ids(conn, cursor, name = "pen")[-1] == 4
+    assert find_product_ids(conn, cursor, name = "pen", limit = 3) == [1, 2, 3]
+    assert find_product_ids(conn, cursor, name = "pen", limit = 3, after_id = 3) == [4]
+
+def test_search_products_text_covers_tags_and_customers(test_db):
+    conn, cursor = test_db
+    assert search_products_text(conn, cursor, "test tag") == [1]
+    assert search_products_text(conn, cursor, "customer") == [1]
+    assert search_products_text(conn, cursor, "TEST001") == [1]
+    with pytest.raises(ValueError):
+        search_products_text(conn, cursor, "nothing")
+
+def test_search_index_follows_edits(test_db):
+    conn, cursor = test_db
+    edit_product(conn, cursor, 1, name = "fountain marker")
+    assert search_product_name(conn, cursor, "fountain") == [1]
+    with pytest.raises(ValueError):
+        search_products_text(conn, cursor, "pen")
+
+    edit_tag(conn, cursor, 1, "stationery")
+    assert search_products_text(conn, cursor, "stationery") == [1]
+    delete_tag_from_product(conn, cursor, 1, 1)
+    with pytest.raises(ValueError):
+        search_products_text(conn, cursor, "stationery")
+
+    edit_customer(conn, cursor, 1, "Acme")
+    assert search_products_text(conn, cursor, "acme") == [1]
+
+    delete_product(conn, cursor, 1)
+    assert cursor.execute("SELECT COUNT(*) FROM product_search").fetchone()[0] == 0
+
+def add_search_fixtures(conn, cursor):
+    add_product(conn, cursor, ProductCreate(ref_num = "TEST002", name = "blue pen", price_usd = 3.0, weight = 1.0,
+                                            customers = ["Acme"], quote = {}, imgs = [], tags = ["test tag", "blue"]))
+    add_product(conn, cursor, ProductCreate(ref_num = "TEST003", name = "blue box", price_usd = 8.0, weight = 5.0,
+                                            customers = ["Acme", "Test Customer"], quote = {}, imgs = [], tags = ["blue"]))
+
+def test_search_products_intersects_filters(test_db):
+    conn, cursor = test_db
+    add_search_fixtures(conn, cursor)
+
+    assert [p["id"] for p in search_products(conn, cursor, name = "blue", tag = "test tag")] == [2]
+    assert [p["id"] for p in search_products(conn, cursor, tag = ["test tag", "blue"])] == [1, 2, 3]
+    assert [p["id"] for p in search_products(conn, cursor, tag = ["test tag", "blue"], tag_mode = "all")] == [2]
+    assert [p["id"] for p in search_products(conn, cursor, customer = ["acme", "test customer"],
+                                             customer_mode = "all")] == [3]
+    assert [p["id"] for p in search_products(conn, cursor, tag = "blue", price_usd_min = 2,
+                                             price_usd_max = 5)] == [2]
+    assert [p["id"] for p in search_products(conn, cursor, weight_min = 0.1, weight_max = 1)] == [1, 2]
+    assert search_products(conn, cursor) == []
+    with pytest.raises(ValueError):
+        search_products(conn, cursor, name = "blue", ref_num = "TEST001")
+
+def test_search_products_is_one_statement(test_db):
+    conn, cursor = test_db
+    add_search_fixtures(conn, cursor)
+    sql, params = build_product_search(q = "blue", tags = ["blue", "tag"], tag_mode = "all",
+                                       customers = ["acme"], price_usd_max = 10)
+    plan = [row[3] for row in cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+    assert not any(step.split()[:2] == ["SCAN", "p"] for step in plan)
+    assert [row[0] for row in cursor.execute(sql, params)] == [2]
+
+def test_search_by_tag_uses_every_match(test_db):
+    conn, cursor = test_db
+    add_search_fixtures(conn, cursor)
+    assert search_by_tag(conn, cursor, "t") == [1, 2]
+    assert search_by_customer(conn, cursor, "c") == [1, 2, 3]
+
+def test_list_products_page_keyset(test_db):
+    conn, cursor = test_db
+    for i in range(4):
+        add_product(conn, cursor, ProductCreate(ref_num = f"PAGE{i}", name = f"page {i}",
+                                                customers = [], quote = {}, imgs = [], tags = []))
+    first = list_products_page(conn, cursor, limit = 2)
+    assert [p["id"] for p in first["items"]] == [1, 2]
+    assert first["items"][0]["tags"][0]["tag_name"] == "test tag"
+    second = list_products_page(conn, cursor, after = first["next_cursor"], limit = 2)
+    assert [p["id"] for p in second["items"]] == [3, 4]
+    third = list_products_page(conn, cursor, after = second["next_cursor"], limit = 2)
+    assert [p["id"] for p in third["items"]] == [5]
+    assert third["next_cursor"] is None
+
+    with pytest.raises(ValueError):
+        list_products_page(conn, cursor, after = first["next_cursor"], order_by = "last_updated")
+    with pytest.raises(ValueError):
+        list_products_page(conn, cursor, after = "not-a-cursor")
+
+def test_list_products_page_projection(test_db):
+    conn, cursor = test_db
+    statements = []
+    conn.set_trace_callback(statements.append)
+    page = list_products_page(conn, cursor, fields = "ref_num,price_usd", order_by = "last_updated")
+    conn.set_trace_callback(None)
+    assert page["items"] == [{"id": 1, "ref_num": "TEST001", "price_usd": 1.0}]
+    assert len(statements) == 1
+    assert set(list_products_page(conn, cursor, fields = "base")["items"][0]) == set(BASE_COLUMNS)
+    with pytest.raises(ValueError):
+        list_products_page(conn, cursor, fields = "ref_num,secret")
+
 
 # Edit function tests
 
@@ -229,6 +426,100 @@ def test_edit_quote(test_db):
     assert result[2] == 2
     assert result[3] == "new remark"
 
+def test_add_quote_rejects_unknown_customer_before_inserting(test_db):
+    conn, cursor = test_db
+    with pytest.raises(ValueError, match = "Customer Nobody not found"):
+        add_quote(conn, cursor, 1, {"test customer": QuoteDetail(quote = 2.0), "Nobody": QuoteDetail(quote = 1.0)})
+    assert len(list_quote(cursor)) == 1
+
+def test_add_quotes_bulk_reports_bad_rows(test_db):
+    conn, cursor = test_db
+    cache = CustomerNameCache()
+    rows = [QuoteRow(product_id = 1, quote = 1.25),
+            QuoteRow(ref_num = "TEST001", customer = "Nobody", quote = 1.0),
+            QuoteRow(ref_num = "MISSING", quote = 1.0),
+            QuoteRow(product_id = 1, quote = 0.9, timestamp = "2024-05-01"),
+            QuoteRow(product_id = 1, quote = 1.0, timestamp = "someday"),
+            QuoteRow(quote = 1.0)]
+    result = add_quotes_bulk(conn, cursor, rows, customer = "TEST CUSTOMER", cache = cache, chunk_size = 4)
+    assert result["created"] == 2
+    assert [(e["index"], e["error"]) for e in result["errors"]] == [
+        (1, "Customer Nobody not found"), (2, "Product MISSING not found"),
+        (4, "timestamp must be an ISO date or datetime, not 'someday'"), (5, "product_id or ref_num is required")]
+    assert cursor.execute("SELECT timestamp FROM quotes WHERE quote = 0.9").fetchone()[0] == "2024-05-01 00:00:00"
+    assert format_product(conn, cursor, 1)["quote"][0]["quote"] == 1.25
+
+    # The name was looked up once per chunk, then served from the cache
+    assert (cache.stats()["misses"], cache.stats()["hits"]) == (2, 1)
+
+def test_customer_name_cache_invalidated_by_renames(test_db):
+    conn, cursor = test_db
+    customer_name_cache.clear()
+    assert lookup_customer_ids(conn, cursor, ["Test Customer"], cache = customer_name_cache) == {"Test Customer": 1}
+    edit_customer(conn, cursor, 1, "Renamed Customer")
+    assert lookup_customer_ids(conn, cursor, ["Test Customer"], cache = customer_name_cache) == {}
+    assert lookup_customer_ids(conn, cursor, ["renamed customer"], cache = customer_name_cache) == {"renamed customer": 1}
+
+    # A load that started before an invalidation is not kept
+    racing = lambda keys: (customer_name_cache.invalidate(conn, ["x"]), {"x": 99})[1]
+    assert customer_name_cache.get_many(["x"], racing) == {"x": 99}
+    assert customer_name_cache.get_many(["x"], lambda keys: {}) == {}
+    customer_name_cache.clear()
+
+    # Changes the cache never hears about (another process) are picked up once entries expire
+    expiring = CustomerNameCache(ttl = 0)
+    assert expiring.get_many(["x"], lambda keys: {"x": 1}) == {"x": 1}
+    assert expiring.get_many(["x"], lambda keys: {}) == {}
+    assert expiring.stats()["expirations"] == 1
+
+def test_current_quotes_follow_history(test_db):
+    conn, cursor = test_db
+    add_quote(conn, cursor, 1, {"Test Customer": QuoteDetail(quote = 1.3)})
+    cursor.executemany("INSERT INTO quotes(product_id, customer_id, quote, timestamp) VALUES (1, 1, ?, ?)",
+                       [(0.9, "2024-01-02 10:00:00"), (1.0, "2024-01-20 10:00:00"), (1.2, "2024-02-03 10:00:00")])
+    # Backfilled history is older than the current quote and leaves it alone
+    assert [(q["quote"], q["quote_id"]) for q in format_product(conn, cursor, 1)["quote"]] == [(1.3, 2)]
+
+    edit_quote(conn, cursor, 1, 1.1, "older")
+    assert format_product(conn, cursor, 1)["quote"][0]["quote"] == 1.3
+    delete_quote(conn, cursor, 2)
+    assert format_product(conn, cursor, 1)["quote"][0]["quote"] == 1.1
+    delete_quote(conn, cursor, 1)
+    assert format_product(conn, cursor, 1)["quote"][0]["quote"] == 1.2
+    cursor.execute("DELETE FROM quotes")
+    assert format_product(conn, cursor, 1)["quote"] == []
+
+def test_quote_history_windows_and_downsamples(test_db):
+    conn, cursor = test_db
+    cursor.execute("DELETE FROM quotes")
+    cursor.executemany("INSERT INTO quotes(product_id, customer_id, quote, timestamp) VALUES (1, 1, ?, ?)",
+                       [(1.0, "2024-01-01 09:00:00"), (1.4, "2024-01-01 17:00:00"), (1.2, "2024-01-03 09:00:00"),
+                        (2.0, "2024-02-10 09:00:00"), (1.8, "2024-03-05 09:00:00")])
+
+    raw = quote_history(conn, cursor, 1, since = "2024-01-01", until = "2024-03-01")
+    assert [p["quote"] for p in raw["points"]] == [1.0, 1.4, 1.2, 2.0]
+    assert not raw["truncated"]
+    # Bounds with an offset are converted to UTC: 12:00+02:00 is 10:00 UTC
+    offset = quote_history(conn, cursor, 1, since = "2024-01-01T12:00:00+02:00", until = "2024-01-02")
+    assert [p["quote"] for p in offset["points"]] == [1.4]
+    assert parse_history_bound("2024-01-01T01:00:00+02:00", "since") == "2023-12-31 23:00:00"
+    latest = quote_history(conn, cursor, 1, limit = 2)
+    assert ([p["quote"] for p in latest["points"]], latest["truncated"]) == ([2.0, 1.8], True)
+
+    daily = quote_history(conn, cursor, 1, bucket = "day", until = "2024-01-31")
+    assert [(p["period"], p["open"], p["quote"], p["low"], p["high"], p["count"]) for p in daily["points"]] == \
+        [("2024-01-01", 1.0, 1.4, 1.0, 1.4, 2), ("2024-01-03", 1.2, 1.2, 1.2, 1.2, 1)]
+    weekly = quote_history(conn, cursor, 1, bucket = "week")
+    assert [p["period"] for p in weekly["points"]] == ["2024-01-01", "2024-02-05", "2024-03-04"]
+    monthly = quote_history(conn, cursor, 1, bucket = "month", limit = 2)
+    assert [(p["period"], p["avg"]) for p in monthly["points"]] == [("2024-02-01", 2.0), ("2024-03-01", 1.8)]
+    assert monthly["truncated"]
+
+    with pytest.raises(ValueError):
+        quote_history(conn, cursor, 999)
+    with pytest.raises(ValueError):
+        quote_history(conn, cursor, 1, since = "last week")
+
 def test_edit_tag(test_db):
     conn, cursor = test_db
     edit_tag(conn, cursor, 1, "new tag")
@@ -247,4 +538,440 @@ def test_edit_customer(test_db):
     assert len(result) == 1
     tag = result[0]
 
-    assert tag[1] == "new customer"
\ No newline at end of file
+    assert tag[1] == "new customer"
+
+# Format function tests
+
+def test_format_products_matches_format_product(test_db):
+    conn, cursor = test_db
+    second = ProductCreate(ref_num = "TEST002", name = "test pencil",
+                           customers = ["Test Customer", "Other Customer"],
+                           quote = {"Other Customer": {"quote": 2.5, "remark": "second"}},
+                           imgs = ["img2.jpg", "img3.jpg"], tags = ["test tag", "pencil"])
+    add_product(conn, cursor, second)
+
+    batched = format_products(conn, cursor, [2, 1, 999])
+    assert [p["id"] for p in batched] == [2, 1]
+    assert batched[0] == format_product(conn, cursor, 2)
+    assert batched[1] == format_product(conn, cursor, 1)
+    assert [t["tag_name"] for t in batched[0]["tags"]] == ["test tag", "pencil"]
+    assert len(batched[0]["imgs"]) == 2
+    assert batched[0]["quote"][0]["customer_name"] == "Other Customer"
+
+def test_format_products_uses_constant_queries(test_db):
+    conn, cursor = test_db
+    for i in range(20):
+        add_product(conn, cursor, ProductCreate(ref_num = f"BULK{i}", customers = [], quote = {},
+                                                imgs = [], tags = []))
+    statements = []
+    conn.set_trace_callback(statements.append)
+    format_products(conn, cursor, list(range(1, 22)))
+    conn.set_trace_callback(None)
+    assert len(statements) == 5
+
+
+def test_product_version_covers_child_rows(test_db):
+    conn, cursor = test_db
+    add_product(conn, cursor, ProductCreate(ref_num = "TEST002", customers = [], quote = {}, imgs = [], tags = []))
+    def version():
+        return dict(product_versions(conn, cursor, [1, 2]))
+    writes = [
+        lambda: edit_product(conn, cursor, 1, price_usd = 2.0),
+        lambda: add_image(conn, cursor, 1, ["img9.jpg"]),
+        lambda: delete_image(conn, cursor, 1),
+        lambda: add_tag(conn, cursor, 1, ["a", "b", "c"]),
+        lambda: delete_tag_from_product(conn, cursor, 1, 1),
+        lambda: add_customer(conn, cursor, 1, ["Other"]),
+        lambda: delete_customer_from_product(conn, cursor, 1, 1),
+        lambda: edit_quote(conn, cursor, 1, 2.0, None),
+        lambda: delete_quote(conn, cursor, 1),
+        lambda: edit_tag(conn, cursor, 2, "renamed"),
+        lambda: edit_customer(conn, cursor, 2, "Renamed"),
+        lambda: locked_product(conn, cursor, 1, "alice"),
+    ]
+    for write in writes:
+        before = version()
+        write()
+        after = version()
+        assert after[1] > before[1]
+        assert after[2] == before[2]
+    assert format_product(conn, cursor, 1)["version"] == version()[1]
+
+    # Linking many names through the set-based path bumps the version once
+    before = version()[1]
+    add_tag(conn, cursor, 1, [f"tag {i}" for i in range(20)])
+    assert version()[1] == before + 1
+
+def test_edit_product_expected_version(test_db):
+    conn, cursor = test_db
+    version = format_product(conn, cursor, 1)["version"]
+    edit_product(conn, cursor, 1, expected_version = version, name = "first")
+    with pytest.raises(VersionConflict) as conflict:
+        edit_product(conn, cursor, 1, expected_version = version, name = "stale")
+    assert conflict.value.current_version == version + 1
+    assert format_product(conn, cursor, 1)["name"] == "first"
+    with pytest.raises(ValueError):
+        edit_product(conn, cursor, 99, expected_version = 1, name = "missing")
+
+    # Child writes are guarded by check_version in the same transaction
+    check_version(conn, cursor, 1, version + 1)
+    add_tag(conn, cursor, 1, ["guarded"])
+    with pytest.raises(VersionConflict):
+        check_version(conn, cursor, 1, version + 1)
+    check_version(conn, cursor, 1, None)
+
+# Change feed tests
+
+def test_list_changes_compacts_and_tracks_deletes(test_db):
+    conn, cursor = test_db
+    first = list_changes(conn, cursor)
+    assert (first["upserted"], first["deleted"], first["has_more"]) == ([1], [], False)
+    token = first["next_token"]
+    assert list_changes(conn, cursor, token)["upserted"] == []
+
+    add_product(conn, cursor, ProductCreate(ref_num = "TEST002", customers = [], quote = {}, imgs = [], tags = []))
+    add_tag(conn, cursor, 1, ["changed"])
+    edit_product(conn, cursor, 1, name = "changed again")
+    delete_product(conn, cursor, 2)
+    changes = list_changes(conn, cursor, token)
+    assert (changes["upserted"], changes["deleted"]) == ([1], [2])
+    assert list_changes(conn, cursor, changes["next_token"])["upserted"] == []
+
+    # Renaming a customer reaches the products quoting it
+    edit_customer(conn, cursor, 1, "Renamed")
+    assert list_changes(conn, cursor, changes["next_token"])["upserted"] == [1]
+    assert current_change_token(conn, cursor) == list_changes(conn, cursor, changes["next_token"])["next_token"]
+
+def test_list_changes_pages_and_prunes(test_db):
+    conn, cursor = test_db
+    for i in range(2, 7):
+        add_product(conn, cursor, ProductCreate(ref_num = f"TEST00{i}", customers = [], quote = {}, imgs = [], tags = []))
+    page = list_changes(conn, cursor, limit = 4)
+    assert (page["upserted"], page["has_more"]) == ([1, 2, 3, 4], True)
+    page = list_changes(conn, cursor, page["next_token"], limit = 4)
+    assert (page["upserted"], page["has_more"]) == ([5, 6], False)
+
+    old_token = page["next_token"]
+    delete_product(conn, cursor, 3)
+    edit_product(conn, cursor, 4, name = "newer")
+    assert prune_changes(conn, cursor, keep = 1) == 1
+    with pytest.raises(ChangesPruned):
+        list_changes(conn, cursor, old_token)
+    assert list_changes(conn, cursor)["upserted"] == [1, 2, 5, 6, 4]
+    with pytest.raises(ValueError):
+        list_changes(conn, cursor, "not-a-token")
+
+# Product cache tests
+
+@pytest.fixture
+def cache():
+    product_cache.clear()
+    yield product_cache
+    product_cache.clear()
+
+def test_product_cache_hits_skip_queries(test_db, cache):
+    conn, cursor = test_db
+    first = format_product(conn, cursor, 1, cache = cache)
+    statements = []
+    conn.set_trace_callback(statements.append)
+    assert format_product(conn, cursor, 1, cache = cache) is first
+    conn.set_trace_callback(None)
+    assert statements == []
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+def test_product_cache_invalidated_by_writes(test_db, cache):
+    conn, cursor = test_db
+    writes = [
+        lambda: edit_product(conn, cursor, 1, name = "renamed"),
+        lambda: add_image(conn, cursor, 1, ["img9.jpg"]),
+        lambda: delete_image(conn, cursor, 1),
+        lambda: add_tag(conn, cursor, 1, ["another"]),
+        lambda: delete_tag_from_product(conn, cursor, 1, 1),
+        lambda: add_customer(conn, cursor, 1, ["Other"]),
+        lambda: edit_quote(conn, cursor, 1, 9.99, "changed"),
+        lambda: delete_quote(conn, cursor, 1),
+        lambda: locked_product(conn, cursor, 1, "alice"),
+        lambda: unlock_product(conn, cursor, 1),
+    ]
+    for write in writes:
+        format_product(conn, cursor, 1, cache = cache)
+        write()
+        assert format_product(conn, cursor, 1, cache = cache) == format_product(conn, cursor, 1)
+
+def test_product_cache_rename_fans_out(test_db, cache):
+    conn, cursor = test_db
+    add_product(conn, cursor, ProductCreate(ref_num = "TEST002", customers = ["Test Customer"],
+                                            imgs = [], tags = ["test tag"], quote = {}))
+    add_product(conn, cursor, ProductCreate(ref_num = "TEST003", customers = [], imgs = [], tags = [],
+                                            quote = {"Test Customer": {"quote": 2.0}}))
+    format_products(conn, cursor, [1, 2, 3], cache = cache)
+
+    edit_tag(conn, cursor, 1, "renamed tag")
+    assert cache.stats()["entries"] == 1  # only product 3 has no tag
+    format_products(conn, cursor, [1, 2, 3], cache = cache)
+    edit_customer(conn, cursor, 1, "Renamed Customer")
+    assert cache.stats()["entries"] == 0  # linked (1, 2) or quoted (3)
+    third = format_product(conn, cursor, 3, cache = cache)
+    assert third["quote"][0]["customer_name"] == "Renamed Customer"
+
+def test_product_cache_rejects_loads_racing_a_write(test_db, cache):
+    conn, cursor = test_db
+    def load_then_write(missing):
+        products = format_products(conn, cursor, missing)
+        edit_product(conn, cursor, 1, name = "changed meanwhile")
+        return products
+    assert cache.get_many([1], load_then_write)[0]["name"] == "test pen"
+    assert cache.stats()["rejected"] == 1
+    assert format_product(conn, cursor, 1, cache = cache)["name"] == "changed meanwhile"
+
+def test_product_cache_bounds(test_db):
+    conn, cursor = test_db
+    for i in range(2, 5):
+        add_product(conn, cursor, ProductCreate(ref_num = f"TEST00{i}", customers = [], quote = {},
+                                                imgs = [], tags = []))
+    load = lambda ids: format_products(conn, cursor, ids)
+
+    lru = ProductCache(max_entries = 2, max_bytes = 10 ** 6, ttl = 60)
+    lru.get_many([1, 2], load)
+    lru.get_many([1], load)      # 1 is now the most recently used
+    lru.get_many([3], load)      # evicts 2
+    assert lru.stats()["evictions"] == 1
+    lru.get_many([1, 3], load)
+    assert lru.stats()["hits"] == 3
+
+    size = len(json.dumps(format_product(conn, cursor, 2), default = str))
+    budget = ProductCache(max_entries = 10, max_bytes = size * 2 + 1, ttl = 60)
+    budget.get_many([2, 3, 4], load)
+    assert budget.stats()["entries"] == 2
+
+    expiring = ProductCache(max_entries = 10, max_bytes = 10 ** 6, ttl = 0)
+    expiring.get_many([1], load)
+    expiring.get_many([1], load)
+    assert expiring.stats()["expirations"] == 1
+
+    disabled = ProductCache(max_entries = 0)
+    assert disabled.get_many([1], load)[0]["id"] == 1
+    assert disabled.stats()["entries"] == 0
+
+
+# Lock tests
+
+@pytest.fixture
+def metrics():
+    lock_metrics.reset()
+    yield lock_metrics
+    lock_metrics.reset()
+
+def test_lock_conflicts_and_expiry(test_db, metrics):
+    conn, cursor = test_db
+    acquire_lock(conn, cursor, 1, "alice")
+    acquire_lock(conn, cursor, 1, "alice")  # re-acquiring renews
+    with pytest.raises(LockConflict) as conflict:
+        acquire_lock(conn, cursor, 1, "bob")
+    assert conflict.value.holders == {1: "alice"}
+    with pytest.raises(LockConflict):
+        release_lock(conn, cursor, 1, "bob")
+    with pytest.raises(LockConflict):
+        renew_lock(conn, cursor, 1, "bob")
+    renew_lock(conn, cursor, 1, "alice")
+    with pytest.raises(ValueError):
+        acquire_lock(conn, cursor, 99, "alice")
+
+    # An expired lease can be taken over
+    acquire_lock(conn, cursor, 1, "bob", ttl = 0)
+    assert format_product(conn, cursor, 1)["locked_by"] == "bob"
+    assert release_lock(conn, cursor, 1, "bob") == [1]
+    assert format_product(conn, cursor, 1)["locked_timestamp"] is None
+    stats = metrics.stats()
+    assert (stats["acquired"], stats["renewed"], stats["released"], stats["conflicts"]) == (3, 1, 1, 3)
+
+def test_acquire_locks_is_all_or_nothing(test_db, metrics):
+    conn, cursor = test_db
+    add_product(conn, cursor, ProductCreate(ref_num = "TEST002", customers = [], quote = {}, imgs = [], tags = []))
+    add_product(conn, cursor, ProductCreate(ref_num = "TEST003", customers = [], quote = {}, imgs = [], tags = []))
+    conn.commit()
+    acquire_lock(conn, cursor, 2, "bob")
+    with pytest.raises(LockConflict) as conflict:
+        acquire_locks(conn, cursor, [1, 2, 3], "alice", wait = 0.05)
+    assert conflict.value.holders == {2: "bob"}
+    assert [format_product(conn, cursor, pid)["locked_by"] for pid in (1, 2, 3)] == [None, "bob", None]
+    assert (metrics.stats()["waits"], metrics.stats()["timeouts"]) == (1, 1)
+
+    release_locks(conn, cursor, [2], "bob")
+    assert acquire_locks(conn, cursor, [1, 2, 3], "alice") == [1, 2, 3]
+    assert count_active_locks(conn, cursor) == 3
+
+def test_acquire_locks_joins_the_callers_transaction(test_db, metrics):
+    conn, cursor = test_db
+    conn.commit()
+    cursor.execute("UPDATE product_manager SET ref_num = 'PENDING' WHERE id = 1")
+    with pytest.raises(ValueError):
+        acquire_lock(conn, cursor, 1, "alice", wait = 1)
+    acquire_lock(conn, cursor, 1, "alice")
+    assert conn.in_transaction
+    conn.rollback()
+    assert (format_product(conn, cursor, 1)["locked_by"], format_product(conn, cursor, 1)["ref_num"]) == (None, "TEST001")
+
+def test_reap_expired_locks(test_db, metrics):
+    conn, cursor = test_db
+    acquire_lock(conn, cursor, 1, "alice")
+    assert reap_expired_locks(conn, cursor) == []
+    assert reap_expired_locks(conn, cursor, ttl = 0) == [1]
+    assert format_product(conn, cursor, 1)["locked_by"] is None
+    assert count_active_locks(conn, cursor) == 0
+    assert metrics.stats()["reaped"] == 1
+
+
+# Orphan cleanup tests
+
+def test_clean_orphaned_data_in_batches(test_db):
+    conn, cursor = test_db
+    cursor.executemany("INSERT INTO tags(tag_name) VALUES (?)", [(f"unused {i}",) for i in range(5)])
+    cursor.executemany("INSERT INTO customers(customer_name) VALUES (?)", [("Gone A",), ("Gone B",), ("Gone C",)])
+    gone_a = cursor.execute("SELECT id FROM customers WHERE customer_name = 'Gone A'").fetchone()[0]
+    # A quote without a customer must not keep every customer alive (the old NOT IN did)
+    cursor.execute("INSERT INTO quotes(product_id, customer_id, quote) VALUES (1, NULL, 1.0)")
+    conn.commit()
+    cursor.execute("PRAGMA foreign_keys = OFF")
+    cursor.execute("INSERT INTO quotes(product_id, customer_id, quote) VALUES (999, ?, 1.0)", (gone_a,))
+    conn.commit()
+    cursor.execute("PRAGMA foreign_keys = ON")
+    tags, customers, quotes = (cursor.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                               for table in ("tags", "customers", "quotes"))
+
+    cleanup_metrics.reset()
+    report = clean_orphaned_data(conn, cursor, batch_size = 2)
+    assert report["removed"] == {"quotes": 1, "tags": 5, "customers": 3, "product_changes": 0}
+    assert report["batches"] >= 3 + 3 + 2 + 1
+    assert 0 <= report["max_lock_hold"] <= report["elapsed"]
+    assert not conn.in_transaction
+    assert [cursor.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in ("tags", "customers", "quotes")] \
+        == [tags - 5, customers - 3, quotes - 1]
+    assert [c["customer_name"] for c in format_product(conn, cursor, 1)["customers"]] == ["Test Customer"]
+    assert clean_orphaned_data(conn, cursor)["removed"] == {"quotes": 0, "tags": 0, "customers": 0,
+                                                            "product_changes": 0}
+    assert cleanup_metrics.stats()["runs"] == 2
+
+def test_clean_orphaned_data_prunes_change_tombstones(test_db):
+    conn, cursor = test_db
+    for i in range(3):
+        add_product(conn, cursor, ProductCreate(ref_num = f"GONE{i}"))
+    for product_id in (2, 3, 4):
+        delete_product(conn, cursor, product_id)
+    report = clean_orphans(lambda step: (step(conn, cursor), 0.0), keep = 1)
+    assert report["removed"]["product_changes"] == 2
+    assert cursor.execute("SELECT COUNT(*) FROM product_changes WHERE deleted = 1").fetchone()[0] == 1
+
+
+# Quote analytics tests
+
+def test_percentile_interpolates():
+    assert percentile([1.0, 2.0, 3.0, 4.0], 0.5) == 2.5
+    assert percentile([1.0, 2.0, 3.0, 4.0], 0.9) == pytest.approx(3.7)
+    assert summarize([])["median"] is None
+
+def test_quote_summary_groups_by_customer(test_db):
+    conn, cursor = test_db
+    add_product(conn, cursor, ProductCreate(ref_num = "TEST002", price_usd = 2.0, customers = ["Other Customer"],
+                                            quote = {"Other Customer": {"quote": 2.5}, "Test Customer": {"quote": 3.0}}))
+    add_quote(conn, cursor, 1, {"Test Customer": QuoteDetail(quote = 1.5)})
+
+    summary = quote_summary(conn, cursor)
+    by_name = {c["customer_name"]: c for c in summary["customers"]}
+    test = by_name["Test Customer"]
+    assert (test["products"], test["quotes"]["count"], test["quotes"]["min"], test["quotes"]["max"]) == (2, 2, 1.5, 3.0)
+    assert test["quotes"]["median"] == 2.25
+    # (1.5 - 1.0) / 1.5 and (3.0 - 2.0) / 3.0
+    assert test["margin"]["avg"] == pytest.approx((1 / 3 + 1 / 3) / 2, abs = 1e-4)
+    assert by_name["Other Customer"]["margin"]["median"] == 0.2
+    assert summary["overall"]["count"] == 3
+
+    history = quote_summary(conn, cursor, history = True)
+    assert {c["customer_name"]: c["quotes"]["count"] for c in history["customers"]}["Test Customer"] == 3
+    rmb = quote_summary(conn, cursor, currency = "rmb")
+    assert {c["customer_name"]: c["margin"]["count"] for c in rmb["customers"]}["Other Customer"] == 0
+
+def test_quote_drift_relative_to_opening_quote(test_db):
+    conn, cursor = test_db
+    cursor.execute("DELETE FROM quotes")
+    cursor.executemany("INSERT INTO quotes(product_id, customer_id, quote, timestamp) VALUES (1, 1, ?, ?)",
+                       [(2.0, "2024-01-05 09:00:00"), (2.2, "2024-02-05 09:00:00"), (2.4, "2024-02-20 09:00:00")])
+    drift = quote_drift(conn, cursor, bucket = "month")
+    assert [(p["period"], p["ratio"]["count"], p["ratio"]["median"]) for p in drift["points"]] == \
+        [("2024-01-01", 1, 1.0), ("2024-02-01", 2, 1.15)]
+    # The window trims the points, not the opening quote
+    windowed = quote_drift(conn, cursor, since = "2024-02-10")
+    assert [(p["period"], p["ratio"]["max"]) for p in windowed["points"]] == [("2024-02-01", 1.2)]
+
+def test_analytics_cache_until_next_quote_write(test_db):
+    conn, cursor = test_db
+    cache = AnalyticsCache()
+    first = quote_summary(conn, cursor, cache = cache)
+    assert quote_summary(conn, cursor, cache = cache) is first
+    assert quote_summary(conn, cursor, currency = "rmb", cache = cache) is not first
+
+    edit_product(conn, cursor, 1, remarks = "not a price")
+    assert quote_summary(conn, cursor, cache = cache) is first
+    add_quote(conn, cursor, 1, {"Test Customer": QuoteDetail(quote = 9.0)})
+    second = quote_summary(conn, cursor, cache = cache)
+    assert second is not first
+    assert second["overall"]["max"] == 9.0
+    edit_product(conn, cursor, 1, price_usd = 3.0)
+    assert quote_summary(conn, cursor, cache = cache) is not second
+    assert cache.stats()["hits"] == 2
+
+
+# Query plan tests
+
+# The statements the CRUD calls actually run are captured with a trace callback and explained.
+# label -> (call, tables that may be scanned): tags and customers are small name tables matched by
+# substring (LIKE '%...%'), which no index serves
+HOT_CALLS = {
+    "format_products": (lambda conn, cursor: format_products(conn, cursor, [1, 2]), ()),
+    "list_products_page by id": (lambda conn, cursor: list_products_page(conn, cursor, limit = 10), ()),
+    "list_products_page by last_updated": (
+        lambda conn, cursor: list_products_page(conn, cursor, limit = 10, order_by = "last_updated"), ()),
+    "search by text": (lambda conn, cursor: find_product_ids(conn, cursor, q = "pen"), ()),
+    "search by name": (lambda conn, cursor: find_product_ids(conn, cursor, name = "pen"), ()),
+    "search by barcode": (lambda conn, cursor: find_product_ids(conn, cursor, barcode = 111111), ()),
+    "search by ref_num": (lambda conn, cursor: find_product_ids(conn, cursor, ref_num = "TEST001"), ()),
+    "search page by tag": (lambda conn, cursor: search_product_ids_page(conn, cursor, tag = "test tag", limit = 10),
+                           ("tags",)),
+    "search by customer": (lambda conn, cursor: find_product_ids(conn, cursor, customers = "Test Customer"),
+                           ("customers",)),
+    "search page by price": (lambda conn, cursor: search_product_ids_page(conn, cursor, limit = 10, price_usd_min = 0.5),
+                             ()),
+    "quote history": (lambda conn, cursor: quote_history(conn, cursor, 1, since = "2025-01-01"), ()),
+    "search_by_tag": (lambda conn, cursor: search_by_tag(conn, cursor, "test tag"), ("tags",)),
+    "search_by_customer": (lambda conn, cursor: search_by_customer(conn, cursor, "Test Customer"), ("customers",)),
+    "search_by_barcode": (lambda conn, cursor: search_by_barcode(conn, cursor, 111111), ()),
+    "search_by_ref_num": (lambda conn, cursor: search_by_ref_num(conn, cursor, "TEST001"), ()),
+    "customer by name": (lambda conn, cursor: lookup_customer_ids(conn, cursor, ["Test Customer"]), ()),
+    "customer rename": (lambda conn, cursor: edit_customer(conn, cursor, 1, "Renamed"), ()),
+    "expired locks": (lambda conn, cursor: reap_expired_locks(conn, cursor), ()),
+    "change feed": (lambda conn, cursor: list_changes(conn, cursor, limit = 10), ()),
+}
+
+def full_scans(sql, plan, allowed):
+    # Plain "SCAN table" steps. A LIMIT query whose ORDER BY needs no sort walks its index (or the
+    # rowid) and stops after the page, so its scan is not a full one
+    walks = " LIMIT " in sql and not any(step.startswith("USE TEMP B-TREE FOR ORDER BY") for step in plan)
+    return [step for step in plan if re.fullmatch(r"SCAN \w+", step) and step.split()[1] not in allowed and not walks]
+
+@pytest.mark.parametrize("label", HOT_CALLS)
+def test_hot_queries_use_indexes(test_db, label):
+    conn, cursor = test_db
+    conn.commit()
+    call, allowed = HOT_CALLS[label]
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        call(conn, cursor)
+    finally:
+        conn.set_trace_callback(None)
+    queries = [sql for sql in statements if sql.lstrip().upper().startswith(("SELECT", "WITH", "UPDATE", "DELETE"))]
+    assert queries, f"{label} ran no queries"
+    for sql in queries:
+        plan = [row[3] for row in cursor.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()]
+        assert not full_scans(sql, plan, allowed), f"{label} falls back to a full scan: {sql} {plan}"
@@ -1,3 +1,10 @@
+import re
+import json
+import base64
+
+# Max number of bound parameters per IN (...) list; stays well below SQLite's variable limit
+SQL_CHUNK_SIZE = 500
+
 # Raise value error if empty; select + fetchone/fetchall statements
 def raise_value_error_if_empty(result, msg = "Resource not found"):
     if not result:
@@ -7,4 +14,39 @@ def raise_value_error_if_empty(result, msg = "Resource not found"):
 def raise_value_error_if_not_found(cursor, msg = "Resource not found"):
     if cursor.rowcount == 0:
         raise ValueError(msg)
-    
\ No newline at end of file
+    
+
+# Split a list into consecutive slices of at most size items; for IN (...) lists and executemany batches
+def chunked(items, size = SQL_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+# Python equivalent of SQLite's NOCASE collation (folds ASCII letters only)
+def nocase(name):
+    return "".join(ch.lower() if "A" <= ch <= "Z" else ch for ch in name)
+
+# Build an FTS5 MATCH expression where every word must match as a prefix, optionally limited
+# to some columns of product_search; returns None when the text has no searchable words
+def fts_query(text, columns = None):
+    terms = re.findall(r"\w+", text or "")
+    if not terms:
+        return None
+    expr = " ".join(f'"{term}"*' for term in terms)
+    if columns:
+        expr = f"{{{' '.join(columns)}}} : ({expr})"
+    return expr
+
+# Opaque keyset-pagination cursor: the sort key values of the last row on a page
+def encode_cursor(values):
+    raw = json.dumps(values, separators = (",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
@@ -1,30 +1,94 @@
 import sqlite3
+import functools
+import threading
+import weakref
+import logging
+from contextlib import contextmanager
+import config
 from database.schema import create_table
+from database.migrations import migrate
+from database.pool import get_pool
+from database.storage import apply_storage_profile
 
-def init_database(db_name = "product_manager.db"):
+def init_database(db_name = config.DB_NAME, profile = None):
     conn = sqlite3.connect(db_name)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     cursor.execute("PRAGMA foreign_keys = ON")
+    apply_storage_profile(conn, profile)
     create_table(conn, cursor)
+    migrate(conn, cursor)
     conn.close()
 
-def get_db(db_name = "product_manager.db"):
-    conn = sqlite3.connect(db_name)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON")
-    cursor = conn.cursor()
-    try:
-        yield conn, cursor
-        conn.commit()
-    except:
-        conn.rollback()
-        raise
-    finally:
-        conn.close()
+# Callbacks to run once the current unit of work on a connection has ended; see on_commit.
+# conn -> {callback: keys}. Weakly keyed, so the hooks of a connection dropped without reaching
+# run_commit_hooks go with it instead of passing to a later connection
+_commit_hooks = weakref.WeakKeyDictionary()
+_commit_hooks_lock = threading.Lock()
+
+def on_commit(conn, callback, keys = ()):
+    # Run callback(conn, keys) after the request / open_db block / writer batch using conn commits
+    # or rolls back, once per unit of work: keys is the union of the keys given for callback
+    # (None if any registration passed None, meaning "everything").
+    # Plain sqlite3 connections (scripts, tests) cannot be weakly referenced and have no such
+    # block to wait for; their callback runs right away
+    keys = None if keys is None else set(keys)
+    with _commit_hooks_lock:
+        try:
+            hooks = _commit_hooks.setdefault(conn, {})
+        except TypeError:
+            hooks = None
+        else:
+            if callback in hooks:
+                pending = hooks[callback]
+                hooks[callback] = None if keys is None or pending is None else pending | keys
+            else:
+                hooks[callback] = keys
+    if hooks is None:
+        callback(conn, keys)
+
+def run_commit_hooks(conn):
+    with _commit_hooks_lock:
+        try:
+            hooks = _commit_hooks.pop(conn, {})
+        except TypeError:
+            hooks = {}
+    for callback, keys in hooks.items():
+        try:
+            callback(conn, keys)
+        except Exception:
+            logging.exception("Commit hook failed")
+
+def get_db():
+    # Dependency: a pooled connection to config.DB_NAME for the duration of the request. It takes no
+    # parameters, since FastAPI would expose them as query parameters; tests switch databases
+    # through app.dependency_overrides
+    with open_db(config.DB_NAME) as session:
+        yield session
+
+@contextmanager
+def open_db(db_name = config.DB_NAME):
+    # Pooled (conn, cursor) for work that outlives the request dependency, e.g. a streaming response
+    # or a handler running on a DB executor; commits or rolls back like get_db
+    with get_pool(db_name).connection() as conn:
+        cursor = conn.cursor()
+        try:
+            yield conn, cursor
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            run_commit_hooks(conn)
+
+def get_db_factory():
+    # Dependency: a callable that opens a pooled connection to config.DB_NAME when the caller is
+    # ready to use it. Needed because yield-dependencies are closed before a StreamingResponse body is sent
+    return functools.partial(open_db, config.DB_NAME)
 
 
-def reset_database(db_name = "product_manager.db"):
+def reset_database(db_name = config.DB_NAME):
     # for whole database reset if necessary
     conn = sqlite3.connect(db_name)
     conn.row_factory = sqlite3.Row
@@ -37,10 +101,19 @@ def reset_database(db_name = "product_manager.db"):
         cursor.execute("DROP TABLE IF EXISTS tags")
         cursor.execute("DROP TABLE IF EXISTS product_tags")
         cursor.execute("DROP TABLE IF EXISTS quotes")
+        cursor.execute("DROP TABLE IF EXISTS product_search")
+        cursor.execute("DROP TABLE IF EXISTS search_index_suspended")
+        cursor.execute("DROP TABLE IF EXISTS product_changes")
+        cursor.execute("DROP TABLE IF EXISTS change_sequence")
+        cursor.execute("DROP TABLE IF EXISTS current_quotes")
+        cursor.execute("DROP TABLE IF EXISTS quote_generation")
+        cursor.execute("DROP TABLE IF EXISTS product_name_trigram")
 
         cursor.execute("DROP TABLE IF EXISTS product_manager")
         cursor.execute("PRAGMA foreign_keys = ON")
+        cursor.execute("PRAGMA user_version = 0")
         create_table(conn, cursor)
+    migrate(conn, cursor)
     conn.close()
 
 
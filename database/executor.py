@@ -0,0 +1,141 @@
+import time
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import config
+
+
+class ExecutorSaturated(Exception):
+    pass
+
+
+class DBExecutor:
+    """
+    Bounded thread pool that runs blocking database work for async route handlers.
+    At most max_queue calls wait for a worker; beyond that run() raises ExecutorSaturated
+    right away (the API answers 503) instead of letting requests pile up.
+    Keep the total number of workers over all lanes at or below the connection pool size,
+    so a worker never waits for a connection.
+    """
+
+    def __init__(self, name, workers, max_queue = config.DB_EXECUTOR_MAX_QUEUE):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = f"db-{name}")
+        self._lock = threading.Lock()
+
+        self._queued = 0
+        self._active = 0
+        self._max_queued = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._cancelled = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+        self._busy_time = 0.0
+
+    async def run(self, func, *args, **kwargs):
+        # Run func(*args, **kwargs) on a worker thread and await its result
+        with self._lock:
+            if self._queued >= self.max_queue:
+                self._rejected += 1
+                raise ExecutorSaturated(f"Database executor '{self.name}' is saturated ({self._queued} queued)")
+            self._queued += 1
+            self._submitted += 1
+            self._max_queued = max(self._max_queued, self._queued)
+        submitted = time.monotonic()
+        context = contextvars.copy_context()
+
+        def call():
+            started = time.monotonic()
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+                self._wait_time += started - submitted
+                self._max_wait = max(self._max_wait, started - submitted)
+            failed = False
+            try:
+                return context.run(func, *args, **kwargs)
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._busy_time += time.monotonic() - started
+                    if failed:
+                        self._failed += 1
+                    else:
+                        self._completed += 1
+
+        def settle(future):
+            # A call whose awaiting request was cancelled while it was queued never starts, so
+            # call() cannot take it off the queue
+            if future.cancelled():
+                with self._lock:
+                    self._queued -= 1
+                    self._cancelled += 1
+
+        future = self._executor.submit(call)
+        future.add_done_callback(settle)
+        return await asyncio.wrap_future(future)
+
+    def stats(self):
+        with self._lock:
+            started = self._submitted - self._queued - self._cancelled
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "active": self._active,
+                "queued": self._queued,
+                "max_queued": self._max_queued,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "cancelled": self._cancelled,
+                "wait_time": round(self._wait_time, 6),
+                "avg_wait": round(self._wait_time / started, 6) if started else 0.0,
+                "max_wait": round(self._max_wait, 6),
+                "busy_time": round(self._busy_time, 6),
+            }
+
+    def shutdown(self, wait = True):
+        self._executor.shutdown(wait = wait)
+
+
+# Lanes: point reads get their own workers so slow searches and listings cannot starve them,
+# writes (serialized by SQLite anyway) get a small lane of their own, and lock routes, which may
+# sleep while a holder lets go, get another so a waiting lock never holds up other writes
+LANES = {
+    "read": config.DB_READ_WORKERS,
+    "query": config.DB_QUERY_WORKERS,
+    "write": config.DB_WRITE_WORKERS,
+    "lock": config.DB_LOCK_WORKERS,
+}
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+def get_executor(lane):
+    with _executors_lock:
+        executor = _executors.get(lane)
+        if executor is None:
+            executor = _executors[lane] = DBExecutor(lane, LANES[lane])
+        return executor
+
+def executor_stats():
+    with _executors_lock:
+        executors = dict(_executors)
+    return {lane: executor.stats() for lane, executor in executors.items()}
+
+def shutdown_executors():
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown()
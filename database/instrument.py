@@ -0,0 +1,199 @@
+import os
+import re
+import sys
+import time
+import sqlite3
+import logging
+import threading
+import functools
+from collections import Counter, deque
+import config
+
+"""
+Per-statement instrumentation. Pooled and writer connections are InstrumentedConnections;
+while query_stats is enabled (PM_QUERY_STATS, or query_stats.enabled = True at runtime) their
+cursors time every execute and fetch, count rows and note the calling CRUD function, aggregate
+by normalized SQL, and log statements slower than PM_SLOW_QUERY_MS with their EXPLAIN QUERY PLAN.
+Disabled, the cursors pass straight through to sqlite3. Aggregates are served by GET /debug/queries.
+Rows are counted for fetch* calls and DML; rows read by iterating a cursor are not.
+"""
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_ROOT = os.path.dirname(_HERE)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_VALUES_LIST = re.compile(r"(\(\s*\?(?:\s*,\s*\?)*\s*\))(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))+")
+_SPACE = re.compile(r"\s+")
+_PLANNED = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+
+@functools.lru_cache(maxsize = 4096)
+def normalize_sql(sql):
+    # One key per statement shape: literals -> ?, IN (?, ?, ...) -> IN (...), whitespace collapsed
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _VALUES_LIST.sub(r"\1, ...", sql)
+    sql = _IN_LIST.sub("(...)", sql)
+    return _SPACE.sub(" ", sql).strip()
+
+def call_site():
+    # "crud/product_crud.py:123 format_products": the innermost caller outside this module and
+    # the sqlite3 / stdlib frames
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_ROOT) and filename != __file__:
+            return f"{os.path.relpath(filename, _ROOT)}:{frame.f_lineno} {frame.f_code.co_name}"
+        frame = frame.f_back
+    return "?"
+
+
+class QueryStats:
+    """Aggregated statement timings, keyed by normalized SQL; thread-safe."""
+
+    def __init__(self, enabled = config.QUERY_STATS, slow_ms = config.SLOW_QUERY_MS,
+                 max_statements = config.QUERY_STATS_MAX_STATEMENTS, slow_log_size = 100):
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.max_statements = max_statements
+        self._lock = threading.Lock()
+        self._statements = {}
+        self._slow = deque(maxlen = slow_log_size)
+        self._dropped = 0
+
+    def record(self, key, seconds, rows, site, new_execution, elapsed):
+        # seconds: this call; elapsed: the execution so far (execute plus fetches)
+        with self._lock:
+            entry = self._statements.get(key)
+            if entry is None:
+                if len(self._statements) >= self.max_statements:
+                    self._dropped += 1
+                    return
+                entry = self._statements[key] = {"calls": 0, "time": 0.0, "max_time": 0.0, "rows": 0,
+                                                 "slow": 0, "sites": Counter()}
+            if new_execution:
+                entry["calls"] += 1
+                entry["sites"][site] += 1
+            entry["time"] += seconds
+            entry["rows"] += max(rows, 0)
+            entry["max_time"] = max(entry["max_time"], elapsed)
+
+    def record_slow(self, key, sql, seconds, rows, site, plan):
+        with self._lock:
+            entry = self._statements.get(key)
+            if entry is not None:
+                entry["slow"] += 1
+            self._slow.append({"sql": _SPACE.sub(" ", sql).strip(), "ms": round(seconds * 1000, 3),
+                               "rows": rows, "site": site, "plan": plan, "at": time.time()})
+
+    def snapshot(self, sort = "time", limit = 50):
+        with self._lock:
+            statements = [
+                {"sql": key, "calls": e["calls"], "total_ms": round(e["time"] * 1000, 3),
+                 "avg_ms": round(e["time"] / e["calls"] * 1000, 3) if e["calls"] else 0.0,
+                 "max_ms": round(e["max_time"] * 1000, 3), "rows": e["rows"], "slow": e["slow"],
+                 "sites": [site for site, _ in e["sites"].most_common(3)]}
+                for key, e in self._statements.items()]
+            slow = list(self._slow)
+            dropped = self._dropped
+        order = {"time": "total_ms", "calls": "calls", "avg": "avg_ms", "max": "max_ms", "rows": "rows"}[sort]
+        statements.sort(key = lambda s: s[order], reverse = True)
+        return {"enabled": self.enabled, "slow_ms": self.slow_ms, "distinct": len(statements),
+                "dropped": dropped, "statements": statements[:limit], "slow": slow[::-1]}
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self._slow.clear()
+            self._dropped = 0
+
+query_stats = QueryStats()
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    # Times execute / executemany and the fetches that follow them as one execution
+
+    def _begin(self, sql, params):
+        self._sql = sql
+        self._key = normalize_sql(sql)
+        self._params = params
+        self._site = call_site()
+        self._elapsed = 0.0
+        self._rows = 0
+        self._logged = False
+
+    def _account(self, seconds, rows, new_execution):
+        self._elapsed += seconds
+        self._rows += max(rows, 0)
+        query_stats.record(self._key, seconds, rows, self._site, new_execution, self._elapsed)
+        if not self._logged and self._elapsed * 1000 >= query_stats.slow_ms:
+            self._logged = True
+            self._log_slow()
+
+    def _log_slow(self):
+        plan = None
+        if self._sql.lstrip().upper().startswith(_PLANNED):
+            try:
+                params = self._params
+                if isinstance(params, (list, tuple)) and params and isinstance(params[0], (list, tuple, dict)):
+                    params = params[0]  # executemany: plan the first row
+                plan = [row[3] for row in sqlite3.Cursor(self.connection).execute(
+                    f"EXPLAIN QUERY PLAN {self._sql}", params if params is not None else ()).fetchall()]
+            except sqlite3.Error as e:
+                plan = [f"(no plan: {e})"]
+        query_stats.record_slow(self._key, self._sql, self._elapsed, self._rows, self._site, plan)
+        logging.warning("Slow query %.1f ms (%d rows) at %s: %s%s", self._elapsed * 1000, self._rows, self._site,
+                        _SPACE.sub(" ", self._sql).strip(), "".join(f"\n    {step}" for step in plan or ()))
+
+    def execute(self, sql, params = ()):
+        if not query_stats.enabled:
+            return super().execute(sql, params)
+        self._begin(sql, params)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            self._account(time.perf_counter() - start, self.rowcount, True)
+
+    def executemany(self, sql, seq_of_params):
+        if not query_stats.enabled:
+            return super().executemany(sql, seq_of_params)
+        seq_of_params = list(seq_of_params)
+        self._begin(sql, seq_of_params)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_params)
+        finally:
+            self._account(time.perf_counter() - start, self.rowcount, True)
+
+    def _fetch(self, fetch, *args):
+        if not query_stats.enabled or getattr(self, "_sql", None) is None:
+            return fetch(*args)
+        start = time.perf_counter()
+        result = fetch(*args)
+        rows = (1 if result is not None else 0) if fetch.__name__ == "fetchone" else len(result)
+        self._account(time.perf_counter() - start, rows, False)
+        return result
+
+    def fetchone(self):
+        return self._fetch(super().fetchone)
+
+    def fetchmany(self, size = None):
+        return self._fetch(super().fetchmany, *(() if size is None else (size,)))
+
+    def fetchall(self):
+        return self._fetch(super().fetchall)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    # sqlite3 connection whose cursors (including conn.execute shortcuts) are InstrumentedCursors
+
+    def cursor(self, factory = InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params = ()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
@@ -0,0 +1,197 @@
+"""
+Online maintenance for the database file: ANALYZE (so the query planner has statistics),
+PRAGMA optimize, and incremental vacuum (free pages left by deletes handed back to the file
+system; needs auto_vacuum = INCREMENTAL, set by schema migration 10). Every step is its own
+short write transaction with a pause in between, so API writes keep going while it runs.
+A run reports database size and free pages before and after, and the latency of a few probe
+queries, so its effect can be checked. Served by POST /admin/maintenance, or from the shell:
+python -m database.maintenance [--db product_manager.db] [--no-analyze] [--no-vacuum] [--max-pages N]
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import statistics
+import threading
+import config
+from database.storage import checkpoint
+from database.connection import init_database
+
+
+AUTO_VACUUM_MODES = {0: "NONE", 1: "FULL", 2: "INCREMENTAL"}
+
+# Indexed reads behind the hot routes, timed before and after a run. Arguments come from
+# subqueries so the probes work on any catalog
+PROBE_QUERIES = {
+    "product page": "SELECT id FROM product_manager ORDER BY last_updated DESC, id DESC LIMIT 50",
+    "products by tag name": """SELECT p.id FROM product_manager p
+                               JOIN product_tags pt ON pt.product_id = p.id JOIN tags t ON t.id = pt.tag_id
+                               WHERE t.tag_name = (SELECT tag_name FROM tags ORDER BY id DESC LIMIT 1)
+                               AND p.deleted = 0""",
+    "products by customer": """SELECT pc.product_id FROM product_customers pc
+                               WHERE pc.customer_id = (SELECT MAX(id) FROM customers)""",
+    "current quotes": """SELECT cq.product_id, c.customer_name, cq.quote
+                         FROM current_quotes cq JOIN customers c ON c.id = cq.customer_id
+                         WHERE cq.product_id IN (SELECT id FROM product_manager ORDER BY id DESC LIMIT 50)""",
+    "quote history": """SELECT customer_id, timestamp, quote FROM quotes
+                        WHERE product_id = (SELECT MAX(product_id) FROM quotes)
+                        ORDER BY customer_id, timestamp""",
+}
+
+
+class MaintenanceRunning(Exception):
+    pass
+
+_running = threading.Lock()
+_last_report = None
+
+
+def database_stats(conn):
+    # Size of the database file in pages and bytes, free pages, and the WAL file next to it
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    path = conn.execute("PRAGMA database_list").fetchone()[2]
+    wal = path + "-wal" if path else None
+    return {"page_size": page_size, "page_count": page_count, "freelist_count": freelist,
+            "bytes": page_size * page_count, "free_bytes": page_size * freelist,
+            "wal_bytes": os.path.getsize(wal) if wal and os.path.exists(wal) else 0,
+            "auto_vacuum": AUTO_VACUUM_MODES.get(conn.execute("PRAGMA auto_vacuum").fetchone()[0]),
+            "analyzed": conn.execute("SELECT COUNT(*) FROM sqlite_schema WHERE name = 'sqlite_stat1'").fetchone()[0] > 0}
+
+def probe_latency(conn, rounds = config.MAINTENANCE_PROBE_ROUNDS):
+    # Median milliseconds per PROBE_QUERIES entry over rounds runs
+    latency = {}
+    for name, sql in PROBE_QUERIES.items():
+        timings = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            conn.execute(sql).fetchall()
+            timings.append(time.perf_counter() - started)
+        latency[name] = round(statistics.median(timings) * 1000, 3) if timings else None
+    return latency
+
+
+def analyze(conn, pause = config.MAINTENANCE_PAUSE, analysis_limit = config.ANALYSIS_LIMIT):
+    # ANALYZE one table per transaction, sampling at most analysis_limit rows per index. The limit
+    # is per connection, so conn's previous setting is restored afterwards (conn may be pooled)
+    previous = conn.execute("PRAGMA analysis_limit").fetchone()[0]
+    conn.execute(f"PRAGMA analysis_limit = {int(analysis_limit)}").fetchall()
+    try:
+        tables = [row[0] for row in conn.execute("""SELECT name FROM sqlite_schema
+                                                    WHERE type = 'table' AND name NOT LIKE 'sqlite_%'""").fetchall()]
+        longest = 0.0
+        started = time.perf_counter()
+        for i, table in enumerate(tables):
+            if i and pause:
+                time.sleep(pause)
+            step = time.perf_counter()
+            conn.execute(f'ANALYZE "{table}"')
+            longest = max(longest, time.perf_counter() - step)
+    finally:
+        conn.execute(f"PRAGMA analysis_limit = {int(previous)}").fetchall()
+    return {"tables": len(tables), "seconds": round(time.perf_counter() - started, 6), "max_step": round(longest, 6)}
+
+def optimize(conn):
+    # Re-analyzes whatever tables SQLite considers stale since the last ANALYZE
+    started = time.perf_counter()
+    conn.execute("PRAGMA optimize").fetchall()
+    return {"seconds": round(time.perf_counter() - started, 6)}
+
+def incremental_vacuum(conn, max_pages = None, step_pages = config.VACUUM_STEP_PAGES,
+                       pause = config.MAINTENANCE_PAUSE):
+    # Releases up to max_pages free pages (None: all of them), step_pages per transaction
+    mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    result = {"pages": 0, "steps": 0, "seconds": 0.0, "max_step": 0.0, "skipped": None}
+    if mode != 2:
+        result["skipped"] = f"auto_vacuum is {AUTO_VACUUM_MODES.get(mode)}, not INCREMENTAL; apply the schema migrations"
+        return result
+    started = time.perf_counter()
+    while max_pages is None or result["pages"] < max_pages:
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        pages = min(step_pages, free, max_pages - result["pages"] if max_pages is not None else free)
+        if pages <= 0:
+            break
+        if result["steps"] and pause:
+            time.sleep(pause)
+        step = time.perf_counter()
+        # sqlite3's execute() steps the pragma once, which frees a single page; executescript
+        # runs it to the end
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+        result["max_step"] = max(result["max_step"], time.perf_counter() - step)
+        result["pages"] += free - conn.execute("PRAGMA freelist_count").fetchone()[0]
+        result["steps"] += 1
+    result["seconds"] = round(time.perf_counter() - started, 6)
+    result["max_step"] = round(result["max_step"], 6)
+    return result
+
+
+def run_maintenance(conn, analyze_tables = True, vacuum = True, max_pages = None,
+                    step_pages = config.VACUUM_STEP_PAGES, pause = config.MAINTENANCE_PAUSE,
+                    probe_rounds = config.MAINTENANCE_PROBE_ROUNDS):
+    """
+    ANALYZE (analyze_tables), PRAGMA optimize and incremental vacuum on conn, which must not be
+    used for anything else meanwhile; pending work on it is committed first. One run at a time
+    per process: raises MaintenanceRunning otherwise. Returns the report, also kept for
+    maintenance_stats().
+    """
+    global _last_report
+    if not _running.acquire(blocking = False):
+        raise MaintenanceRunning("Database maintenance is already running")
+    try:
+        if conn.in_transaction:
+            conn.commit()
+        started = time.perf_counter()
+        report = {"before": database_stats(conn), "latency": {"before": probe_latency(conn, probe_rounds)}}
+        report["analyze"] = analyze(conn, pause) if analyze_tables else None
+        report["optimize"] = optimize(conn)
+        report["vacuum"] = incremental_vacuum(conn, max_pages, step_pages, pause) if vacuum else None
+        if conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal":
+            # Pages released in the WAL only leave the file once they are checkpointed
+            checkpoint(conn)
+        report["latency"]["after"] = probe_latency(conn, probe_rounds)
+        report["after"] = database_stats(conn)
+        report["reclaimed_bytes"] = report["before"]["bytes"] - report["after"]["bytes"]
+        report["elapsed"] = round(time.perf_counter() - started, 6)
+        report["finished_at"] = time.time()
+        _last_report = report
+    finally:
+        _running.release()
+    logging.info("Database maintenance: %d -> %d pages (%d free), %.3fs",
+                 report["before"]["page_count"], report["after"]["page_count"],
+                 report["after"]["freelist_count"], report["elapsed"])
+    return report
+
+def maintenance_stats():
+    return {"running": _running.locked(), "last": _last_report}
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default = config.DB_NAME)
+    parser.add_argument("--no-analyze", action = "store_true", help = "skip ANALYZE (PRAGMA optimize still runs)")
+    parser.add_argument("--no-vacuum", action = "store_true", help = "skip the incremental vacuum")
+    parser.add_argument("--max-pages", type = int, help = "release at most this many free pages")
+    parser.add_argument("--step-pages", type = int, default = config.VACUUM_STEP_PAGES)
+    parser.add_argument("--pause", type = float, default = config.MAINTENANCE_PAUSE)
+    parser.add_argument("--probe-rounds", type = int, default = config.MAINTENANCE_PROBE_ROUNDS)
+    args = parser.parse_args()
+
+    # Bring the schema up to date first: migration 10 switches the file to incremental auto_vacuum
+    init_database(args.db)
+    conn = sqlite3.connect(args.db)
+    try:
+        conn.execute(f"PRAGMA busy_timeout = {int(config.BUSY_TIMEOUT)}")
+        report = run_maintenance(conn, analyze_tables = not args.no_analyze, vacuum = not args.no_vacuum,
+                                 max_pages = args.max_pages, step_pages = args.step_pages, pause = args.pause,
+                                 probe_rounds = args.probe_rounds)
+    finally:
+        conn.close()
+    print(json.dumps(report, indent = 2))
+
+
+if __name__ == "__main__":
+    main()
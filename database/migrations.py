@@ -0,0 +1,295 @@
+import logging
+from database.schema import INDEXES, SEARCH_ROWS_SQL, CURRENT_QUOTE_SQL
+
+
+"""
+Versioned schema migrations, tracked in PRAGMA user_version.
+create_table builds the base tables; every later schema change is appended to MIGRATIONS
+with the next version number and is never edited once released.
+"""
+
+
+def _create_indexes(cursor):
+    for sql in INDEXES.values():
+        cursor.execute(sql)
+
+
+# Full-text index over product fields plus tag and customer names; rowid = product_manager.id.
+# Rows are rebuilt by the triggers below whenever a product, its links, or a linked name changes.
+def _reindex_search(ids):
+    # Trigger body that rebuilds the search rows for the products selected by ids (SQL expression)
+    return f"""DELETE FROM product_search WHERE rowid IN ({ids});
+        {SEARCH_ROWS_SQL.format(where = f"p.id IN ({ids})")};"""
+
+def _create_product_search(cursor):
+    cursor.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS product_search USING fts5(
+                        name, ref_num, remarks, packing, tags, customers,
+                        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')""")
+
+    triggers = {
+        "product_search_insert": ("AFTER INSERT ON product_manager", _reindex_search("NEW.id")),
+        "product_search_update": ("AFTER UPDATE OF name, ref_num, remarks, packing ON product_manager",
+                                  _reindex_search("NEW.id")),
+        "product_search_delete": ("AFTER DELETE ON product_manager",
+                                  "DELETE FROM product_search WHERE rowid = OLD.id;"),
+        "product_search_tag_link": ("AFTER INSERT ON product_tags", _reindex_search("NEW.product_id")),
+        "product_search_tag_unlink": ("AFTER DELETE ON product_tags", _reindex_search("OLD.product_id")),
+        "product_search_customer_link": ("AFTER INSERT ON product_customers", _reindex_search("NEW.product_id")),
+        "product_search_customer_unlink": ("AFTER DELETE ON product_customers", _reindex_search("OLD.product_id")),
+        "product_search_tag_rename": ("AFTER UPDATE OF tag_name ON tags",
+                                      _reindex_search("SELECT product_id FROM product_tags WHERE tag_id = NEW.id")),
+        "product_search_customer_rename": ("AFTER UPDATE OF customer_name ON customers",
+                                           _reindex_search("SELECT product_id FROM product_customers WHERE customer_id = NEW.id")),
+    }
+    for name, (event, body) in triggers.items():
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+
+    # Backfill existing products
+    cursor.execute("DELETE FROM product_search")
+    cursor.execute(SEARCH_ROWS_SQL.format(where = "1"))
+
+
+def _create_listing_index(cursor):
+    cursor.execute(INDEXES["idx_product_last_updated"])
+
+def _create_lock_index(cursor):
+    cursor.execute(INDEXES["idx_product_locks"])
+
+
+def _suspendable_search_triggers(cursor):
+    # Per-row search triggers re-index a product once per linked tag/customer. Set-based writers
+    # put a row in search_index_suspended inside their own transaction (invisible to every other
+    # connection), write all rows, then re-index each product once; see crud.search_crud.suspend_search_index
+    cursor.execute("CREATE TABLE IF NOT EXISTS search_index_suspended (flag INTEGER PRIMARY KEY)")
+    when = "WHEN NOT EXISTS (SELECT 1 FROM search_index_suspended)"
+    triggers = {
+        "product_search_insert": ("AFTER INSERT ON product_manager", _reindex_search("NEW.id")),
+        "product_search_tag_link": ("AFTER INSERT ON product_tags", _reindex_search("NEW.product_id")),
+        "product_search_tag_unlink": ("AFTER DELETE ON product_tags", _reindex_search("OLD.product_id")),
+        "product_search_customer_link": ("AFTER INSERT ON product_customers", _reindex_search("NEW.product_id")),
+        "product_search_customer_unlink": ("AFTER DELETE ON product_customers", _reindex_search("OLD.product_id")),
+    }
+    for name, (event, body) in triggers.items():
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(f"CREATE TRIGGER {name} {event} {when} BEGIN {body} END")
+
+
+def _add_product_version(cursor):
+    # version counts every change to a product or its child rows (images, tags, customers, quotes,
+    # and the names of linked tags/customers); it drives ETags. last_updated moves with it.
+    # Child-row triggers are deferred like the search triggers (migration 4); suspend_search_index
+    # bumps each product once instead
+    cursor.execute("ALTER TABLE product_manager ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+    bump = "UPDATE product_manager SET version = version + 1, last_updated = CURRENT_TIMESTAMP WHERE id IN ({});"
+    when = "WHEN NOT EXISTS (SELECT 1 FROM search_index_suspended)"
+    triggers = {
+        "product_version_update": ("""AFTER UPDATE OF ref_num, name, barcode, pcs_innerbox, pcs_ctn, weight,
+                                      price_usd, price_rmb, remarks, packing, deleted, locked_by ON product_manager""",
+                                   bump.format("NEW.id")),
+        "product_version_image_insert": (f"AFTER INSERT ON product_images {when}", bump.format("NEW.product_id")),
+        "product_version_image_update": (f"AFTER UPDATE ON product_images {when}", bump.format("OLD.product_id, NEW.product_id")),
+        "product_version_image_delete": (f"AFTER DELETE ON product_images {when}", bump.format("OLD.product_id")),
+        "product_version_tag_link": (f"AFTER INSERT ON product_tags {when}", bump.format("NEW.product_id")),
+        "product_version_tag_unlink": (f"AFTER DELETE ON product_tags {when}", bump.format("OLD.product_id")),
+        "product_version_customer_link": (f"AFTER INSERT ON product_customers {when}", bump.format("NEW.product_id")),
+        "product_version_customer_unlink": (f"AFTER DELETE ON product_customers {when}", bump.format("OLD.product_id")),
+        "product_version_quote_insert": (f"AFTER INSERT ON quotes {when}", bump.format("NEW.product_id")),
+        "product_version_quote_update": (f"AFTER UPDATE ON quotes {when}", bump.format("OLD.product_id, NEW.product_id")),
+        "product_version_quote_delete": (f"AFTER DELETE ON quotes {when}", bump.format("OLD.product_id")),
+        "product_version_tag_rename": ("AFTER UPDATE OF tag_name ON tags",
+                                       bump.format("SELECT product_id FROM product_tags WHERE tag_id = NEW.id")),
+        "product_version_customer_rename": ("AFTER UPDATE OF customer_name ON customers",
+                                            bump.format("""SELECT product_id FROM product_customers WHERE customer_id = NEW.id
+                                                           UNION SELECT product_id FROM quotes WHERE customer_id = NEW.id""")),
+    }
+    for name, (event, body) in triggers.items():
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+
+
+def _create_change_feed(cursor):
+    # Compacted change log for delta sync: one row per product holding the sequence number of its
+    # latest change, kept by triggers on insert, version bump (i.e. any change, see migration 5)
+    # and delete. Rows with deleted = 1 are tombstones; prune_changes drops old ones and records
+    # the floor below which a client has to resync from scratch
+    cursor.execute("""CREATE TABLE IF NOT EXISTS change_sequence (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        seq INTEGER NOT NULL,
+                        pruned_seq INTEGER NOT NULL DEFAULT 0)""")
+    cursor.execute("INSERT OR IGNORE INTO change_sequence(id, seq) VALUES (1, 0)")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS product_changes (
+                        product_id INTEGER PRIMARY KEY,
+                        seq INTEGER NOT NULL,
+                        deleted INTEGER NOT NULL DEFAULT 0)""")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_changes_seq ON product_changes(seq)")
+
+    record = """UPDATE change_sequence SET seq = seq + 1 WHERE id = 1;
+        INSERT INTO product_changes(product_id, seq, deleted)
+            VALUES ({id}, (SELECT seq FROM change_sequence WHERE id = 1), {deleted})
+            ON CONFLICT(product_id) DO UPDATE SET seq = excluded.seq, deleted = excluded.deleted;"""
+    triggers = {
+        "product_change_insert": ("AFTER INSERT ON product_manager", record.format(id = "NEW.id", deleted = "NEW.deleted != 0")),
+        "product_change_update": ("AFTER UPDATE OF version ON product_manager",
+                                  record.format(id = "NEW.id", deleted = "NEW.deleted != 0")),
+        "product_change_delete": ("AFTER DELETE ON product_manager", record.format(id = "OLD.id", deleted = "1")),
+    }
+    for name, (event, body) in triggers.items():
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+
+    # Backfill existing products in id order
+    cursor.execute("""INSERT OR IGNORE INTO product_changes(product_id, seq, deleted)
+                      SELECT id, ROW_NUMBER() OVER (ORDER BY id), deleted != 0 FROM product_manager""")
+    cursor.execute("UPDATE change_sequence SET seq = (SELECT COUNT(*) FROM product_changes) WHERE id = 1")
+
+
+def _create_quote_history(cursor):
+    # quotes keeps every quote ever given; current_quotes holds the latest one per product and
+    # customer (by timestamp, then id), kept by the triggers below, so products hydrate without
+    # reading the history. The covering history index replaces the plain product_id index
+    cursor.execute("DROP INDEX IF EXISTS idx_quotes_product")
+    cursor.execute(INDEXES["idx_quotes_history"])
+    cursor.execute("""CREATE TABLE IF NOT EXISTS current_quotes (
+                        product_id INTEGER NOT NULL,
+                        customer_id INTEGER NOT NULL,
+                        quote_id INTEGER NOT NULL,
+                        quote REAL,
+                        quote_remark TEXT,
+                        timestamp TEXT,
+                        PRIMARY KEY (product_id, customer_id)) WITHOUT ROWID""")
+
+    # A new quote usually is the latest one; an older one (backfilled history) leaves the row alone
+    insert = """INSERT INTO current_quotes(product_id, customer_id, quote_id, quote, quote_remark, timestamp)
+            VALUES (NEW.product_id, NEW.customer_id, NEW.id, NEW.quote, NEW.quote_remark, NEW.timestamp)
+            ON CONFLICT(product_id, customer_id) DO UPDATE SET
+                quote_id = excluded.quote_id, quote = excluded.quote,
+                quote_remark = excluded.quote_remark, timestamp = excluded.timestamp
+            WHERE (excluded.timestamp, excluded.quote_id) > (current_quotes.timestamp, current_quotes.quote_id);"""
+    old_pair = CURRENT_QUOTE_SQL.format(product_id = "OLD.product_id", customer_id = "OLD.customer_id")
+    new_pair = CURRENT_QUOTE_SQL.format(product_id = "NEW.product_id", customer_id = "NEW.customer_id")
+    triggers = {
+        "current_quote_insert": ("AFTER INSERT ON quotes WHEN NEW.product_id IS NOT NULL AND NEW.customer_id IS NOT NULL",
+                                 insert),
+        "current_quote_update": ("AFTER UPDATE OF product_id, customer_id, quote, quote_remark, timestamp ON quotes",
+                                 old_pair + new_pair),
+        # Deleting anything but the current quote changes nothing
+        "current_quote_delete": ("""AFTER DELETE ON quotes WHEN EXISTS (SELECT 1 FROM current_quotes
+                                    WHERE product_id = OLD.product_id AND customer_id = OLD.customer_id AND quote_id = OLD.id)""",
+                                 old_pair),
+    }
+    for name, (event, body) in triggers.items():
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+
+    # Backfill from the existing history
+    cursor.execute("DELETE FROM current_quotes")
+    cursor.execute("""INSERT INTO current_quotes(product_id, customer_id, quote_id, quote, quote_remark, timestamp)
+                      SELECT product_id, customer_id, id, quote, quote_remark, timestamp FROM (
+                          SELECT *, ROW_NUMBER() OVER (PARTITION BY product_id, customer_id
+                                                       ORDER BY timestamp DESC, id DESC) AS rank
+                          FROM quotes WHERE product_id IS NOT NULL AND customer_id IS NOT NULL)
+                      WHERE rank = 1""")
+
+
+def _create_quote_generation(cursor):
+    # Counter bumped by every write that can change quote analytics: quotes themselves (cascades
+    # included), the prices they are compared with, product deletion and customer names. Cached
+    # analytics (crud/analytics_crud.py) are tagged with it and recomputed once it moves
+    cursor.execute("""CREATE TABLE IF NOT EXISTS quote_generation (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        generation INTEGER NOT NULL)""")
+    cursor.execute("INSERT OR IGNORE INTO quote_generation(id, generation) VALUES (1, 0)")
+    bump = "UPDATE quote_generation SET generation = generation + 1 WHERE id = 1;"
+    triggers = {
+        "quote_generation_insert": "AFTER INSERT ON quotes",
+        "quote_generation_update": "AFTER UPDATE ON quotes",
+        "quote_generation_delete": "AFTER DELETE ON quotes",
+        "quote_generation_price": "AFTER UPDATE OF price_usd, price_rmb, deleted ON product_manager",
+        "quote_generation_customer": "AFTER UPDATE OF customer_name ON customers",
+    }
+    for name, event in triggers.items():
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {bump} END")
+
+
+def _enable_incremental_vacuum(cursor):
+    # Lets database/maintenance.py hand free pages back to the file system in small steps.
+    # A database that already has tables only switches auto_vacuum mode by being rebuilt with
+    # VACUUM, which rewrites the whole file once and cannot run inside a transaction
+    if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cursor.execute("VACUUM")
+
+
+def _create_name_trigram_index(cursor):
+    # Substring index over product names (FTS5 trigram, external content on product_manager):
+    # name LIKE '%fragment%' is answered from the index for fragments of three or more characters,
+    # so search_product_name can always include mid-word matches without a table scan
+    cursor.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS product_name_trigram USING fts5(
+                        name, content = 'product_manager', content_rowid = 'id', tokenize = 'trigram')""")
+    remove = "INSERT INTO product_name_trigram(product_name_trigram, rowid, name) VALUES ('delete', OLD.id, OLD.name);"
+    add = "INSERT INTO product_name_trigram(rowid, name) VALUES (NEW.id, NEW.name);"
+    triggers = {
+        "product_name_trigram_insert": ("AFTER INSERT ON product_manager", add),
+        "product_name_trigram_update": ("AFTER UPDATE OF name ON product_manager", remove + add),
+        "product_name_trigram_delete": ("AFTER DELETE ON product_manager", remove),
+    }
+    for name, (event, body) in triggers.items():
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+    cursor.execute("INSERT INTO product_name_trigram(product_name_trigram) VALUES ('rebuild')")
+
+
+MIGRATIONS = [
+    (1, "secondary and join indexes", _create_indexes),
+    (2, "FTS5 product search index", _create_product_search),
+    (3, "keyset pagination index on last_updated", _create_listing_index),
+    (4, "suspendable per-row search triggers", _suspendable_search_triggers),
+    (5, "product version for ETags", _add_product_version),
+    (6, "change feed for delta sync", _create_change_feed),
+    (7, "partial index on held product locks", _create_lock_index),
+    (8, "quote history index and current quotes", _create_quote_history),
+    (9, "quote analytics generation counter", _create_quote_generation),
+    (10, "incremental auto_vacuum", _enable_incremental_vacuum),
+    (11, "trigram index on product names", _create_name_trigram_index),
+]
+
+# Migrations that cannot run in a transaction (VACUUM). They run in autocommit mode before
+# user_version is bumped, so they must be safe to repeat after an interruption
+NON_TRANSACTIONAL = {10}
+
+
+def schema_version(cursor):
+    return cursor.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn, cursor):
+    # Apply every migration newer than the database's user_version, each in its own transaction
+    # (except NON_TRANSACTIONAL ones)
+    current = schema_version(cursor)
+    if conn.in_transaction:
+        conn.commit()
+    for version, description, step in MIGRATIONS:
+        if version <= current:
+            continue
+        if version in NON_TRANSACTIONAL:
+            step(cursor)
+            cursor.execute(f"PRAGMA user_version = {version}")
+            logging.info(f"Applied schema migration {version}: {description}")
+            continue
+        cursor.execute("BEGIN")
+        try:
+            step(cursor)
+            cursor.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+        logging.info(f"Applied schema migration {version}: {description}")
+    check_indexes(conn, cursor)
+    return schema_version(cursor)
+
+def check_indexes(conn, cursor):
+    # Recreate any expected index that has gone missing; returns the names that were rebuilt
+    existing = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'").fetchall()}
+    missing = [name for name in INDEXES if name not in existing]
+    for name in missing:
+        logging.warning(f"Index {name} was missing; recreating it")
+        cursor.execute(INDEXES[name])
+    if missing:
+        conn.commit()
+    return missing
@@ -0,0 +1,219 @@
+import sqlite3
+import threading
+import time
+import logging
+from contextlib import contextmanager
+import config
+from database.storage import apply_storage_profile
+from database.instrument import InstrumentedConnection
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Bounded pool of long-lived SQLite connections for one database file.
+    Each checkout is exclusive to the caller until released; PRAGMAs are applied once
+    when a connection is opened, and connections are health-checked on checkout and
+    recycled after max_uses checkouts or max_age seconds.
+    """
+
+    def __init__(self, db_name, max_size = config.POOL_SIZE, timeout = config.POOL_TIMEOUT,
+                 max_uses = config.POOL_MAX_USES, max_age = config.POOL_MAX_AGE, profile = None):
+        self.db_name = db_name
+        self.profile = profile
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_uses = max_uses
+        self.max_age = max_age
+
+        self._cond = threading.Condition()
+        self._idle = []       # LIFO so the warmest connection (hot page cache) is reused first
+        self._meta = {}       # id(conn) -> {"created": t, "uses": n}
+        self._size = 0
+        self._in_use = 0
+        self._closed = False
+
+        self._created = 0
+        self._recycled = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+        self._timeouts = 0
+
+    # Connection lifecycle
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_name, check_same_thread = False, factory = InstrumentedConnection)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        apply_storage_profile(conn, self.profile)
+        return conn
+
+    def _is_healthy(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _is_expired(self, meta):
+        if self.max_uses and meta["uses"] >= self.max_uses:
+            return True
+        return bool(self.max_age) and time.monotonic() - meta["created"] >= self.max_age
+
+    def _close(self, conn):
+        # Caller holds no lock; closes conn but keeps its slot
+        with self._cond:
+            self._meta.pop(id(conn), None)
+            self._recycled += 1
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def _discard(self, conn):
+        # Caller holds no lock; frees the slot for a new connection
+        self._close(conn)
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    # Checkout / release
+
+    def acquire(self):
+        start = time.monotonic()
+        waited = False
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    conn = None
+                    self._size += 1
+                    break
+                if not waited:
+                    waited = True
+                    self._waits += 1
+                remaining = self.timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"No database connection available after {self.timeout}s")
+                self._cond.wait(remaining)
+
+            self._in_use += 1
+            self._checkouts += 1
+            if waited:
+                waited_for = time.monotonic() - start
+                self._wait_time += waited_for
+                self._max_wait = max(self._max_wait, waited_for)
+
+        try:
+            if conn is not None and not self._is_healthy(conn):
+                # Replaced in place: the slot is never given up, so no waiter can take it meanwhile
+                logging.warning("Discarding unhealthy pooled connection")
+                self._close(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+                with self._cond:
+                    self._meta[id(conn)] = {"created": time.monotonic(), "uses": 0}
+                    self._created += 1
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._meta[id(conn)]["uses"] += 1
+        return conn
+
+    def release(self, conn, discard = False):
+        with self._cond:
+            self._in_use -= 1
+            meta = self._meta.get(id(conn))
+        if not discard:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                discard = True
+        if discard or meta is None or self._closed or self._is_expired(meta):
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except sqlite3.DatabaseError:
+            self.release(conn, discard = not self._is_healthy(conn))
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    # Introspection / shutdown
+
+    def stats(self):
+        with self._cond:
+            return {
+                "db_name": self.db_name,
+                "max_size": self.max_size,
+                "size": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "checkouts": self._checkouts,
+                "created": self._created,
+                "recycled": self._recycled,
+                "waits": self._waits,
+                "wait_time": round(self._wait_time, 6),
+                "max_wait": round(self._max_wait, 6),
+                "timeouts": self._timeouts,
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn in idle:
+            self._discard(conn)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_name = config.DB_NAME):
+    # One pool per database file, created lazily
+    with _pools_lock:
+        pool = _pools.get(db_name)
+        if pool is None:
+            pool = _pools[db_name] = ConnectionPool(db_name)
+        return pool
+
+def pool_stats():
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.stats() for pool in pools]
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
@@ -0,0 +1,34 @@
+import threading
+import logging
+
+
+class PeriodicTask:
+    """Runs func() every interval seconds on a daemon thread until stop() is called."""
+
+    def __init__(self, name, interval, func):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.runs = 0
+        self.failures = 0
+        self.last_result = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target = self._run, name = name, daemon = True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.last_result = self.func()
+                self.runs += 1
+            except Exception as e:
+                self.failures += 1
+                logging.error(f"Periodic task {self.name} failed: {e}", exc_info = True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout = 5):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
@@ -68,10 +68,45 @@ def create_table(conn, cursor):
                             )""")
         conn.commit()
 
+# Rebuilds product_search rows (see migrations 2 and 4) for the products matching {where} (alias p)
+SEARCH_ROWS_SQL = """INSERT INTO product_search(rowid, name, ref_num, remarks, packing, tags, customers)
+    SELECT p.id, p.name, p.ref_num, p.remarks, p.packing,
+        (SELECT group_concat(t.tag_name, ' ') FROM product_tags pt
+            JOIN tags t ON t.id = pt.tag_id WHERE pt.product_id = p.id),
+        (SELECT group_concat(c.customer_name, ' ') FROM product_customers pc
+            JOIN customers c ON c.id = pc.customer_id WHERE pc.product_id = p.id)
+    FROM product_manager p WHERE {where}"""
+
+# Every secondary index the application relies on; created by the migrations in database/migrations.py
+# and re-checked on startup by check_indexes
+INDEXES = {
+        "idx_product_ref_num": "CREATE INDEX IF NOT EXISTS idx_product_ref_num ON product_manager(ref_num)",
+        "idx_product_name": "CREATE INDEX IF NOT EXISTS idx_product_name ON product_manager(name COLLATE NOCASE)",
+        "idx_product_barcode": "CREATE INDEX IF NOT EXISTS idx_product_barcode ON product_manager(barcode)",
+        # Lock reaper / active lock count: only locked rows are indexed
+        "idx_product_locks": "CREATE INDEX IF NOT EXISTS idx_product_locks ON product_manager(locked_timestamp) WHERE locked_by IS NOT NULL",
+        # Keyset pagination by (last_updated, id)
+        "idx_product_last_updated": "CREATE INDEX IF NOT EXISTS idx_product_last_updated ON product_manager(last_updated, id)",
+        "idx_tag_name": "CREATE INDEX IF NOT EXISTS idx_tag_name ON tags(tag_name COLLATE NOCASE)",
+        "idx_customer_name": "CREATE INDEX IF NOT EXISTS idx_customer_name ON customers(customer_name COLLATE NOCASE)",
+        # Join indexes: child rows by product, and the reverse side of the link tables
+        "idx_product_images_product": "CREATE INDEX IF NOT EXISTS idx_product_images_product ON product_images(product_id)",
+        # Quote history by product / customer in time order; covers the history and trend queries
+        "idx_quotes_history": "CREATE INDEX IF NOT EXISTS idx_quotes_history ON quotes(product_id, customer_id, timestamp, quote)",
+        "idx_quotes_customer": "CREATE INDEX IF NOT EXISTS idx_quotes_customer ON quotes(customer_id)",
+        "idx_product_tags_tag": "CREATE INDEX IF NOT EXISTS idx_product_tags_tag ON product_tags(tag_id, product_id)",
+        "idx_product_customers_customer": "CREATE INDEX IF NOT EXISTS idx_product_customers_customer ON product_customers(customer_id, product_id)",
+}
+
+# Re-materializes current_quotes (migration 8) for one (product, customer) pair: the latest quote
+# by (timestamp, id), if any is left
+CURRENT_QUOTE_SQL = """DELETE FROM current_quotes WHERE product_id = {product_id} AND customer_id = {customer_id};
+    INSERT INTO current_quotes(product_id, customer_id, quote_id, quote, quote_remark, timestamp)
+        SELECT product_id, customer_id, id, quote, quote_remark, timestamp FROM quotes
+        WHERE product_id = {product_id} AND customer_id = {customer_id}
+        ORDER BY timestamp DESC, id DESC LIMIT 1;"""
+
 def create_index(conn, cursor):
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_ref_num ON product_manager(ref_num)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_name ON product_manager(name COLLATE NOCASE)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_barcode ON product_manager(barcode)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_tag_name ON tags(tag_name COLLATE NOCASE)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_customer_name ON customers(customer_name COLLATE NOCASE)")
-        conn.commit()
\ No newline at end of file
+        for sql in INDEXES.values():
+                cursor.execute(sql)
+        conn.commit()
@@ -0,0 +1,71 @@
+import sqlite3
+import logging
+import config
+from database.scheduler import PeriodicTask
+
+
+# PRAGMAs applied to every connection, in this order. journal_mode is persistent in the
+# database file; the others are per-connection and must be set each time one is opened.
+DEFAULT_PROFILE = {
+    "journal_mode": config.JOURNAL_MODE,
+    "synchronous": config.SYNCHRONOUS,
+    "cache_size": config.CACHE_SIZE,
+    "mmap_size": config.MMAP_SIZE,
+    "temp_store": config.TEMP_STORE,
+    "busy_timeout": config.BUSY_TIMEOUT,
+    "wal_autocheckpoint": config.WAL_AUTOCHECKPOINT,
+}
+
+_ALLOWED_KEYWORDS = {
+    "journal_mode": {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"},
+    "synchronous": {"OFF", "NORMAL", "FULL", "EXTRA"},
+    "temp_store": {"DEFAULT", "FILE", "MEMORY"},
+}
+
+def storage_profile(**overrides):
+    # Copy of the default profile with overrides, e.g. storage_profile(journal_mode="DELETE")
+    unknown = set(overrides) - set(DEFAULT_PROFILE)
+    if unknown:
+        raise ValueError(f"Unknown storage settings: {', '.join(sorted(unknown))}")
+    profile = dict(DEFAULT_PROFILE)
+    profile.update(overrides)
+    return profile
+
+def apply_storage_profile(conn, profile = None):
+    # PRAGMA values cannot be bound as parameters, so every value is validated first
+    profile = DEFAULT_PROFILE if profile is None else profile
+    for key, value in profile.items():
+        if value is None:
+            continue
+        if key in _ALLOWED_KEYWORDS:
+            value = str(value).upper()
+            if value not in _ALLOWED_KEYWORDS[key]:
+                raise ValueError(f"Invalid {key}: {value}")
+        else:
+            value = int(value)
+        conn.execute(f"PRAGMA {key} = {value}").fetchall()
+
+def checkpoint(conn, mode = "PASSIVE"):
+    # Copies WAL frames back into the database file; returns (busy, wal_frames, checkpointed_frames)
+    if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+        raise ValueError(f"Invalid checkpoint mode: {mode}")
+    return tuple(conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone())
+
+def start_checkpointer(db_name = config.DB_NAME, interval = config.CHECKPOINT_INTERVAL, mode = "PASSIVE"):
+    # Background checkpoints keep the WAL short even when readers never leave the file idle,
+    # which the automatic checkpoint on commit needs in order to make progress
+    if not interval:
+        return None
+
+    def run_checkpoint():
+        conn = sqlite3.connect(db_name)
+        try:
+            conn.execute(f"PRAGMA busy_timeout = {int(config.BUSY_TIMEOUT)}")
+            result = checkpoint(conn, mode)
+            if result[0]:
+                logging.info(f"WAL checkpoint on {db_name} was blocked by a reader; will retry")
+            return result
+        finally:
+            conn.close()
+
+    return PeriodicTask("wal-checkpoint", interval, run_checkpoint).start()
@@ -0,0 +1,433 @@
+import sqlite3
+import threading
+import pytest
+
+import config
+from database.connection import init_database, get_db
+from database.pool import ConnectionPool, PoolTimeout, get_pool, close_pools
+from database.storage import storage_profile, apply_storage_profile, checkpoint
+from database.migrations import MIGRATIONS, migrate, schema_version, check_indexes
+from database.schema import INDEXES
+from database.executor import DBExecutor, ExecutorSaturated
+from database.writer import SQLiteWriter
+from database.instrument import InstrumentedConnection, query_stats, normalize_sql
+from database.maintenance import run_maintenance, database_stats, incremental_vacuum, PROBE_QUERIES
+
+# ========== DATABASE TEST SUITE MEGA BLOCK ==========
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "test_product_manager.db")
+    init_database(path)
+    yield path
+    close_pools()
+
+
+# ========== POOL ==========
+
+def test_pool_reuses_connections(db_path):
+    pool = ConnectionPool(db_path, max_size = 2)
+    first = pool.acquire()
+    pool.release(first)
+    second = pool.acquire()
+    pool.release(second)
+
+    assert first is second
+    stats = pool.stats()
+    assert stats["created"] == 1
+    assert stats["checkouts"] == 2
+    assert stats["in_use"] == 0
+    assert first.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+    pool.close()
+
+def test_pool_is_bounded_and_counts_waits(db_path):
+    pool = ConnectionPool(db_path, max_size = 1, timeout = 2)
+    held = pool.acquire()
+    acquired = []
+
+    def worker():
+        conn = pool.acquire()
+        acquired.append(conn)
+        pool.release(conn)
+
+    thread = threading.Thread(target = worker)
+    thread.start()
+    thread.join(0.1)
+    assert acquired == []
+    assert pool.stats()["in_use"] == 1
+
+    pool.release(held)
+    thread.join(2)
+    assert acquired == [held]
+    stats = pool.stats()
+    assert stats["waits"] == 1
+    assert stats["wait_time"] > 0
+    pool.close()
+
+def test_pool_timeout(db_path):
+    pool = ConnectionPool(db_path, max_size = 1, timeout = 0.05)
+    held = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    assert pool.stats()["timeouts"] == 1
+    pool.release(held)
+    pool.close()
+
+def test_pool_recycles_broken_and_dirty_connections(db_path):
+    pool = ConnectionPool(db_path, max_size = 1)
+    conn = pool.acquire()
+    conn.execute("INSERT INTO tags(tag_name) VALUES ('uncommitted')")
+    pool.release(conn)
+
+    # Open transaction is rolled back on release
+    conn = pool.acquire()
+    assert conn.execute("SELECT COUNT(*) FROM tags").fetchone()[0] == 0
+    conn.close()
+    pool.release(conn)
+
+    # Closed connection fails the health check and is replaced
+    replacement = pool.acquire()
+    assert replacement is not conn
+    assert replacement.execute("SELECT 1").fetchone()[0] == 1
+    pool.release(replacement)
+    assert pool.stats()["recycled"] == 1
+    pool.close()
+
+def test_pool_replaces_unhealthy_idle_connection_in_its_slot(db_path):
+    pool = ConnectionPool(db_path, max_size = 1)
+    conn = pool.acquire()
+    pool.release(conn)
+    conn.close()  # goes bad while idle
+
+    replacement = pool.acquire()
+    assert replacement is not conn
+    stats = pool.stats()
+    assert (stats["size"], stats["in_use"], stats["recycled"], stats["created"]) == (1, 1, 1, 2)
+    pool.release(replacement)
+    pool.close()
+
+def test_pool_recycles_after_max_uses(db_path):
+    pool = ConnectionPool(db_path, max_size = 1, max_uses = 2)
+    first = pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+    pool.release(first)
+    assert pool.acquire() is not first
+    pool.close()
+
+def test_get_db_uses_pool(db_path, monkeypatch):
+    monkeypatch.setattr(config, "DB_NAME", db_path)
+    gen = get_db()
+    conn, cursor = next(gen)
+    cursor.execute("INSERT INTO tags(tag_name) VALUES ('pooled')")
+    assert get_pool(db_path).stats()["in_use"] == 1
+    with pytest.raises(StopIteration):
+        next(gen)
+
+    stats = get_pool(db_path).stats()
+    assert stats["in_use"] == 0
+    assert stats["idle"] == 1
+    check = sqlite3.connect(db_path)
+    assert check.execute("SELECT tag_name FROM tags").fetchone()[0] == "pooled"
+    check.close()
+
+
+# ========== STORAGE PROFILE ==========
+
+def test_init_database_enables_wal(db_path):
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    conn.close()
+
+def test_pooled_connections_get_storage_profile(db_path):
+    pool = ConnectionPool(db_path, profile = storage_profile(synchronous = "FULL", busy_timeout = 1234))
+    conn = pool.acquire()
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 2
+    assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 1234
+    assert conn.execute("PRAGMA temp_store").fetchone()[0] == 2
+    pool.release(conn)
+    pool.close()
+
+def test_invalid_storage_profile(db_path):
+    conn = sqlite3.connect(db_path)
+    with pytest.raises(ValueError):
+        storage_profile(page_size = 4096)
+    with pytest.raises(ValueError):
+        apply_storage_profile(conn, storage_profile(synchronous = "NORMAL; DROP TABLE tags"))
+    conn.close()
+
+def test_wal_readers_not_blocked_by_writer(db_path):
+    writer = sqlite3.connect(db_path)
+    writer.execute("BEGIN IMMEDIATE")
+    writer.execute("INSERT INTO tags(tag_name) VALUES ('pending')")
+
+    reader = sqlite3.connect(db_path, timeout = 0)
+    assert reader.execute("SELECT COUNT(*) FROM tags").fetchone()[0] == 0
+    writer.commit()
+    assert reader.execute("SELECT COUNT(*) FROM tags").fetchone()[0] == 1
+
+    busy, wal_frames, checkpointed = checkpoint(writer, "TRUNCATE")
+    assert busy == 0
+    reader.close()
+    writer.close()
+
+
+# ========== MIGRATIONS ==========
+
+def test_init_database_migrates_to_latest(db_path):
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    assert schema_version(cursor) == MIGRATIONS[-1][0]
+    indexes = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert set(INDEXES) <= indexes
+
+    # Running again is a no-op
+    assert migrate(conn, cursor) == MIGRATIONS[-1][0]
+    # Tables existed before the migrations ran, so migration 10 had to VACUUM to switch modes
+    assert cursor.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    conn.close()
+
+def test_check_indexes_recreates_missing(db_path):
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("DROP INDEX idx_quotes_history")
+    assert check_indexes(conn, cursor) == ["idx_quotes_history"]
+    assert check_indexes(conn, cursor) == []
+    conn.close()
+
+def test_commit_hooks_run_after_request(db_path, monkeypatch):
+    from database.connection import on_commit
+    seen = []
+    def hook(conn, keys):
+        check = sqlite3.connect(db_path)
+        seen.append((check.execute("SELECT COUNT(*) FROM tags").fetchone()[0], keys))
+        check.close()
+
+    monkeypatch.setattr(config, "DB_NAME", db_path)
+    gen = get_db()
+    conn, cursor = next(gen)
+    cursor.execute("INSERT INTO tags(tag_name) VALUES ('hooked')")
+    on_commit(conn, hook, [1])
+    on_commit(conn, hook, [2])
+    assert seen == []
+    with pytest.raises(StopIteration):
+        next(gen)
+    # Ran once with the merged keys, after the write was visible to other connections
+    assert seen == [(1, {1, 2})]
+
+    # Plain connections have no unit of work to wait for
+    plain = sqlite3.connect(db_path)
+    on_commit(plain, hook, None)
+    assert seen[-1] == (1, None)
+    plain.close()
+
+def test_commit_hooks_do_not_outlive_their_connection(db_path):
+    from database.connection import on_commit, _commit_hooks
+    before = len(_commit_hooks)
+    conn = InstrumentedConnection(db_path)
+    on_commit(conn, lambda conn, keys: None, [1])
+    assert len(_commit_hooks) == before + 1
+    conn.close()
+    del conn
+    assert len(_commit_hooks) == before
+
+
+# ========== MAINTENANCE ==========
+
+def test_run_maintenance_analyzes_and_vacuums_in_steps(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.executemany("INSERT INTO tags(tag_name) VALUES (?)", [(f"tag {i} " + "x" * 200,) for i in range(3000)])
+    conn.commit()
+    conn.execute("DELETE FROM tags")
+    conn.commit()
+    before = database_stats(conn)
+    assert before["freelist_count"] > 32
+    assert not before["analyzed"]
+
+    report = run_maintenance(conn, max_pages = 32, step_pages = 8, pause = 0, probe_rounds = 1)
+    assert (report["vacuum"]["pages"], report["vacuum"]["steps"]) == (32, 4)
+    assert report["analyze"]["tables"] > 0
+    # The sampling limit is per connection and must not stay behind on it
+    assert conn.execute("PRAGMA analysis_limit").fetchone()[0] == 0
+    assert set(report["latency"]["before"]) == set(report["latency"]["after"]) == set(PROBE_QUERIES)
+    assert report["after"]["analyzed"]
+    assert report["after"]["page_count"] == before["page_count"] - 32
+    assert report["reclaimed_bytes"] == 32 * before["page_size"]
+
+    report = run_maintenance(conn, analyze_tables = False, pause = 0, probe_rounds = 0)
+    assert report["after"]["freelist_count"] == 0
+    assert report["analyze"] is None
+    assert report["latency"]["after"]["product page"] is None
+    conn.close()
+
+def test_incremental_vacuum_needs_incremental_auto_vacuum():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE t(x)")
+    assert incremental_vacuum(conn)["skipped"].startswith("auto_vacuum is NONE")
+    conn.close()
+
+
+# ========== DB EXECUTOR ==========
+
+def test_executor_runs_off_loop_and_sheds_load():
+    import asyncio
+    executor = DBExecutor("test", workers = 1, max_queue = 2)
+    release = threading.Event()
+
+    async def scenario():
+        blocker = asyncio.ensure_future(executor.run(release.wait))
+        await asyncio.sleep(0.05)
+        queued = [asyncio.ensure_future(executor.run(threading.get_ident)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(ExecutorSaturated):
+            await executor.run(threading.get_ident)
+        release.set()
+        await blocker
+        return await asyncio.gather(*queued)
+
+    try:
+        idents = asyncio.run(scenario())
+    finally:
+        executor.shutdown()
+    assert threading.get_ident() not in idents
+    stats = executor.stats()
+    assert (stats["completed"], stats["rejected"], stats["max_queued"], stats["queued"]) == (3, 1, 2, 0)
+    assert stats["max_wait"] > 0
+
+def test_executor_frees_queue_slots_of_cancelled_calls():
+    import asyncio
+    executor = DBExecutor("test", workers = 1, max_queue = 1)
+    release = threading.Event()
+
+    async def scenario():
+        blocker = asyncio.ensure_future(executor.run(release.wait))
+        await asyncio.sleep(0.05)
+        queued = asyncio.ensure_future(executor.run(threading.get_ident))
+        await asyncio.sleep(0)
+        queued.cancel()
+        await asyncio.sleep(0)
+        # The cancelled call's slot is free again
+        second = asyncio.ensure_future(executor.run(threading.get_ident))
+        release.set()
+        await blocker
+        return await second
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        executor.shutdown()
+    stats = executor.stats()
+    assert (stats["queued"], stats["cancelled"], stats["completed"], stats["rejected"]) == (0, 1, 2, 0)
+
+
+# ========== SINGLE WRITER ==========
+
+def test_writer_group_commits_and_isolates_failures(db_path):
+    writer = SQLiteWriter(db_path, max_delay = 0.05).start()
+    def insert(name):
+        def job(conn, cursor):
+            with conn:  # commits only the job's savepoint; the writer commits the group
+                cursor.execute("INSERT INTO tags(tag_name) VALUES (?)", (name,))
+            if name == "bad":
+                raise ValueError("rejected")
+            return cursor.lastrowid
+        return job
+
+    try:
+        futures = [writer.submit(insert(name)) for name in ("a", "bad", "b", "c")]
+        assert isinstance(futures[1].exception(timeout = 5), ValueError)
+        ids = [futures[i].result(timeout = 5) for i in (0, 2, 3)]
+    finally:
+        writer.stop()
+
+    check = sqlite3.connect(db_path)
+    rows = check.execute("SELECT id, tag_name FROM tags ORDER BY id").fetchall()
+    check.close()
+    assert [name for _, name in rows] == ["a", "b", "c"]
+    assert [row_id for row_id, _ in rows] == ids
+    stats = writer.stats()
+    assert (stats["jobs"], stats["failed"], stats["batches"]) == (4, 1, 1)
+
+def test_writer_retries_begin_while_another_connection_writes(db_path):
+    writer = SQLiteWriter(db_path, begin_retries = 6, begin_backoff = 0.02,
+                          profile = storage_profile(busy_timeout = 0)).start()
+    other = sqlite3.connect(db_path, check_same_thread = False)
+    other.execute("BEGIN IMMEDIATE")
+    timer = threading.Timer(0.1, other.commit)
+    timer.start()
+    try:
+        writer.call(lambda conn, cursor: cursor.execute("INSERT INTO tags(tag_name) VALUES ('late')"))
+    finally:
+        timer.join()
+        other.close()
+        writer.stop()
+    stats = writer.stats()
+    assert stats["busy_retries"] > 0
+    assert (stats["jobs"], stats["failed"], stats["failed_commits"]) == (1, 0, 0)
+
+def test_writer_serializes_concurrent_writers(db_path):
+    writer = SQLiteWriter(db_path).start()
+    errors = []
+    def client(n):
+        try:
+            for i in range(20):
+                writer.call(lambda conn, cursor: cursor.execute(
+                    "INSERT INTO tags(tag_name) VALUES (?)", (f"t{n}-{i}",)))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target = client, args = (n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    writer.stop()
+
+    assert errors == []
+    check = sqlite3.connect(db_path)
+    assert check.execute("SELECT COUNT(*) FROM tags").fetchone()[0] == 160
+    check.close()
+    assert writer.stats()["batches"] <= 160
+
+
+# ========== QUERY INSTRUMENTATION ==========
+
+@pytest.fixture
+def stats():
+    enabled, slow_ms = query_stats.enabled, query_stats.slow_ms
+    query_stats.enabled = True
+    query_stats.reset()
+    yield query_stats
+    query_stats.enabled, query_stats.slow_ms = enabled, slow_ms
+    query_stats.reset()
+
+def test_normalize_sql():
+    assert normalize_sql("SELECT *  FROM t\n WHERE id IN (?, ?, ?) AND name = 'x' AND n > 10") == \
+        "SELECT * FROM t WHERE id IN (...) AND name = ? AND n > ?"
+    assert normalize_sql("INSERT INTO t VALUES (?, ?), (?, ?)") == "INSERT INTO t VALUES (...), ..."
+
+def test_instrumented_cursor_aggregates_and_logs_slow_queries(db_path, stats, caplog):
+    conn = sqlite3.connect(db_path, factory = InstrumentedConnection)
+    cursor = conn.cursor()
+    cursor.executemany("INSERT INTO tags(tag_name) VALUES (?)", [("a",), ("b",), ("c",)])
+    for tag_id in (1, 2):
+        cursor.execute("SELECT tag_name FROM tags WHERE id = ?", (tag_id,)).fetchall()
+    conn.execute("SELECT COUNT(*) FROM tags WHERE id IN (1, 2)").fetchone()
+
+    snapshot = stats.snapshot(sort = "calls")
+    by_sql = {s["sql"]: s for s in snapshot["statements"]}
+    select = by_sql["SELECT tag_name FROM tags WHERE id = ?"]
+    assert (select["calls"], select["rows"]) == (2, 2)
+    assert select["sites"][0].startswith("database/test_database.py:")
+    assert by_sql["INSERT INTO tags(tag_name) VALUES (?)"]["rows"] == 3
+    assert "SELECT COUNT(*) FROM tags WHERE id IN (...)" in by_sql
+    assert snapshot["slow"] == []
+
+    stats.slow_ms = 0
+    with caplog.at_level("WARNING"):
+        cursor.execute("SELECT tag_name FROM tags WHERE tag_name = ?", ("b",)).fetchall()
+    slow = stats.snapshot()["slow"][0]
+    assert slow["sql"] == "SELECT tag_name FROM tags WHERE tag_name = ?"
+    assert any("idx_tag_name" in step or "sqlite_autoindex" in step for step in slow["plan"])
+    assert "Slow query" in caplog.text
+    conn.close()
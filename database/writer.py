@@ -0,0 +1,315 @@
+import sqlite3
+import time
+import queue
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+import config
+from database.storage import apply_storage_profile
+from database.executor import ExecutorSaturated
+from database.connection import run_commit_hooks
+from database.instrument import InstrumentedConnection
+
+
+class WriterClosed(Exception):
+    pass
+
+
+class WriterConnection(InstrumentedConnection):
+    """
+    Connection used by the writer thread. While a job runs, commit() / `with conn:` only end the
+    job's own savepoint and rollback() undoes just that job, so CRUD functions that commit for
+    themselves can run unchanged inside a group transaction that the writer commits.
+    """
+
+    in_job = False
+
+    def commit(self):
+        if not self.in_job:
+            super().commit()
+
+    def rollback(self):
+        if self.in_job:
+            self.execute("ROLLBACK TO write_job")
+        else:
+            super().rollback()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+
+class _Job:
+    __slots__ = ("func", "future", "queued")
+
+    def __init__(self, func):
+        self.func = func
+        self.future = Future()
+        self.queued = time.monotonic()
+
+
+class SQLiteWriter:
+    """
+    Single writer for one database file: write jobs from every handler are queued and run, in
+    order, on one connection by one thread, so request writes never contend with each other for
+    SQLite's write lock. Writes on other connections still do: lock routes (lock lane), the
+    maintenance run, the lock reaper and anything run with PM_WRITER_ENABLED=0. When one of them
+    holds the lock past busy_timeout, BEGIN is retried with backoff (begin_retries times) before
+    the batch fails. Bulk imports go through the writer one chunk per job for the same reason.
+    Jobs that arrive while a transaction is being committed are run together in the next one
+    (group commit, at most max_batch per transaction), each inside its own savepoint: a job that
+    raises is rolled back alone and its caller gets the exception. Results are handed back only
+    after the transaction has committed.
+
+    A job is func(conn, cursor) -> result. It must not wait on other jobs or sleep.
+    """
+
+    def __init__(self, db_name, max_batch = config.WRITER_MAX_BATCH, max_delay = config.WRITER_MAX_DELAY,
+                 max_queue = config.WRITER_MAX_QUEUE, begin_retries = config.WRITER_BEGIN_RETRIES,
+                 begin_backoff = config.WRITER_BEGIN_BACKOFF, profile = None):
+        self.db_name = db_name
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_queue = max_queue
+        self.begin_retries = begin_retries
+        self.begin_backoff = begin_backoff
+        self.profile = profile
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target = self._run, name = "db-writer", daemon = True)
+
+        self._jobs = 0
+        self._failed = 0
+        self._rejected = 0
+        self._batches = 0
+        self._max_batch_seen = 0
+        self._failed_commits = 0
+        self._busy_retries = 0
+        self._wait_time = 0.0
+        self._commit_time = 0.0
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    # Submitting jobs
+
+    def submit(self, func):
+        # Queue func(conn, cursor); returns a concurrent.futures.Future with its result
+        with self._lock:
+            if self._closed:
+                raise WriterClosed("Writer is stopped")
+            if self._queue.qsize() >= self.max_queue:
+                self._rejected += 1
+                raise ExecutorSaturated(f"Write queue is full ({self.max_queue} jobs)")
+            job = _Job(func)
+            self._queue.put(job)
+        return job.future
+
+    async def run(self, func):
+        return await asyncio.wrap_future(self.submit(func))
+
+    def call(self, func):
+        # Blocking submit for code that is not async
+        return self.submit(func).result()
+
+    # Writer thread
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_name, check_same_thread = False, factory = WriterConnection)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        apply_storage_profile(conn, self.profile)
+        return conn
+
+    def _next_batch(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                remaining = deadline - time.monotonic()
+                job = self._queue.get(timeout = remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                self._queue.put(None)  # stop after this batch
+                break
+            batch.append(job)
+        return batch
+
+    def _run(self):
+        try:
+            conn = self._connect()
+        except Exception as e:
+            logging.error(f"Writer could not open {self.db_name}: {e}", exc_info = True)
+            with self._lock:
+                self._closed = True
+            while not self._queue.empty():
+                job = self._queue.get_nowait()
+                if job is not None and job.future.set_running_or_notify_cancel():
+                    job.future.set_exception(e)
+            return
+        try:
+            while True:
+                job = self._queue.get()
+                if job is None:
+                    break
+                self._run_batch(conn, self._next_batch(job))
+        finally:
+            conn.close()
+
+    def _begin(self, cursor):
+        # BEGIN IMMEDIATE, retried with backoff while another connection holds the write lock
+        delay = self.begin_backoff
+        for attempt in range(self.begin_retries + 1):
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as e:
+                if attempt == self.begin_retries or e.sqlite_errorcode != sqlite3.SQLITE_BUSY:
+                    raise
+                with self._lock:
+                    self._busy_retries += 1
+                logging.warning(f"Writer BEGIN found the database locked; retrying in {delay:.3f}s")
+                time.sleep(delay)
+                delay *= 2
+
+    def _run_batch(self, conn, batch):
+        batch = [job for job in batch if job.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        started = time.monotonic()
+        cursor = conn.cursor()
+        outcomes = []
+        try:
+            self._begin(cursor)
+            for job in batch:
+                cursor.execute("SAVEPOINT write_job")
+                conn.in_job = True
+                try:
+                    outcomes.append((job, job.func(conn, cursor), None))
+                except BaseException as e:
+                    conn.in_job = False
+                    cursor.execute("ROLLBACK TO write_job")
+                    outcomes.append((job, None, e))
+                finally:
+                    conn.in_job = False
+                    cursor.execute("RELEASE write_job")
+            conn.commit()
+        except BaseException as e:
+            # The transaction itself failed (e.g. BEGIN or COMMIT): nothing in the batch was written
+            logging.error(f"Write batch of {len(batch)} jobs failed: {e}", exc_info = True)
+            if conn.in_transaction:
+                conn.rollback()
+            outcomes = [(job, None, e) for job in batch]
+            with self._lock:
+                self._failed_commits += 1
+        finally:
+            cursor.close()
+            run_commit_hooks(conn)
+
+        finished = time.monotonic()
+        with self._lock:
+            self._batches += 1
+            self._jobs += len(batch)
+            self._max_batch_seen = max(self._max_batch_seen, len(batch))
+            self._failed += sum(1 for _, _, error in outcomes if error is not None)
+            self._wait_time += sum(started - job.queued for job in batch)
+            self._commit_time += finished - started
+        for job, result, error in outcomes:
+            if error is None:
+                job.future.set_result(result)
+            else:
+                job.future.set_exception(error)
+
+    # Introspection / shutdown
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "max_queue": self.max_queue,
+                "jobs": self._jobs,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "batches": self._batches,
+                "avg_batch": round(self._jobs / self._batches, 2) if self._batches else 0.0,
+                "max_batch": self._max_batch_seen,
+                "failed_commits": self._failed_commits,
+                "busy_retries": self._busy_retries,
+                "avg_wait": round(self._wait_time / self._jobs, 6) if self._jobs else 0.0,
+                "transaction_time": round(self._commit_time, 6),
+            }
+
+    def stop(self, timeout = 5):
+        # Finish the queued jobs, then close the connection
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+
+class InlineWriter:
+    """Writer interface over an existing connection, running each job synchronously; for tests."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._lock = threading.Lock()
+
+    def submit(self, func):
+        future = Future()
+        with self._lock:
+            cursor = self.conn.cursor()
+            try:
+                future.set_result(func(self.conn, cursor))
+                self.conn.commit()
+            except BaseException as e:
+                self.conn.rollback()
+                future.set_exception(e)
+            finally:
+                cursor.close()
+                run_commit_hooks(self.conn)
+        return future
+
+    async def run(self, func):
+        return await asyncio.wrap_future(self.submit(func))
+
+    def call(self, func):
+        return self.submit(func).result()
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+def get_writer(db_name = config.DB_NAME):
+    # Process-wide writer for db_name, started on first use
+    with _writers_lock:
+        writer = _writers.get(db_name)
+        if writer is None:
+            writer = _writers[db_name] = SQLiteWriter(db_name).start()
+        return writer
+
+def get_db_writer():
+    # Dependency: the writer for the application database (tests override it with an InlineWriter)
+    return get_writer(config.DB_NAME)
+
+def writer_stats():
+    with _writers_lock:
+        writers = dict(_writers)
+    return {db_name: writer.stats() for db_name, writer in writers.items()}
+
+def stop_writers():
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.stop()
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, field_validator, StrictStr
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Any
 
 class ProductBase(BaseModel):
     ref_num: StrictStr
@@ -42,6 +42,21 @@ class QuoteDetail(BaseModel):
             raise ValueError(f"{info.field_name} must be zero or positive")
         return v
 
+class QuoteRow(BaseModel):
+    # One row of a bulk quote upload; the product by product_id or ref_num
+    product_id: Optional[int] = None
+    ref_num: Optional[StrictStr] = None
+    customer: Optional[StrictStr] = None    # may instead be given once for the whole upload
+    quote: float
+    remark: Optional[str] = None
+    timestamp: Optional[str] = None         # ISO date / datetime for back-dated price lists; default now
+
+    @field_validator ("quote")
+    def non_negative(cls, v, info):
+        if v < 0:
+            raise ValueError(f"{info.field_name} must be zero or positive")
+        return v
+
 class ProductCreate(ProductBase):
     customers: Optional[List[StrictStr]] = None
     quote: Optional[Dict[str, QuoteDetail]] = None
@@ -83,6 +98,7 @@ class ProductUpdate(BaseModel):
     price_rmb: Optional[float] = None
     remarks: Optional[str] = None
     packing: Optional[str] = None
+    expected_version: Optional[int] = None   # reject the edit (412) unless the product is still at this version
 
 
 # View models
@@ -105,16 +121,117 @@ class QuoteOut(BaseModel):
     customer_name: str
     quote: float
     quote_remark: Optional[str]
+    timestamp: Optional[str] = None
+
+class QuotePoint(BaseModel):
+    customer_id: int
+    customer_name: str
+    period: str                         # quote timestamp, or the first day of the bucket
+    quote: Optional[float]              # last quote in the period
+    count: int = 1
+    quote_id: Optional[int] = None      # raw history only
+    quote_remark: Optional[str] = None
+    open: Optional[float] = None        # downsampled history only
+    low: Optional[float] = None
+    high: Optional[float] = None
+    avg: Optional[float] = None
+
+class QuoteHistory(BaseModel):
+    product_id: int
+    bucket: Optional[str] = None
+    since: Optional[str] = None
+    until: Optional[str] = None
+    points: List[QuotePoint]
+    truncated: bool                     # older points were left out to stay within limit
+
+class QuoteStats(BaseModel):
+    count: int
+    min: Optional[float] = None
+    max: Optional[float] = None
+    avg: Optional[float] = None
+    median: Optional[float] = None
+    p10: Optional[float] = None
+    p90: Optional[float] = None
+
+class CustomerQuoteStats(BaseModel):
+    customer_id: int
+    customer_name: str
+    products: int
+    quotes: QuoteStats
+    margin: QuoteStats                  # (quote - price) / quote, for products that have a price
+
+class QuoteSummary(BaseModel):
+    history: bool                       # every quote, not just the current ones
+    currency: str                       # price column the margins are taken against
+    generation: int
+    overall: QuoteStats
+    overall_margin: QuoteStats
+    customers: List[CustomerQuoteStats]
+
+class DriftPoint(BaseModel):
+    period: str
+    ratio: QuoteStats                   # quote / first quote for the same product and customer
+
+class QuoteDrift(BaseModel):
+    bucket: str
+    customer_id: Optional[int] = None
+    since: Optional[str] = None
+    until: Optional[str] = None
+    generation: int
+    points: List[DriftPoint]
 
 class Product(ProductBase):
     id: int
+    version: Optional[int] = None
+    last_updated: Optional[str] = None
     customers: Optional[List[CustomerOut]] = None
     tags: Optional[List[TagOut]] = None
     imgs: Optional[List[ImageOut]] = None
     quote: Optional[List[QuoteOut]] = None
 
+
+class BulkCreated(BaseModel):
+    index: int
+    id: int
+    ref_num: str
+
+class BulkError(BaseModel):
+    index: int
+    ref_num: Optional[str] = None
+    error: str
+
+class BulkResult(BaseModel):
+    created: List[BulkCreated]
+    errors: List[BulkError]
+
+class BulkQuoteResult(BaseModel):
+    created: int
+    errors: List[BulkError]
+
+class ChangeFeed(BaseModel):
+    upserted: List[int]
+    deleted: List[int]
+    products: Optional[List[Product]] = None   # hydrated upserted products when requested
+    next_token: str
+    has_more: bool
+
+class ProductPage(BaseModel):
+    # items are full Product dicts, or only the requested base columns when fields= is set
+    items: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None
+
     
 # Lock status
 
 class LockStatus(BaseModel):
-    locked: bool
\ No newline at end of file
+    locked: bool
+
+class BulkLock(BaseModel):
+    product_ids: List[int]
+    user: StrictStr
+    locked: bool = True
+    wait: float = 0      # seconds to keep retrying while another user holds one of the products
+
+class BulkLockResult(BaseModel):
+    product_ids: List[int]   # locked, or actually released
+    locked_by: Optional[str] = None
\ No newline at end of file